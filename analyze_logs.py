@@ -11,87 +11,47 @@ This tool analyzes audit logs from the AI Gateway to provide insights into:
 
 import argparse
 import json
-import re
 from datetime import datetime, timedelta
 from pathlib import Path
 from collections import defaultdict, Counter
 from typing import Dict, List, Optional, Tuple
 import sys
 
+# The audit record reader is shared with the gateway's dashboard API
+sys.path.insert(0, str(Path(__file__).resolve().parent / "api-gatekeeper"))
+import audit_format  # noqa: E402
+
 class AuditLogAnalyzer:
     """Analyzes AI Gateway audit logs for security and usage insights."""
 
     def __init__(self, log_file: str):
         self.log_file = Path(log_file)
-        self.log_pattern = re.compile(
-            r'(?P<timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \| '
-            r'(?P<level>\w+) \| '
-            r'(?P<event>\w+) \| '
-            r'(?P<method>\w+) '
-            r'(?P<endpoint>/[^\|]*) \|'
-            r'(?P<details>.*)'
-        )
 
     def parse_logs(self, hours_back: Optional[int] = None) -> List[Dict]:
-        """Parse audit logs and return structured data."""
+        """Parse audit logs (legacy text or JSONL) and return structured data."""
         if not self.log_file.exists():
             print(f"❌ Log file not found: {self.log_file}")
             return []
 
-        cutoff_time = None
+        since_ms = None
         if hours_back:
-            cutoff_time = datetime.now() - timedelta(hours=hours_back)
+            since_ms = int((datetime.now() - timedelta(hours=hours_back)).timestamp() * 1000)
 
         logs = []
         try:
-            with open(self.log_file, 'r') as f:
-                for line_num, line in enumerate(f, 1):
-                    try:
-                        match = self.log_pattern.match(line.strip())
-                        if not match:
-                            continue
-
-                        timestamp_str = match.group('timestamp')
-                        timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-
-                        # Skip entries older than cutoff
-                        if cutoff_time and timestamp < cutoff_time:
-                            continue
-
-                        log_entry = {
-                            'timestamp': timestamp,
-                            'level': match.group('level'),
-                            'event': match.group('event'),
-                            'method': match.group('method'),
-                            'endpoint': match.group('endpoint'),
-                            'details': match.group('details').strip(),
-                            'line_num': line_num
-                        }
-
-                        # Parse additional details
-                        details = log_entry['details']
-
-                        # Extract IP address
-                        ip_match = re.search(r'IP: ([\d\.]+|unknown)', details)
-                        log_entry['ip'] = ip_match.group(1) if ip_match else 'unknown'
-
-                        # Extract user and service for authorized requests
-                        if log_entry['event'] == 'AUTHORIZED':
-                            user_match = re.search(r'User: ([^\|]+)', details)
-                            service_match = re.search(r'Service: ([^\|]+)', details)
-                            log_entry['user'] = user_match.group(1).strip() if user_match else 'unknown'
-                            log_entry['service'] = service_match.group(1).strip() if service_match else 'unknown'
-
-                        # Extract partial key for unauthorized requests
-                        elif log_entry['event'] == 'UNAUTHORIZED':
-                            key_match = re.search(r'Key: ([^\|]+)', details)
-                            log_entry['key_partial'] = key_match.group(1).strip() if key_match else 'missing'
-
-                        logs.append(log_entry)
-
-                    except Exception as e:
-                        print(f"⚠️  Warning: Failed to parse line {line_num}: {e}")
-                        continue
+            for entry in audit_format.iter_entries(str(self.log_file), since_ms=since_ms):
+                log_entry = dict(entry)
+                log_entry['timestamp'] = datetime.fromtimestamp(entry['ts'] / 1000)
+                log_entry['details'] = audit_format.format_details(entry)
+                log_entry.setdefault('method', '')
+                log_entry.setdefault('endpoint', '')
+                log_entry.setdefault('ip', 'unknown')
+                if log_entry['event'] == 'AUTHORIZED':
+                    log_entry.setdefault('user', 'unknown')
+                    log_entry.setdefault('service', 'unknown')
+                elif log_entry['event'] == 'UNAUTHORIZED':
+                    log_entry.setdefault('key_partial', 'missing')
+                logs.append(log_entry)
 
         except Exception as e:
             print(f"❌ Error reading log file: {e}")
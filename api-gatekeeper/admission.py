@@ -0,0 +1,193 @@
+"""
+Admission control for expensive backends (image generation, transcription).
+
+Each limiter admits a fixed number of concurrent requests; extra requests
+wait in a bounded FIFO queue up to a deadline. A full queue is rejected with
+429 and an expired wait with 503, both carrying Retry-After, so bursts queue
+briefly instead of all hitting a CPU-bound backend at once.
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import metrics
+
+
+def _env_setting(name, setting, default, cast):
+    value = os.environ.get(f"ADMISSION_{name.upper().replace('-', '_')}_{setting}")
+    return cast(value) if value is not None else default
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; carries the HTTP status and Retry-After."""
+
+    def __init__(self, status_code, message, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """A queued request; woken by a thread event or, for async callers, a future."""
+
+    def __init__(self, loop=None):
+        self.arrived = time.monotonic()
+        self.admitted_at = None
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def grant(self, admitted_at):
+        self.admitted_at = admitted_at
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class ConcurrencyLimiter:
+    """
+    Concurrency limit with a bounded FIFO wait queue and a queue-time deadline.
+
+    Freed slots are handed directly to the oldest waiter, so a request that
+    arrives while others are queued cannot jump ahead of them. Threaded
+    (Flask) and asyncio (ASGI) callers share the same queue.
+
+    Args:
+        name (str): Limiter name, used for metrics and ADMISSION_<NAME>_* overrides
+        concurrency (int): Requests allowed to run at once
+        max_queue (int): Requests allowed to wait; more are rejected with 429
+        queue_timeout (float): Seconds a request may wait before a 503
+    """
+
+    def __init__(self, name, concurrency, max_queue, queue_timeout):
+        self.name = name
+        self.concurrency = _env_setting(name, "CONCURRENCY", concurrency, int)
+        self.max_queue = _env_setting(name, "QUEUE", max_queue, int)
+        self.queue_timeout = _env_setting(name, "QUEUE_TIMEOUT", queue_timeout, float)
+
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self.active = 0
+        self._avg_hold = None
+
+        self._queue_depth = metrics.gauge("admission_queue_depth", limiter=name)
+        self._active_gauge = metrics.gauge("admission_active", limiter=name)
+        self._wait_time = metrics.summary("admission_wait_seconds", limiter=name)
+
+    def acquire(self):
+        """Block until admitted and return the admit time, or raise AdmissionRejected."""
+        waiter = _Waiter()
+        if self._enqueue(waiter):
+            return waiter.admitted_at
+        if not waiter.event.wait(self.queue_timeout) and not self._abandon(waiter):
+            raise self._timed_out()
+        return waiter.admitted_at
+
+    async def acquire_async(self):
+        """Async counterpart of acquire() that waits without holding a thread."""
+        waiter = _Waiter(asyncio.get_running_loop())
+        if self._enqueue(waiter):
+            return waiter.admitted_at
+        try:
+            await asyncio.wait_for(waiter.future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not self._abandon(waiter):
+                raise self._timed_out()
+        except asyncio.CancelledError:
+            # Client went away; hand back a slot granted in the meantime
+            if self._abandon(waiter):
+                self.release(waiter.admitted_at)
+            raise
+        return waiter.admitted_at
+
+    def release(self, admitted_at):
+        """Free the slot taken by the request admitted at admitted_at."""
+        held = time.monotonic() - admitted_at
+        with self._lock:
+            self.active -= 1
+            self._active_gauge.set(self.active)
+            # Exponential moving average of how long requests hold a slot
+            self._avg_hold = held if self._avg_hold is None else 0.8 * self._avg_hold + 0.2 * held
+            self._grant_waiting()
+
+    def _enqueue(self, waiter):
+        """Admit waiter now (returns True), queue it (returns False) or reject a full queue."""
+        with self._lock:
+            if self.active < self.concurrency and not self._waiters:
+                self._admit(waiter)
+                return True
+            if len(self._waiters) >= self.max_queue:
+                metrics.counter("admission_rejected_total", limiter=self.name, reason="queue_full").inc()
+                raise AdmissionRejected(429, f"Too many queued {self.name} requests",
+                                        self._retry_after(len(self._waiters)))
+            self._waiters.append(waiter)
+            self._queue_depth.set(len(self._waiters))
+            return False
+
+    def _abandon(self, waiter):
+        """Stop waiting; True if the slot was granted before we gave up."""
+        with self._lock:
+            if waiter.admitted_at is not None:
+                return True
+            self._waiters.remove(waiter)
+            self._queue_depth.set(len(self._waiters))
+            return False
+
+    def _timed_out(self):
+        metrics.counter("admission_rejected_total", limiter=self.name, reason="queue_timeout").inc()
+        with self._lock:
+            queued = len(self._waiters)
+        return AdmissionRejected(503, f"Timed out waiting for a {self.name} slot", self._retry_after(queued))
+
+    def _grant_waiting(self):
+        # Called with the lock held
+        while self._waiters and self.active < self.concurrency:
+            waiter = self._waiters.popleft()
+            waiter.grant(self._admit(waiter))
+        self._queue_depth.set(len(self._waiters))
+
+    def _admit(self, waiter):
+        # Called with the lock held
+        now = time.monotonic()
+        self.active += 1
+        self._active_gauge.set(self.active)
+        self._wait_time.observe(now - waiter.arrived)
+        waiter.admitted_at = now
+        return now
+
+    def _retry_after(self, queued):
+        """Estimate seconds until a retry could be admitted from the average hold time."""
+        avg_hold = self._avg_hold or 1.0
+        return max(1, math.ceil(avg_hold * (queued + 1) / self.concurrency))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "active": self.active,
+                "queued": len(self._waiters),
+                "max_queue": self.max_queue,
+                "queue_timeout": self.queue_timeout,
+                "avg_hold_seconds": round(self._avg_hold, 3) if self._avg_hold is not None else None
+            }
+
+
+def rejection_body(rejected):
+    """JSON body for a rejected request, shared by the Flask and ASGI responses."""
+    return {
+        "error": "Too many requests" if rejected.status_code == 429 else "Service busy",
+        "message": rejected.message,
+        "retry_after": rejected.retry_after
+    }
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, Response, stream_with_context, redirect
+from flask import Flask, request, jsonify, Response, stream_with_context, redirect, g
 from flask_cors import CORS
 import requests
 import os
@@ -6,12 +6,27 @@ import json
 import logging
 from functools import wraps
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
 import base64
 import firebase_admin
-from firebase_admin import credentials, auth as firebase_auth
+from firebase_admin import credentials
 import uuid
 import time
+import random
+from upstream_pool import upstream_pool
+from metrics import metrics
+from streaming import BULK, policy_for, iter_response, metered, StreamMeter
+from load_balancer import BackendPool, extract_model, upstream_failed
+from circuit_breaker import BREAKER_SLOW_CALL_SECONDS, breakers
+from health_check import health_prober
+from admission import ConcurrencyLimiter, AdmissionRejected, rejection_body
+from rate_limiter import rate_limiter
+from key_store import create_key_store, NegativeCache
+from temp_key_store import create_temp_key_store, TempKeyLimitExceeded
+import firebase_tokens
+from audit_log import AuditLogWriter
+import audit_format
+from audit_format import AuditRecord
+from audit_rollup import rollup_store
 
 # Configuration
 API_KEYS_FILE = os.environ.get("API_KEYS_FILE", "caddy_apikeys.json")
@@ -19,6 +34,30 @@ LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
 AUDIT_LOG_FILE = os.environ.get("AUDIT_LOG_FILE", "/var/log/ai-gateway/audit.log")
 FIREBASE_SERVICE_ACCOUNT = os.environ.get("FIREBASE_SERVICE_ACCOUNT", "/app/firebase-service-account.json")
 
+# Upstream services
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://host.docker.internal:11434")
+EDGE_TTS_URL = os.environ.get("EDGE_TTS_URL", "http://edge-tts:8090")
+STABLE_DIFFUSION_URL = os.environ.get("STABLE_DIFFUSION_URL", "http://localhost:7860")
+WHISPER_URL = os.environ.get("WHISPER_URL", "http://localhost:8092")
+DASHBOARD_WEB_URL = os.environ.get("DASHBOARD_WEB_URL", "http://ai-gateway-web:3000")
+
+# Ollama nodes to balance chat traffic across (comma-separated, defaults to OLLAMA_URL)
+OLLAMA_BACKENDS = [url.strip() for url in os.environ.get("OLLAMA_BACKENDS", OLLAMA_URL).split(",") if url.strip()]
+OLLAMA_EJECT_AFTER = int(os.environ.get("OLLAMA_EJECT_AFTER", "3"))
+OLLAMA_EJECT_SECONDS = float(os.environ.get("OLLAMA_EJECT_SECONDS", "30"))
+OLLAMA_MODELS_REFRESH = float(os.environ.get("OLLAMA_MODELS_REFRESH", "15"))
+
+# Block size used when streaming chunked request bodies upstream
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+# Sampled payload/header logging for proxied chat requests (0 disables, 1 logs every request)
+PROXY_DEBUG_SAMPLE_RATE = float(os.environ.get("PROXY_DEBUG_SAMPLE_RATE", "0"))
+PROXY_DEBUG_MAX_PAYLOAD = int(os.environ.get("PROXY_DEBUG_MAX_PAYLOAD", "2000"))
+REDACTED_HEADERS = {'authorization', 'cookie', 'x-firebase-token'}
+
+# How much of an upstream error body is copied into the application log
+ERROR_LOG_PREFIX_BYTES = int(os.environ.get("ERROR_LOG_PREFIX_BYTES", "500"))
+
 # Setup application logging
 logging.basicConfig(
     level=getattr(logging, LOG_LEVEL),
@@ -26,6 +65,50 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Register upstreams with the shared connection pool manager
+# (the Ollama pool registers one upstream per node)
+ollama_backends = BackendPool(
+    "ollama",
+    OLLAMA_BACKENDS,
+    eject_after=OLLAMA_EJECT_AFTER,
+    eject_seconds=OLLAMA_EJECT_SECONDS,
+    models_path="/api/ps",
+    models_refresh=OLLAMA_MODELS_REFRESH
+)
+upstream_pool.register("edge-tts", EDGE_TTS_URL)
+upstream_pool.register("stable-diffusion", STABLE_DIFFUSION_URL)
+# CPU image generation is legitimately slow; only near-timeout calls count as slow
+breakers.configure("stable-diffusion", slow_call_seconds=110)
+upstream_pool.register("whisper", WHISPER_URL)
+upstream_pool.register("dashboard-web", DASHBOARD_WEB_URL, pool_size=50, read_timeout=30)
+# Non-streaming chat completions and transcriptions only send headers once the work
+# is done, so a long one on a healthy node is not slow until it nears the read timeout
+for name in ["whisper"] + [backend.name for backend in ollama_backends.backends]:
+    breakers.configure(name, slow_call_seconds=max(upstream_pool.get(name).read_timeout - 10,
+                                                   BREAKER_SLOW_CALL_SECONDS))
+
+# Active health checks, probed in the background for /api/dashboard/services;
+# failing Ollama nodes are also taken out of the balancer's rotation
+health_prober.register("caddy", "Caddy Proxy", container="ai-gateway-caddy", port=443)
+health_prober.register("api-gatekeeper", "API Gateway", container="ai-gateway-api-gatekeeper", port=8080)
+health_prober.register("edge-tts", "Edge TTS", url=f"{EDGE_TTS_URL}/health", container="edge-tts",
+                       upstream="edge-tts")
+health_prober.register("stable-diffusion", "Stable Diffusion", url=f"{STABLE_DIFFUSION_URL}/health",
+                       container="ai-gateway-stable-diffusion", upstream="stable-diffusion")
+health_prober.register("whisper", "Whisper", url=f"{WHISPER_URL}/health", container="ai-gateway-whisper",
+                       upstream="whisper")
+for backend in ollama_backends.backends:
+    health_prober.register(backend.name, "Ollama LLM" if backend.name == "ollama" else f"Ollama LLM ({backend.name})",
+                           url=f"{backend.url}/", upstream=backend.name)
+
+# Admission control for CPU-bound backends: bursts wait in a short FIFO queue
+# instead of piling onto the backend (override with ADMISSION_<NAME>_CONCURRENCY,
+# ADMISSION_<NAME>_QUEUE and ADMISSION_<NAME>_QUEUE_TIMEOUT)
+admission_limiters = {
+    "image": ConcurrencyLimiter("image", concurrency=1, max_queue=8, queue_timeout=60),
+    "whisper": ConcurrencyLimiter("whisper", concurrency=2, max_queue=16, queue_timeout=30)
+}
+
 # Initialize Firebase Admin SDK
 firebase_initialized = False
 try:
@@ -41,83 +124,103 @@ except Exception as e:
     firebase_initialized = False
 
 # Setup dedicated audit logging for security events
-audit_logger = logging.getLogger('ai_gateway_audit')
-audit_logger.setLevel(logging.INFO)
-
 # Create audit log directory if it doesn't exist
 os.makedirs(os.path.dirname(AUDIT_LOG_FILE), exist_ok=True)
 
-# Create rotating file handler for audit logs (10MB max, keep 5 files)
-audit_handler = RotatingFileHandler(
+# Audit records are queued and written in batches by a background thread
+# into hourly, indexed segments (AUDIT_ROTATION=size restores 10MB max per
+# file, keep 5 files; rotation is coordinated across workers)
+audit_writer = AuditLogWriter(
     AUDIT_LOG_FILE,
-    maxBytes=10*1024*1024,  # 10MB
-    backupCount=5
-)
-audit_formatter = logging.Formatter(
-    '%(asctime)s | %(levelname)s | %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S UTC'
+    audit_format.formatter(),  # AUDIT_FORMAT: "text" (legacy lines) or "jsonl"
+    max_bytes=10*1024*1024,  # 10MB
+    backup_count=5,
+    on_write=rollup_store.ingest  # keeps the dashboard's counters current
 )
-audit_handler.setFormatter(audit_formatter)
-audit_logger.addHandler(audit_handler)
 
-def log_request_event(event_type, endpoint, method, ip_address, key_info=None, key_partial=None, status_code=None):
+def log_request_event(event_type, endpoint, method, ip_address, key_info=None, key_partial=None, status_code=None,
+                      latency_ms=None, ttfb_ms=None, upstream_ms=None, bytes_sent=None, upstream=None):
     """
     Log security-relevant request events to audit log.
 
+    Only queues a compact record; formatting and disk I/O happen on the
+    audit writer thread, so this never waits on the disk.
+
     Args:
-        event_type (str): Type of event (AUTHORIZED, UNAUTHORIZED, ERROR)
+        event_type (str): Type of event (AUTHORIZED, UNAUTHORIZED, RATE_LIMITED, ERROR)
         endpoint (str): The requested endpoint
         method (str): HTTP method
         ip_address (str): Client IP address
         key_info (dict, optional): Key metadata for authorized requests
         key_partial (str, optional): Partial key for unauthorized requests
         status_code (int, optional): HTTP response status code
+        latency_ms (float, optional): Total time until the response was sent
+        ttfb_ms (float, optional): Time until the first response byte
+        upstream_ms (float, optional): Time spent waiting on the upstream
+        bytes_sent (int, optional): Response body bytes sent
+        upstream (str, optional): Upstream URL that served the request
     """
     try:
-        log_data = {
-            'event': event_type,
-            'method': method,
-            'endpoint': endpoint,
-            'client_ip': ip_address or 'unknown',
-            'timestamp': datetime.utcnow().isoformat() + 'Z'
-        }
-
+        user = service = 'unknown'
         if key_info:
-            log_data.update({
-                'user': key_info.get('user', 'unknown'),
-                'service': key_info.get('service', 'unknown'),
-                'key_created': key_info.get('created_at', 'unknown')
-            })
+            user = key_info.get('user', 'unknown')
+            service = key_info.get('service', 'unknown')
+
+        audit_writer.emit(AuditRecord(time.time(), event_type, method, endpoint, ip_address or 'unknown',
+                                      user, service, key_partial, status_code,
+                                      latency_ms, ttfb_ms, upstream_ms, bytes_sent, upstream))
 
-        if key_partial:
-            log_data['key_partial'] = key_partial
+    except Exception as e:
+        logger.error(f"Failed to write audit log: {e}")
 
-        if status_code:
-            log_data['status_code'] = status_code
+def _ms(seconds):
+    return round(seconds * 1000, 1)
 
-        # Format log message
-        if event_type == "AUTHORIZED":
-            message = f"AUTHORIZED | {method} {endpoint} | User: {log_data.get('user', 'unknown')} | Service: {log_data.get('service', 'unknown')} | IP: {log_data['client_ip']}"
-        elif event_type == "UNAUTHORIZED":
-            key_info_str = f" | Key: {key_partial}" if key_partial else ""
-            message = f"UNAUTHORIZED | {method} {endpoint} | IP: {log_data['client_ip']}{key_info_str}"
-        else:
-            message = f"{event_type} | {method} {endpoint} | IP: {log_data['client_ip']} | Status: {status_code}"
+def log_request_completion(endpoint, method, ip_address, key_info, status_code, started,
+                           meter=None, content_length=None):
+    """
+    Log the AUTHORIZED event of a request once its response has been sent.
 
-        audit_logger.info(message)
+    Called when the response closes, so the event carries the real status,
+    total latency and, for proxied requests, time-to-first-byte, upstream
+    time, bytes streamed and the upstream URL taken from the StreamMeter.
 
-    except Exception as e:
-        logger.error(f"Failed to write audit log: {e}")
+    Args:
+        started (float): perf_counter() when the request reached the gateway
+        meter (StreamMeter, optional): Meter of the relayed upstream response
+        content_length (int, optional): Body size of a response that was not relayed
+    """
+    finished = time.perf_counter()
+    ttfb_ms = upstream_ms = upstream = None
+    bytes_sent = content_length
+    if meter is not None:
+        bytes_sent = meter.bytes
+        upstream = meter.upstream
+        if meter.first_byte_at is not None:
+            ttfb_ms = _ms(meter.first_byte_at - started)
+        upstream_ms = _ms((meter.finished_at or finished) - meter.started)
+
+    metrics.summary("request_latency_seconds", route=endpoint).observe(finished - started)
+    log_request_event("AUTHORIZED", endpoint, method, ip_address, key_info=key_info, status_code=status_code,
+                      latency_ms=_ms(finished - started), ttfb_ms=ttfb_ms, upstream_ms=upstream_ms,
+                      bytes_sent=bytes_sent, upstream=upstream)
 
 app = Flask(__name__)
 
-# Configure CORS
+# Configure CORS (shared with the ASGI engine in asgi.py)
+CORS_ORIGINS = ['http://localhost:3000', 'https://selfmind.dev', 'http://ai-gateway-web:3000']
+CORS_ALLOW_HEADERS = ['Content-Type', 'Authorization', 'X-API-Key', 'X-Requested-With', 'Accept', 'Origin']
+CORS_METHODS = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS']
+CORS_EXPOSE_HEADERS = ['Content-Type', 'Authorization', 'Retry-After', 'X-RateLimit-Limit',
+                       'X-RateLimit-Remaining', 'X-RateLimit-Reset', 'X-RateLimit-Streams-Limit',
+                       'X-RateLimit-Streams-Remaining']
+
 CORS(app,
-     origins=['http://localhost:3000', 'https://selfmind.dev', 'http://ai-gateway-web:3000'],
-     allow_headers=['Content-Type', 'Authorization', 'X-API-Key', 'X-Requested-With', 'Accept', 'Origin'],
-     methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
+     origins=CORS_ORIGINS,
+     allow_headers=CORS_ALLOW_HEADERS,
+     methods=CORS_METHODS,
      supports_credentials=True,
-     expose_headers=['Content-Type', 'Authorization'])
+     expose_headers=CORS_EXPOSE_HEADERS)
 
 # Import and register dashboard blueprint
 try:
@@ -128,74 +231,75 @@ except ImportError as e:
     logger.warning(f"Dashboard API not available: {e}")
 
 class APIKeyValidator:
-    """Centralized API key validation with caching and logging."""
+    """Centralized API key validation against a hashed in-memory index of the key store."""
 
     def __init__(self, keys_file):
         self.keys_file = keys_file
-        self._keys_cache = None
-        self._last_modified = None
-
-    def _load_keys(self):
-        """Load API keys with file modification check for cache invalidation."""
-        try:
-            file_stat = os.path.getmtime(self.keys_file)
+        # Follows the key database (or file) in the background; lookups never touch the disk
+        self.key_store = create_key_store(keys_file)
+        # Floods of bad keys are refused from here without a lookup or log line
+        self.rejected_keys = NegativeCache()
+        self._last_warning = 0.0
+        self._suppressed_warnings = 0
 
-            # Reload if file changed or cache is empty
-            if self._last_modified != file_stat or self._keys_cache is None:
-                with open(self.keys_file, "r") as f:
-                    self._keys_cache = json.load(f)
-                self._last_modified = file_stat
-                logger.info(f"API keys reloaded from {self.keys_file}")
-
-            return self._keys_cache
-        except Exception as e:
-            logger.error(f"Failed to load API keys from {self.keys_file}: {e}")
-            return {}
+    def _lookup(self, key, digest):
+        """Return metadata for key (digest is its HMAC in the key store), or None."""
+        return self.key_store.lookup(digest)
 
     def is_valid_key(self, key):
         """Validate API key and return key metadata if valid."""
         if not key or not key.strip():
             return False, None
 
-        keys = self._load_keys()
         key = key.strip()
+        digest = self.key_store.digest(key)
+        generation = self.key_store.reloads
+        if self.rejected_keys.contains(digest, generation):
+            metrics.counter("auth_rejected_keys_total", cached="true").inc()
+            return False, None
 
-        if key in keys:
-            key_info = keys[key]
-            logger.info(f"Valid API key used - User: {key_info.get('user', 'unknown')}, "
-                       f"Service: {key_info.get('service', 'unknown')}")
+        key_info = self._lookup(key, digest)
+        if key_info is not None:
             return True, key_info
 
-        logger.warning(f"Invalid API key attempted: {key[:8]}...")
+        self.rejected_keys.add(digest, generation)
+        metrics.counter("auth_rejected_keys_total", cached="false").inc()
+        self._warn_invalid(key)
         return False, None
 
-# Store temporary keys in memory (in production, use Redis or similar)
-TEMP_KEYS = {}
+    def _warn_invalid(self, key):
+        """Log invalid keys at most once per second, counting the ones suppressed."""
+        now = time.monotonic()
+        if now - self._last_warning < 1.0:
+            self._suppressed_warnings += 1
+            return
+        suppressed, self._suppressed_warnings = self._suppressed_warnings, 0
+        self._last_warning = now
+        more = f" ({suppressed} more since last warning)" if suppressed else ""
+        logger.warning(f"Invalid API key attempted: {key[:8]}...{more}")
+
+# Temporary keys live in a store shared by all workers (TEMP_KEY_STORE=memory for a local dict)
+temp_keys = create_temp_key_store()
 
 class APIKeyValidatorWithTemp(APIKeyValidator):
     """Extended validator that also checks temporary keys."""
-    
-    def is_valid_key(self, key):
-        """Validate API key, including temporary keys."""
-        # First check permanent keys
-        is_valid, key_info = super().is_valid_key(key)
-        if is_valid:
-            return is_valid, key_info
-        
-        # Check temporary keys
-        if key and key.startswith("temp_") and key in TEMP_KEYS:
-            temp_info = TEMP_KEYS[key]
-            
-            # Check if expired
-            if temp_info["expires_at"] < int(time.time() * 1000):
-                logger.warning(f"Expired temporary key attempted: {key[:20]}...")
-                del TEMP_KEYS[key]  # Clean up expired key
-                return False, None
-            
-            logger.info(f"Valid temporary API key used")
-            return True, temp_info
-        
-        return False, None
+
+    def _lookup(self, key, digest):
+        """Look up a permanent key, then a temporary one."""
+        key_info = super()._lookup(key, digest)
+        if key_info is not None or not key.startswith("temp_"):
+            return key_info
+
+        temp_info = temp_keys.get(key)
+        if temp_info is None:
+            return None
+
+        # Check if expired (the store sweeps it shortly)
+        if temp_info["expires_at"] < int(time.time() * 1000):
+            logger.warning(f"Expired temporary key attempted: {key[:20]}...")
+            return None
+
+        return temp_info
 
 # Initialize validator with temporary key support
 api_validator = APIKeyValidatorWithTemp(API_KEYS_FILE)
@@ -204,6 +308,10 @@ def require_api_key(f):
     """
     Decorator to require valid API key for route access.
 
+    Also enforces the key's rate limits (requests per second and concurrent
+    requests, shared across workers) and reports the remaining budget in
+    X-RateLimit-* response headers.
+
     Usage:
         @app.route('/protected/endpoint')
         @require_api_key
@@ -213,6 +321,7 @@ def require_api_key(f):
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
+        started = time.perf_counter()
         api_key = request.headers.get("X-API-Key", "")
         endpoint = request.path
         method = request.method
@@ -230,52 +339,229 @@ def require_api_key(f):
                 "message": "Valid API key required"
             }), 401
 
-        # Log authorized access
-        log_request_event("AUTHORIZED", endpoint, method, client_ip, key_info=key_info)
+        decision = rate_limiter.acquire(key_info)
+        if not decision.allowed:
+            log_request_event("RATE_LIMITED", endpoint, method, client_ip, key_info=key_info, status_code=429)
+
+            logger.warning(f"Rate limit ({decision.reason}) exceeded on {request.endpoint} "
+                           f"by {key_info.get('user', 'unknown')}")
+            response = jsonify({
+                "error": "Too many requests",
+                "message": "Rate limit exceeded" if decision.reason == "rate"
+                           else "Too many concurrent requests for this API key",
+                "retry_after": decision.retry_after
+            })
+            response.status_code = 429
+            response.headers.update(decision.headers())
+            return response
 
         # Store key info in Flask's g context for use in route handlers
-        from flask import g
         g.key_info = key_info
+        # Set by proxy_request so the audit event can report the upstream leg
+        g.stream_meter = None
 
-        return f(*args, **kwargs)
+        try:
+            response = app.make_response(f(*args, **kwargs))
+        except Exception:
+            rate_limiter.release(decision)
+            log_request_completion(endpoint, method, client_ip, key_info, 500, started)
+            raise
+        response.headers.update(decision.headers())
+        # The concurrent-request slot is held until the response has been sent
+        response.call_on_close(lambda: rate_limiter.release(decision))
+
+        # Authorized access is logged once the response has been sent, with its outcome
+        meter = g.stream_meter
+        status_code = response.status_code
+        content_length = response.content_length
+        response.call_on_close(lambda: log_request_completion(
+            endpoint, method, client_ip, key_info, status_code, started, meter, content_length))
+        return response
 
     return decorated_function
 
+def admission_controlled(limiter):
+    """
+    Decorator to limit a route's concurrency with an admission limiter.
+
+    Requests wait in the limiter's FIFO queue; a full queue returns 429 and
+    an expired wait 503, both with Retry-After. The slot is held until the
+    response has been sent, so streamed responses count for their whole
+    duration.
+
+    Usage:
+        @app.route('/protected/endpoint')
+        @require_api_key
+        @admission_controlled(admission_limiters["image"])
+        def protected_function():
+            ...
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            try:
+                admitted_at = limiter.acquire()
+            except AdmissionRejected as rejected:
+                logger.warning(f"Admission rejected for {request.endpoint}: {rejected.message}")
+                response = jsonify(rejection_body(rejected))
+                response.status_code = rejected.status_code
+                response.headers['Retry-After'] = str(rejected.retry_after)
+                return response
+
+            try:
+                response = app.make_response(f(*args, **kwargs))
+            except Exception:
+                limiter.release(admitted_at)
+                raise
+            response.call_on_close(lambda: limiter.release(admitted_at))
+            return response
+
+        return decorated_function
+    return decorator
+
 
-def proxy_request(target_url, timeout=120):
+class SizedRequestBody:
+    """File-like view of a request body with a known length, read in blocks by the HTTP client."""
+
+    def __init__(self, stream, length):
+        self._stream = stream
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+
+def streaming_request_body():
+    """
+    Return the incoming request body as a streaming upload for the upstream call.
+
+    Bodies with a Content-Length are forwarded with the same length; chunked
+    uploads are re-sent with chunked transfer encoding. Either way the body is
+    read from the WSGI input in blocks and never held in memory as a whole.
+    """
+    stream = request.stream
+    if request.content_length is not None:
+        return SizedRequestBody(stream, request.content_length)
+    return iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b'')
+
+
+def log_debug_sample(target_url, headers, body):
+    """Log a sampled proxied request's payload and headers (secrets redacted)."""
+    safe_headers = {
+        k: ('[redacted]' if k.lower() in REDACTED_HEADERS else v) for k, v in headers.items()
+    }
+    payload = body[:PROXY_DEBUG_MAX_PAYLOAD].decode('utf-8', errors='replace') if body else ''
+    truncated = ' (truncated)' if body and len(body) > PROXY_DEBUG_MAX_PAYLOAD else ''
+    logger.info(f"[debug sample] Proxying to {target_url} with payload{truncated}: {payload}")
+    logger.info(f"[debug sample] Headers being sent: {safe_headers}")
+
+
+def tee_error_prefix(chunks, target_url, limit=None):
+    """
+    Yield an upstream error body unchanged while logging its first bytes.
+
+    Only the first limit bytes (ERROR_LOG_PREFIX_BYTES by default) are kept
+    for the log line, so large error responses are never held in memory.
+    """
+    limit = limit or ERROR_LOG_PREFIX_BYTES
+    prefix = bytearray()
+    logged = False
+
+    def log_prefix():
+        error_body = prefix.decode('utf-8', errors='replace')
+        logger.error(f"Error response from {target_url}: {error_body}")
+
+    try:
+        for chunk in chunks:
+            if not logged:
+                prefix += chunk[:limit - len(prefix)]
+                if len(prefix) >= limit:
+                    log_prefix()
+                    logged = True
+            yield chunk
+    finally:
+        # Short bodies, or clients that disconnect before the prefix fills
+        if not logged:
+            log_prefix()
+
+
+def circuit_open_response(upstream_name, breaker):
+    """503 returned without calling an upstream whose circuit breaker is open."""
+    response = jsonify({
+        "error": "Service unavailable",
+        "message": f"Upstream service {upstream_name} is temporarily unavailable",
+        "circuit": breaker.state
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(breaker.retry_after())
+    return response
+
+
+def proxy_request(target_url, timeout=None, transform=None, stream_policy=None, body=None):
     """
     Generic request proxy function with proper streaming and error handling.
+
+    Upstream calls go through the shared connection pool, so keep-alive
+    connections are reused across requests. timeout overrides the upstream's
+    configured read timeout when given.
+
+    Request bodies are forwarded as raw bytes without being parsed, JSON
+    included, and streamed straight through with their content type. Pass
+    transform (a function taking and returning the decoded JSON body) only
+    when the gateway has to rewrite the payload, or body (bytes) when the
+    caller has already read the raw request body.
+
+    The response is relayed line by line for NDJSON/SSE token streams and in
+    large reads otherwise; stream_policy overrides that choice for a route.
+
+    Calls to an upstream whose circuit breaker is open fail fast with 503.
+
+    g.upstream_outcome is left as (status, None) when the upstream answered,
+    (None, error name) when the call to it failed, and None when it was
+    never called (see load_balancer.upstream_failed).
     """
 
+    g.upstream_outcome = None
     try:
         # Filter headers - keep most headers but remove the ones that cause issues
         headers = {k: v for k, v in request.headers if k.lower() not in
-                  ['host', 'connection', 'x-api-key', 'content-length']}
+                  ['host', 'connection', 'x-api-key', 'content-length', 'transfer-encoding']}
 
-        # Log the request details for debugging
-        if request.method == 'POST' and '/chat/api/' in request.path:
-            logger.info(f"Proxying to {target_url} with payload: {request.json}")
-            logger.info(f"Headers being sent: {dict(headers)}")
-        
-        # Choose method and stream the request
-        if request.method == 'GET':
-            resp = requests.get(target_url, headers=headers, params=request.args, timeout=timeout, stream=True)
-        elif request.method == 'POST':
-            resp = requests.post(target_url, headers=headers, json=request.json, timeout=timeout, stream=True)
-        elif request.method == 'PUT':
-            resp = requests.put(target_url, headers=headers, json=request.json, timeout=timeout, stream=True)
-        elif request.method == 'DELETE':
-            resp = requests.delete(target_url, headers=headers, timeout=timeout, stream=True)
-        else:
+        if request.method not in ('GET', 'POST', 'PUT', 'DELETE'):
             return jsonify({"error": "Method not allowed"}), 405
 
+        upstream_kwargs = {}
+        if request.method == 'GET':
+            upstream_kwargs['params'] = request.args
+        elif request.method in ('POST', 'PUT'):
+            if transform is not None:
+                upstream_kwargs['json'] = transform(request.get_json())
+            elif body is not None and PROXY_DEBUG_SAMPLE_RATE and random.random() < PROXY_DEBUG_SAMPLE_RATE:
+                # Only bodies the caller already read (chat JSON) are sampled; uploads keep streaming
+                log_debug_sample(target_url, headers, body)
+                upstream_kwargs['data'] = body
+            else:
+                upstream_kwargs['data'] = streaming_request_body() if body is None else body
+
+        upstream = upstream_pool.for_url(target_url)
+        breaker = breakers.get(upstream.name)
+        if not breaker.allow():
+            return circuit_open_response(upstream.name, breaker)
+
+        started = time.perf_counter()
+        try:
+            resp = breaker.call(upstream_pool.request, request.method, target_url, headers=headers,
+                                timeout=timeout, stream=True, **upstream_kwargs)
+        except requests.exceptions.RequestException as e:
+            g.upstream_outcome = (None, type(e).__name__)
+            raise
+        g.upstream_outcome = (resp.status_code, None)
+
         logger.info(f"Proxied {request.method} {request.path} -> {target_url} (Status: {resp.status_code})")
         
-        # Log error responses for debugging
-        if resp.status_code >= 400:
-            error_body = resp.content.decode('utf-8')[:500]  # First 500 chars
-            logger.error(f"Error response from {target_url}: {error_body}")
-
         # Filter headers and stream response content
         excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
         response_headers = {
@@ -283,11 +569,22 @@ def proxy_request(target_url, timeout=120):
             if name.lower() not in excluded_headers
         }
 
-        return Response(
-            stream_with_context(resp.iter_content(chunk_size=4096)),
+        policy = policy_for(resp.headers.get('Content-Type'), stream_policy)
+        meter = StreamMeter(request.endpoint, policy, started, upstream=target_url)
+        g.stream_meter = meter
+        body = metered(iter_response(resp, policy), meter)
+        if resp.status_code >= 400:
+            # Log the start of error bodies while the rest streams to the client
+            body = tee_error_prefix(body, target_url)
+
+        response = Response(
+            stream_with_context(body),
             status=resp.status_code,
             headers=response_headers
         )
+        # Hand the connection back to the pool even if the client disconnects early
+        response.call_on_close(resp.close)
+        return response
 
 
     except requests.exceptions.Timeout:
@@ -300,6 +597,23 @@ def proxy_request(target_url, timeout=120):
         logger.error(f"Error proxying request to {target_url}: {str(e)}")
         return jsonify({"error": "Internal server error", "message": "Proxy error occurred"}), 500
 
+def proxy_to_ollama(path):
+    """
+    Proxy a chat request to one of the Ollama nodes.
+
+    Picks the least-busy healthy node, preferring one that already has the
+    requested model loaded. The node counts as busy until the stream closes,
+    and the node's own 5xx answers and connection failures feed its passive
+    health check; the gateway's own errors (e.g. an open breaker) do not.
+    """
+    body = request.get_data()
+    model = extract_model(body)
+    backend = ollama_backends.acquire(model)
+    response = app.make_response(proxy_request(f"{backend.url}{path}", body=body))
+    failed = upstream_failed(g.upstream_outcome)
+    response.call_on_close(lambda: ollama_backends.release(backend, model, failed))
+    return response
+
 # =============================================================================
 # PROTECTED ROUTES - All routes below require valid API keys
 # =============================================================================
@@ -317,10 +631,10 @@ def chat_generate():
     Proxies POST requests to Ollama's text generation API for single-turn conversations.
     Expects JSON payload with model, prompt, and generation parameters.
 
-    Target: Ollama service running on host.docker.internal:11434
+    Target: Ollama nodes from OLLAMA_BACKENDS (host.docker.internal:11434 by default)
     Authentication: Required (X-API-Key header)
     """
-    return proxy_request("http://host.docker.internal:11434/api/generate")
+    return proxy_to_ollama("/api/generate")
 
 
 @app.route("/chat/api/chat", methods=["POST"])
@@ -332,10 +646,10 @@ def chat_conversation():
     Proxies POST requests to Ollama's chat API for multi-turn conversations.
     Supports conversation history and context management.
 
-    Target: Ollama service running on localhost:11434
+    Target: Ollama nodes from OLLAMA_BACKENDS (host.docker.internal:11434 by default)
     Authentication: Required (X-API-Key header)
     """
-    return proxy_request("http://host.docker.internal:11434/api/chat")
+    return proxy_to_ollama("/api/chat")
 
 # ┌─────────────────────────────────────────────────────────────────────────┐
 # │ 🔊 TEXT-TO-SPEECH ROUTES                                                │
@@ -354,7 +668,7 @@ def tts_speak():
     Authentication: Required (X-API-Key header)
     Returns: Audio stream (typically MP3 format)
     """
-    return proxy_request("http://edge-tts:8090/speak")
+    return proxy_request(f"{EDGE_TTS_URL}/speak")
 
 # ┌─────────────────────────────────────────────────────────────────────────┐
 # │ 🎨 IMAGE GENERATION ROUTES                                              │
@@ -362,6 +676,7 @@ def tts_speak():
 
 @app.route("/image/api/generate", methods=["POST"])
 @require_api_key
+@admission_controlled(admission_limiters["image"])
 def image_generate():
     """
     🎨 IMAGE GENERATION ENDPOINT
@@ -383,12 +698,13 @@ def image_generate():
         "height": 512
     }
     """
-    # AUTOMATIC1111 uses /sdapi/v1/txt2img endpoint
-    return proxy_request("http://localhost:7860/sdapi/v1/txt2img")
+    # AUTOMATIC1111 uses /sdapi/v1/txt2img endpoint; base64 images relay best in large reads
+    return proxy_request(f"{STABLE_DIFFUSION_URL}/sdapi/v1/txt2img", stream_policy=BULK)
 
 
 @app.route("/image/api/generate/simple", methods=["POST"])
 @require_api_key
+@admission_controlled(admission_limiters["image"])
 def image_generate_simple():
     """
     🎨 SIMPLIFIED IMAGE GENERATION ENDPOINT
@@ -425,9 +741,15 @@ def image_generate_simple():
             "alwayson_scripts": {}
         }
 
-        # Make request to AUTOMATIC1111
-        response = requests.post(
-            "http://localhost:7860/sdapi/v1/txt2img",
+        # Make request to AUTOMATIC1111, failing fast while the backend is down
+        breaker = breakers.get("stable-diffusion")
+        if not breaker.allow():
+            return circuit_open_response("stable-diffusion", breaker)
+
+        response = breaker.call(
+            upstream_pool.request,
+            "POST",
+            f"{STABLE_DIFFUSION_URL}/sdapi/v1/txt2img",
             json=sd_request,
             timeout=120  # Image generation can take time
         )
@@ -449,6 +771,9 @@ def image_generate_simple():
     except requests.exceptions.Timeout:
         logger.error("Timeout generating image")
         return jsonify({"error": "Image generation timeout"}), 504
+    except requests.exceptions.ConnectionError:
+        logger.error("Could not connect to image generation service")
+        return jsonify({"error": "Image generation service unavailable"}), 503
     except Exception as e:
         logger.error(f"Error in image generation: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
@@ -459,6 +784,7 @@ def image_generate_simple():
 
 @app.route("/whisper/api/transcribe", methods=["POST"])
 @require_api_key
+@admission_controlled(admission_limiters["whisper"])
 def whisper_transcribe():
     """
     🎙️ SPEECH-TO-TEXT TRANSCRIPTION ENDPOINT
@@ -468,10 +794,11 @@ def whisper_transcribe():
 
     Target: Whisper service running on localhost:8092
     Authentication: Required (X-API-Key header)
-    Expects: Audio file in request (WAV, MP3, etc.)
+    Expects: Audio file in request (WAV, MP3, etc.), streamed through
+             to Whisper without buffering the upload in the gateway
     Returns: Transcribed text with confidence scores
     """
-    return proxy_request("http://localhost:8092/transcribe")
+    return proxy_request(f"{WHISPER_URL}/transcribe")
 
 # ┌─────────────────────────────────────────────────────────────────────────┐
 # │ 📝 ADD NEW ROUTES HERE                                                  │
@@ -514,7 +841,8 @@ def whisper_transcribe():
 def generate_temp_key():
     """
     Generate a temporary API key for demo purposes.
-    Keys expire after 1 hour and are only valid for the session.
+    Keys expire after 1 hour and are valid on every worker; each client IP
+    may hold at most TEMP_KEY_MAX_PER_IP live keys (429 beyond that).
     """
     try:
         # Generate unique temporary key
@@ -522,13 +850,23 @@ def generate_temp_key():
         expires_at = int(time.time() * 1000) + 3600000  # 1 hour from now
         
         # Store key with metadata
-        TEMP_KEYS[temp_key] = {
-            "created_at": datetime.utcnow().isoformat(),
-            "expires_at": expires_at,
-            "user": "demo_user",
-            "service": "demo",
-            "is_temp": True
-        }
+        try:
+            temp_keys.add(temp_key, {
+                "created_at": datetime.utcnow().isoformat(),
+                "expires_at": expires_at,
+                "user": "demo_user",
+                "service": "demo",
+                "is_temp": True,
+                # Rate-limit identity of the key (see rate_limiter.identity_for)
+                "client_ip": request.remote_addr or "unknown"
+            }, request.remote_addr)
+        except TempKeyLimitExceeded:
+            logger.warning(f"Temporary key limit reached for {request.remote_addr}")
+            log_request_event("TEMP_KEY_LIMITED", request.path, request.method, request.remote_addr, status_code=429)
+            return jsonify({
+                "error": "Too many temporary keys",
+                "message": f"At most {temp_keys.max_per_ip} temporary keys per client at a time"
+            }), 429
         
         # Log temporary key generation
         logger.info(f"Generated temporary API key: {temp_key[:20]}...")
@@ -569,8 +907,8 @@ def verify_firebase_token():
         # Verify the Firebase ID token
         if firebase_initialized:
             try:
-                # Verify the ID token and get the decoded claims
-                decoded_token = firebase_auth.verify_id_token(token)
+                # Verify the ID token and get the decoded claims (cached until the token expires)
+                decoded_token = firebase_tokens.verify_id_token(token)
                 
                 # Extract user information from the token
                 uid = decoded_token.get('uid')
@@ -630,7 +968,7 @@ def root_redirect():
     """
     Redirect root to the Next.js dashboard app which now includes the landing page.
     """
-    target_url = "http://ai-gateway-web:3000/"
+    target_url = f"{DASHBOARD_WEB_URL}/"
     return proxy_to_dashboard(target_url)
 
 # ┌─────────────────────────────────────────────────────────────────────────┐
@@ -657,17 +995,22 @@ def proxy_to_dashboard(target_url):
         elif request.data:
             data = request.data
         
-        # Make the request to the dashboard
-        resp = requests.request(
-            method=method,
-            url=target_url,
+        breaker = breakers.get("dashboard-web")
+        if not breaker.allow():
+            return circuit_open_response("dashboard-web", breaker)
+
+        # Make the request to the dashboard through the pooled session
+        started = time.perf_counter()
+        resp = breaker.call(
+            upstream_pool.request,
+            method,
+            target_url,
             headers=headers,
             params=request.args,
             json=json_data,
             data=data,
             allow_redirects=False,
-            stream=True,
-            timeout=30
+            stream=True
         )
         
         # Return the response
@@ -677,11 +1020,15 @@ def proxy_to_dashboard(target_url):
             if name.lower() not in excluded_headers
         }
         
-        return Response(
-            stream_with_context(resp.iter_content(chunk_size=1024)),
+        policy = policy_for(resp.headers.get('Content-Type'))
+        response = Response(
+            stream_with_context(metered(iter_response(resp, policy),
+                                        StreamMeter(request.endpoint, policy, started))),
             status=resp.status_code,
             headers=response_headers
         )
+        response.call_on_close(resp.close)
+        return response
         
     except requests.exceptions.Timeout:
         logger.error(f"Timeout proxying to dashboard: {target_url}")
@@ -707,7 +1054,7 @@ def nextjs_static(path=""):
     """
     Proxy Next.js static assets.
     """
-    target_url = f"http://ai-gateway-web:3000/_next/{path}"
+    target_url = f"{DASHBOARD_WEB_URL}/_next/{path}"
     return proxy_to_dashboard(target_url)
 
 # Login page route with SSO check
@@ -723,7 +1070,7 @@ def login_proxy():
     if firebase_token and firebase_initialized:
         try:
             # Verify the Firebase token
-            decoded_token = firebase_auth.verify_id_token(firebase_token)
+            decoded_token = firebase_tokens.verify_id_token(firebase_token)
             email = decoded_token.get('email')
             
             # Check if this is an admin user
@@ -738,7 +1085,7 @@ def login_proxy():
             logger.info(f"Firebase token verification failed: {e}")
     
     # Normal login flow
-    target_url = "http://ai-gateway-web:3000/login"
+    target_url = f"{DASHBOARD_WEB_URL}/login"
     return proxy_to_dashboard(target_url)
 
 # Simplified dashboard routes - NextAuth handles all authentication
@@ -753,9 +1100,9 @@ def dashboard_proxy(path=""):
     """
     # Direct proxy without complex auth checks
     if path:
-        target_url = f"http://ai-gateway-web:3000/{path}"
+        target_url = f"{DASHBOARD_WEB_URL}/{path}"
     else:
-        target_url = "http://ai-gateway-web:3000/"
+        target_url = f"{DASHBOARD_WEB_URL}/"
 
     return proxy_to_dashboard(target_url)
 
@@ -794,7 +1141,9 @@ def status():
     Provides operational status and authenticated user context.
 
     Authentication: Required (X-API-Key header)
-    Returns: JSON with status, user info, service info, timestamp, and version
+    Returns: JSON with status, user info, service info, upstream pool
+             occupancy, circuit breaker states, admission queues, the
+             key's rate-limit budget, key store state, timestamp, and version
     Use case: Authenticated monitoring, user-specific status checks
     """
     from flask import g
@@ -803,8 +1152,35 @@ def status():
         "timestamp": datetime.utcnow().isoformat(),
         "user": g.key_info.get('user', 'unknown'),
         "service": g.key_info.get('service', 'unknown'),
+        "upstreams": upstream_pool.stats(),
+        "ollama_backends": ollama_backends.stats(),
+        "circuit_breakers": breakers.stats(),
+        "admission": {name: limiter.stats() for name, limiter in admission_limiters.items()},
+        "rate_limit": rate_limiter.stats(g.key_info),
+        "api_keys": api_validator.key_store.stats(),
+        "temp_keys": temp_keys.stats(),
         "version": "1.0.0"
     })
 
+@app.route("/metrics", methods=["GET"])
+@require_api_key
+def metrics_snapshot():
+    """
+    📈 AUTHENTICATED METRICS ENDPOINT
+
+    In-process gateway metrics: time-to-first-byte and throughput of
+    streamed responses per route, plus counters and gauges from the
+    gateway subsystems. Values are per worker process.
+
+    Authentication: Required (X-API-Key header)
+    Returns: JSON object of metric name -> value or summary
+    Use case: Tuning streaming policies, capacity monitoring
+    """
+    return jsonify({
+        "timestamp": datetime.utcnow().isoformat(),
+        "pid": os.getpid(),
+        "metrics": metrics.snapshot()
+    })
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8080)
@@ -0,0 +1,559 @@
+"""
+ASGI serving mode for the API Gateway.
+
+Serves the proxy routes (chat, TTS, image, whisper, dashboard pages) on an
+asyncio event loop with non-blocking upstream calls, so one process can hold
+thousands of concurrent streams, including the dashboard's live log stream.
+Everything else (auth endpoints, temp keys, the rest of the dashboard API)
+falls through to the Flask app mounted underneath.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+"""
+
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import wraps
+
+import anyio
+import httpx
+import jwt
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask, BackgroundTasks
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import (
+    app as flask_app,
+    api_validator,
+    temp_keys,
+    log_request_event,
+    log_request_completion,
+    CORS_ORIGINS,
+    CORS_ALLOW_HEADERS,
+    CORS_METHODS,
+    CORS_EXPOSE_HEADERS,
+    ollama_backends,
+    admission_limiters,
+    EDGE_TTS_URL,
+    STABLE_DIFFUSION_URL,
+    WHISPER_URL,
+    DASHBOARD_WEB_URL,
+    ERROR_LOG_PREFIX_BYTES,
+)
+from admission import AdmissionRejected, rejection_body
+from circuit_breaker import breakers
+from dashboard_api import audit_tailer, dashboard_token_cache, log_stream_frames
+from log_tail import LOG_STREAM_HEARTBEAT
+from rate_limiter import rate_limiter
+from load_balancer import extract_model, upstream_failed
+from streaming import BULK, policy_for, aiter_response, ametered, StreamMeter
+from upstream_pool import upstream_pool
+
+logger = logging.getLogger(__name__)
+
+# Async clients are not bound to a thread per stream, so they can hold far
+# more concurrent upstream connections than the sync pools
+UPSTREAM_ASYNC_POOL_SIZE = int(os.environ.get("UPSTREAM_ASYNC_POOL_SIZE", "1000"))
+
+REQUEST_EXCLUDED_HEADERS = {'host', 'connection', 'x-api-key', 'content-length', 'transfer-encoding'}
+DASHBOARD_EXCLUDED_HEADERS = {'host', 'connection', 'content-length', 'transfer-encoding'}
+RESPONSE_EXCLUDED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection'}
+
+_async_clients = {}
+
+
+def get_async_client(target_url):
+    """Return the shared httpx.AsyncClient for target_url's upstream."""
+    upstream = upstream_pool.for_url(target_url)
+    client = _async_clients.get(upstream.name)
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_ASYNC_POOL_SIZE,
+                max_keepalive_connections=upstream.pool_size,
+                keepalive_expiry=upstream.idle_timeout
+            ),
+            timeout=httpx.Timeout(upstream.read_timeout, connect=upstream.connect_timeout),
+            follow_redirects=False
+        )
+        _async_clients[upstream.name] = client
+    return client
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    for client in list(_async_clients.values()):
+        await client.aclose()
+    _async_clients.clear()
+
+
+def require_api_key(f):
+    """Async counterpart of app.require_api_key with the same checks, rate limits and audit events."""
+    @wraps(f)
+    async def decorated_function(request):
+        started = time.perf_counter()
+        api_key = request.headers.get("X-API-Key", "")
+        endpoint = request.url.path
+        method = request.method
+        client_ip = request.client.host if request.client else None
+
+        # Temporary keys are looked up in SQLite (see temp_key_store), which may wait on a lock
+        is_valid, key_info = await run_in_threadpool(api_validator.is_valid_key, api_key)
+        if not is_valid:
+            key_partial = api_key[:8] + "..." if api_key and len(api_key) > 8 else "missing"
+            log_request_event("UNAUTHORIZED", endpoint, method, client_ip, key_partial=key_partial, status_code=401)
+
+            logger.warning(f"Unauthorized access attempt to {endpoint} from {client_ip}")
+            return JSONResponse({
+                "error": "Unauthorized",
+                "message": "Valid API key required"
+            }, status_code=401)
+
+        # SQLite may wait on another worker's write lock, so keep it off the event loop
+        decision = await run_in_threadpool(rate_limiter.acquire, key_info)
+        if not decision.allowed:
+            log_request_event("RATE_LIMITED", endpoint, method, client_ip, key_info=key_info, status_code=429)
+
+            logger.warning(f"Rate limit ({decision.reason}) exceeded on {endpoint} "
+                           f"by {key_info.get('user', 'unknown')}")
+            return JSONResponse({
+                "error": "Too many requests",
+                "message": "Rate limit exceeded" if decision.reason == "rate"
+                           else "Too many concurrent requests for this API key",
+                "retry_after": decision.retry_after
+            }, status_code=429, headers=decision.headers())
+
+        request.state.key_info = key_info
+        request.state.stream_meter = None
+        try:
+            response = await f(request)
+        except BaseException:
+            # Off the event loop like acquire(), and shielded so a cancelled request still frees its slot
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(rate_limiter.release, decision)
+            log_request_completion(endpoint, method, client_ip, key_info, 500, started)
+            raise
+        response.headers.update(decision.headers())
+
+        # The concurrent-request slot is held until the response has been sent,
+        # and authorized access is logged then, with its outcome
+        content_length = response.headers.get("content-length")
+        tasks = BackgroundTasks([response.background] if response.background else [])
+        tasks.add_task(rate_limiter.release, decision)
+        tasks.add_task(log_request_completion, endpoint, method, client_ip, key_info, response.status_code,
+                       started, request.state.stream_meter, int(content_length) if content_length else None)
+        response.background = tasks
+        return response
+
+    return decorated_function
+
+
+def admission_controlled(limiter):
+    """Async counterpart of app.admission_controlled; queued requests wait without a thread."""
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(request):
+            try:
+                admitted_at = await limiter.acquire_async()
+            except AdmissionRejected as rejected:
+                logger.warning(f"Admission rejected for {request.url.path}: {rejected.message}")
+                return JSONResponse(rejection_body(rejected), status_code=rejected.status_code,
+                                    headers={"Retry-After": str(rejected.retry_after)})
+
+            try:
+                response = await f(request)
+            except BaseException:
+                limiter.release(admitted_at)
+                raise
+
+            # Hold the slot until the response has been sent
+            tasks = BackgroundTasks([response.background] if response.background else [])
+            tasks.add_task(limiter.release, admitted_at)
+            response.background = tasks
+            return response
+
+        return decorated_function
+    return decorator
+
+
+def _response_headers(upstream_response):
+    return {
+        name: value for name, value in upstream_response.headers.items()
+        if name.lower() not in RESPONSE_EXCLUDED_HEADERS
+    }
+
+
+def streaming_request_body(request, headers):
+    """
+    Return the request body as an async stream for the upstream call, or None.
+
+    A declared Content-Length is forwarded unchanged; otherwise httpx sends
+    the body with chunked transfer encoding. Only one receive() message is
+    held in memory at a time.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length is not None:
+        if content_length == "0":
+            return None
+        headers["Content-Length"] = content_length
+    elif "chunked" not in request.headers.get("transfer-encoding", "").lower():
+        return None
+    return request.stream()
+
+
+async def tee_error_prefix(chunks, target_url, limit=None):
+    """Async counterpart of app.tee_error_prefix: stream the error body, log its first bytes."""
+    limit = limit or ERROR_LOG_PREFIX_BYTES
+    prefix = bytearray()
+    logged = False
+
+    def log_prefix():
+        error_body = prefix.decode('utf-8', errors='replace')
+        logger.error(f"Error response from {target_url}: {error_body}")
+
+    try:
+        async for chunk in chunks:
+            if not logged:
+                prefix += chunk[:limit - len(prefix)]
+                if len(prefix) >= limit:
+                    log_prefix()
+                    logged = True
+            yield chunk
+    finally:
+        if not logged:
+            log_prefix()
+
+
+def circuit_open_response(upstream_name, breaker):
+    """Async-side counterpart of app.circuit_open_response."""
+    return JSONResponse({
+        "error": "Service unavailable",
+        "message": f"Upstream service {upstream_name} is temporarily unavailable",
+        "circuit": breaker.state
+    }, status_code=503, headers={"Retry-After": str(breaker.retry_after())})
+
+
+# (status, body) returned for each failure mode, matching the Flask proxies
+PROXY_ERRORS = {
+    "timeout": (504, {"error": "Service timeout", "message": "The upstream service did not respond in time"}),
+    "connect": (503, {"error": "Service unavailable", "message": "Could not connect to upstream service"}),
+    "internal": (500, {"error": "Internal server error", "message": "Proxy error occurred"}),
+}
+DASHBOARD_ERRORS = {
+    "timeout": (504, {"error": "Dashboard timeout"}),
+    "connect": (503, {"error": "Dashboard unavailable"}),
+    "internal": (503, {"error": "Dashboard unavailable"}),
+}
+
+
+def _error_response(errors, kind):
+    status_code, body = errors[kind]
+    return JSONResponse(body, status_code=status_code)
+
+
+async def proxy_request(request, target_url, timeout=None, excluded_headers=REQUEST_EXCLUDED_HEADERS,
+                        errors=PROXY_ERRORS, stream_policy=None, content=None):
+    """
+    Non-blocking counterpart of app.proxy_request.
+
+    Streams the upstream response back to the client without holding a
+    thread; the upstream connection is released when the stream finishes.
+    Bodies are relayed with the same content-type-aware policy as Flask.
+    content (bytes) is sent instead of streaming the request body when the
+    caller has already read it.
+
+    request.state.upstream_outcome is left as (status, None) when the
+    upstream answered, (None, error name) when the call to it failed, and
+    None when it was never called (see load_balancer.upstream_failed).
+    """
+    upstream = upstream_pool.for_url(target_url)
+    breaker = breakers.get(upstream.name)
+    request.state.upstream_outcome = None
+
+    started = time.perf_counter()
+    try:
+        client = get_async_client(target_url)
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in excluded_headers}
+        body = streaming_request_body(request, headers) if content is None else content
+        upstream_request = client.build_request(
+            request.method,
+            target_url,
+            headers=headers,
+            params=request.query_params,
+            content=body,
+            timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+        )
+        # Only now, so every call the breaker lets through reaches record() or release()
+        if not breaker.allow():
+            return circuit_open_response(upstream.name, breaker)
+        try:
+            upstream_response = await client.send(upstream_request, stream=True)
+        except Exception as e:
+            breaker.record(True, time.perf_counter() - started, type(e).__name__)
+            request.state.upstream_outcome = (None, type(e).__name__)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record(upstream_response.status_code >= 500, time.perf_counter() - started,
+                       f"HTTP {upstream_response.status_code}")
+        request.state.upstream_outcome = (upstream_response.status_code, None)
+    except httpx.TimeoutException:
+        logger.error(f"Timeout proxying request to {target_url}")
+        return _error_response(errors, "timeout")
+    except httpx.TransportError:
+        logger.error(f"Connection error proxying request to {target_url}")
+        return _error_response(errors, "connect")
+    except Exception as e:
+        logger.error(f"Error proxying request to {target_url}: {str(e)}")
+        return _error_response(errors, "internal")
+
+    logger.info(f"Proxied {request.method} {request.url.path} -> {target_url} (Status: {upstream_response.status_code})")
+
+    policy = policy_for(upstream_response.headers.get('Content-Type'), stream_policy)
+    route = getattr(request.scope.get("endpoint"), "__name__", request.url.path)
+    meter = StreamMeter(route, policy, started, upstream=target_url)
+    request.state.stream_meter = meter
+    body = ametered(aiter_response(upstream_response, policy), meter)
+    if upstream_response.status_code >= 400:
+        body = tee_error_prefix(body, target_url)
+
+    return StreamingResponse(
+        body,
+        status_code=upstream_response.status_code,
+        headers=_response_headers(upstream_response),
+        background=BackgroundTask(upstream_response.aclose)
+    )
+
+
+async def proxy_to_ollama(request, path):
+    """Async counterpart of app.proxy_to_ollama (shares its backend pool)."""
+    body = await request.body()
+    model = extract_model(body)
+    backend = ollama_backends.acquire(model)
+    response = await proxy_request(request, f"{backend.url}{path}", content=body)
+    # The node's own answer, not the gateway's 503s (open breaker) or local errors
+    failed = upstream_failed(request.state.upstream_outcome)
+
+    # Release the node once the stream has been sent
+    tasks = BackgroundTasks([response.background] if response.background else [])
+    tasks.add_task(ollama_backends.release, backend, model, failed)
+    response.background = tasks
+    return response
+
+
+# =============================================================================
+# PROTECTED ROUTES
+# =============================================================================
+
+@require_api_key
+async def chat_generate(request):
+    """🤖 Ollama text generation (see app.chat_generate)."""
+    return await proxy_to_ollama(request, "/api/generate")
+
+
+@require_api_key
+async def chat_conversation(request):
+    """💬 Ollama multi-turn chat (see app.chat_conversation)."""
+    return await proxy_to_ollama(request, "/api/chat")
+
+
+@require_api_key
+async def tts_speak(request):
+    """🔊 Edge-TTS speech synthesis (see app.tts_speak)."""
+    return await proxy_request(request, f"{EDGE_TTS_URL}/speak")
+
+
+@require_api_key
+@admission_controlled(admission_limiters["image"])
+async def image_generate(request):
+    """🎨 AUTOMATIC1111 txt2img passthrough (see app.image_generate)."""
+    return await proxy_request(request, f"{STABLE_DIFFUSION_URL}/sdapi/v1/txt2img", stream_policy=BULK)
+
+
+@require_api_key
+@admission_controlled(admission_limiters["image"])
+async def image_generate_simple(request):
+    """🎨 Simplified image generation with defaults (see app.image_generate_simple)."""
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not data or "prompt" not in data:
+            return JSONResponse({"error": "Missing required field: prompt"}, status_code=400)
+
+        sd_request = {
+            "prompt": data.get("prompt"),
+            "negative_prompt": data.get("negative_prompt", ""),
+            "steps": data.get("steps", 20),
+            "width": data.get("width", 512),
+            "height": data.get("height", 512),
+            "cfg_scale": data.get("cfg_scale", 7),
+            "sampler_name": data.get("sampler", "Euler a"),
+            "batch_size": 1,
+            "n_iter": 1,
+            "seed": data.get("seed", -1),
+            "restore_faces": data.get("restore_faces", False),
+            "enable_hr": False,
+            "denoising_strength": 0,
+            "save_images": False,
+            "send_images": True,
+            "alwayson_scripts": {}
+        }
+
+        breaker = breakers.get("stable-diffusion")
+        if not breaker.allow():
+            return circuit_open_response("stable-diffusion", breaker)
+
+        target_url = f"{STABLE_DIFFUSION_URL}/sdapi/v1/txt2img"
+        started = time.perf_counter()
+        try:
+            response = await get_async_client(target_url).post(target_url, json=sd_request, timeout=120)
+        except Exception as e:
+            breaker.record(True, time.perf_counter() - started, type(e).__name__)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record(response.status_code >= 500, time.perf_counter() - started, f"HTTP {response.status_code}")
+
+        if response.status_code == 200:
+            result = response.json()
+            return JSONResponse({
+                "image": result.get("images", [])[0] if result.get("images") else None,
+                "parameters": result.get("parameters", {}),
+                "info": json.loads(result.get("info", "{}"))
+            })
+        else:
+            return JSONResponse({
+                "error": "Image generation failed",
+                "details": response.text
+            }, status_code=response.status_code)
+
+    except httpx.TimeoutException:
+        logger.error("Timeout generating image")
+        return JSONResponse({"error": "Image generation timeout"}, status_code=504)
+    except httpx.TransportError:
+        logger.error("Could not connect to image generation service")
+        return JSONResponse({"error": "Image generation service unavailable"}, status_code=503)
+    except Exception as e:
+        logger.error(f"Error in image generation: {str(e)}")
+        return JSONResponse({"error": "Internal server error"}, status_code=500)
+
+
+@require_api_key
+@admission_controlled(admission_limiters["whisper"])
+async def whisper_transcribe(request):
+    """🎙️ Whisper transcription (see app.whisper_transcribe)."""
+    return await proxy_request(request, f"{WHISPER_URL}/transcribe")
+
+
+@require_api_key
+async def status(request):
+    """📊 Authenticated status (see app.status)."""
+    key_info = request.state.key_info
+    return JSONResponse({
+        "status": "operational",
+        "timestamp": datetime.utcnow().isoformat(),
+        "user": key_info.get('user', 'unknown'),
+        "service": key_info.get('service', 'unknown'),
+        "upstreams": upstream_pool.stats(),
+        "ollama_backends": ollama_backends.stats(),
+        "circuit_breakers": breakers.stats(),
+        "admission": {name: limiter.stats() for name, limiter in admission_limiters.items()},
+        "rate_limit": rate_limiter.stats(key_info),
+        "api_keys": api_validator.key_store.stats(),
+        "temp_keys": temp_keys.stats(),
+        "server": "asgi",
+        "version": "1.0.0"
+    })
+
+
+# =============================================================================
+# DASHBOARD PAGES - PROXY TO NEXT.JS
+# =============================================================================
+
+async def dashboard_proxy(request):
+    """Proxy dashboard pages and Next.js assets (see app.proxy_to_dashboard)."""
+    path = request.url.path
+    if path.startswith("/dashboard"):
+        path = path[len("/dashboard"):] or "/"
+    return await proxy_request(
+        request,
+        f"{DASHBOARD_WEB_URL}{path}",
+        excluded_headers=DASHBOARD_EXCLUDED_HEADERS,
+        errors=DASHBOARD_ERRORS
+    )
+
+
+async def dashboard_logs_stream(request):
+    """
+    Live audit log stream (see dashboard_api.stream_logs).
+
+    Served here rather than through Flask so an open dashboard waits on the
+    event loop instead of holding a thread for as long as it is connected.
+    """
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return JSONResponse({"error": "Missing or invalid authorization header"}, status_code=401)
+    try:
+        dashboard_token_cache.verify(auth_header.split(" ")[1])
+    except jwt.ExpiredSignatureError:
+        return JSONResponse({"error": "Token has expired"}, status_code=401)
+    except jwt.InvalidTokenError:
+        return JSONResponse({"error": "Invalid token"}, status_code=401)
+
+    async def frames():
+        with audit_tailer.subscribe() as subscription:
+            while True:
+                for frame in log_stream_frames(*await subscription.aget(LOG_STREAM_HEARTBEAT)):
+                    yield frame
+
+    return StreamingResponse(frames(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+DASHBOARD_METHODS = ["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"]
+
+routes = [
+    Route("/chat/api/generate", chat_generate, methods=["POST"]),
+    Route("/chat/api/chat", chat_conversation, methods=["POST"]),
+    Route("/tts/api/speak", tts_speak, methods=["POST"]),
+    Route("/image/api/generate", image_generate, methods=["POST"]),
+    Route("/image/api/generate/simple", image_generate_simple, methods=["POST"]),
+    Route("/whisper/api/transcribe", whisper_transcribe, methods=["POST"]),
+    Route("/status", status, methods=["GET"]),
+    Route("/api/dashboard/logs/stream", dashboard_logs_stream, methods=["GET"]),
+    Route("/", dashboard_proxy, methods=["GET"]),
+    Route("/_next/{path:path}", dashboard_proxy, methods=["GET"]),
+    Route("/dashboard", dashboard_proxy, methods=DASHBOARD_METHODS),
+    Route("/dashboard/{path:path}", dashboard_proxy, methods=DASHBOARD_METHODS),
+    # Auth, temp keys, /login, /health and the dashboard API stay on Flask
+    Mount("/", app=WSGIMiddleware(flask_app)),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=CORS_ORIGINS,
+            allow_headers=CORS_ALLOW_HEADERS,
+            allow_methods=CORS_METHODS,
+            allow_credentials=True,
+            expose_headers=CORS_EXPOSE_HEADERS
+        )
+    ],
+    lifespan=lifespan
+)
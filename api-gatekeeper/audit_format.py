@@ -0,0 +1,392 @@
+"""
+Audit record schema, line formats and the shared audit log reader.
+
+Two on-disk formats are supported, selected with AUDIT_FORMAT:
+
+* "text" (default): the legacy human-readable line,
+  "2024-01-01 12:00:00 UTC | INFO | AUTHORIZED | POST /chat/api/generate | User: ... | IP: ...".
+* "jsonl": one JSON object per line with an epoch-millisecond "ts" and
+  typed fields (see FIELDS); optional fields are omitted when unknown.
+
+Both the dashboard and analyze_logs.py read through parse_line() /
+iter_entries(), which accept either format line by line, so a log that
+switches format mid-file (or its rotated backups) still reads cleanly.
+Entries are plain dicts keyed by FIELDS, with "ts" in epoch milliseconds.
+Readers cover the active file and its rotated segments (see audit_log).
+Time-window scans skip segments last written before the window, seek
+through each segment's sparse index, read only the timestamp (line_ts) of
+the few lines before the window and fully parse just those inside it.
+Newest-first reads (iter_entries_reverse) read files backwards in blocks
+and hand out cursors, so a page of recent entries costs the same however
+large the log has grown.
+"""
+
+import json
+import os
+import re
+import time
+from collections import namedtuple
+
+from audit_log import index_offset, segment_paths
+
+AUDIT_FORMAT = os.environ.get("AUDIT_FORMAT", "text")
+
+# Field order of a queued record; everything after service is optional
+AuditRecord = namedtuple("AuditRecord", [
+    "ts",           # epoch seconds (float) when the event happened
+    "event",        # AUTHORIZED, UNAUTHORIZED, RATE_LIMITED, ...
+    "method",
+    "endpoint",
+    "ip",
+    "user",
+    "service",
+    "key_partial",
+    "status",       # HTTP status code
+    "latency_ms",   # total request time
+    "ttfb_ms",      # time to the first response byte
+    "upstream_ms",  # time spent waiting on the upstream
+    "bytes",        # response body bytes sent to the client
+    "upstream",     # upstream URL that served the request
+], defaults=(None,) * 8)
+
+FIELDS = ("ts", "level") + AuditRecord._fields[1:]
+
+FORMATS = ("text", "jsonl")
+
+# Bytes read per step when reading a file backwards from its end
+REVERSE_BLOCK_SIZE = 64 * 1024
+
+# Legacy detail labels and the fields they map to
+_TEXT_LABELS = {
+    "User": "user",
+    "Service": "service",
+    "IP": "ip",
+    "Key": "key_partial",
+    "Status": "status",
+    "Latency": "latency_ms",
+    "TTFB": "ttfb_ms",
+    "Upstream time": "upstream_ms",
+    "Bytes": "bytes",
+    "Upstream": "upstream",
+}
+_INT_FIELDS = frozenset(("status", "bytes"))
+_FLOAT_FIELDS = frozenset(("latency_ms", "ttfb_ms", "upstream_ms"))
+
+# Endpoint prefixes of the AI services, for per-service charts and rollups
+SERVICE_PREFIXES = (
+    ("/chat/api", "chat"),
+    ("/tts/api", "tts"),
+    ("/image/api", "image"),
+    ("/whisper/api", "whisper"),
+)
+SERVICES = tuple(service for _, service in SERVICE_PREFIXES)
+
+_TEXT_LINE = re.compile(
+    r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}):(\d{2})(?: UTC)? \| (\w+) \| (\w+) \| (\S+) (\S*)(.*)')
+
+
+def _format_completion(record):
+    # Outcome of a completed request, appended to its AUTHORIZED line
+    parts = [f" | Status: {record.status}"]
+    if record.latency_ms is not None:
+        parts.append(f" | Latency: {record.latency_ms}ms")
+    if record.ttfb_ms is not None:
+        parts.append(f" | TTFB: {record.ttfb_ms}ms")
+    if record.upstream_ms is not None:
+        parts.append(f" | Upstream time: {record.upstream_ms}ms")
+    if record.bytes is not None:
+        parts.append(f" | Bytes: {record.bytes}")
+    if record.upstream is not None:
+        parts.append(f" | Upstream: {record.upstream}")
+    return "".join(parts)
+
+
+def format_text(record):
+    """Legacy pipe-delimited audit line (timestamps in the server's local time)."""
+    event = record.event
+    if event == "AUTHORIZED":
+        message = (f"AUTHORIZED | {record.method} {record.endpoint} | User: {record.user} | "
+                   f"Service: {record.service} | IP: {record.ip}")
+        if record.status is not None:
+            message += _format_completion(record)
+    elif event == "UNAUTHORIZED":
+        key_info_str = f" | Key: {record.key_partial}" if record.key_partial else ""
+        message = f"UNAUTHORIZED | {record.method} {record.endpoint} | IP: {record.ip}{key_info_str}"
+    else:
+        message = f"{event} | {record.method} {record.endpoint} | IP: {record.ip} | Status: {record.status}"
+
+    asctime = time.strftime('%Y-%m-%d %H:%M:%S UTC', time.localtime(record.ts))
+    return f"{asctime} | INFO | {message}"
+
+
+def format_jsonl(record):
+    """One compact JSON object; fields that are None are left out."""
+    entry = {"ts": int(record.ts * 1000)}
+    for field, value in zip(AuditRecord._fields[1:], record[1:]):
+        if value is not None:
+            entry[field] = value
+    return json.dumps(entry, separators=(",", ":"))
+
+
+def formatter(name=AUDIT_FORMAT):
+    """Record formatter for an AUDIT_FORMAT name."""
+    if name not in FORMATS:
+        raise ValueError(f"AUDIT_FORMAT must be one of {FORMATS}, not {name!r}")
+    return format_jsonl if name == "jsonl" else format_text
+
+
+_minute_cache = {}
+
+
+def _minute_ms(minute):
+    # Legacy lines share a minute with many neighbours, so mktime runs once per minute
+    value = _minute_cache.get(minute)
+    if value is None:
+        if len(_minute_cache) > 4096:
+            _minute_cache.clear()
+        value = int(time.mktime(time.strptime(minute, '%Y-%m-%d %H:%M'))) * 1000
+        _minute_cache[minute] = value
+    return value
+
+
+def _coerce(field, value):
+    if field in _INT_FIELDS:
+        try:
+            return int(value)
+        except ValueError:
+            return None
+    if field in _FLOAT_FIELDS:
+        try:
+            return float(value.rstrip("ms"))
+        except ValueError:
+            return None
+    return value
+
+
+def parse_text_line(line):
+    """Parse a legacy audit line into an entry dict, or None if it is not one."""
+    match = _TEXT_LINE.match(line)
+    if match is None:
+        return None
+    minute, second, level, event, method, endpoint, details = match.groups()
+    entry = {
+        "ts": _minute_ms(minute) + int(second) * 1000,
+        "level": level,
+        "event": event,
+        "method": method,
+        "endpoint": endpoint,
+    }
+    for part in details.split(" | ")[1:]:
+        label, _, value = part.partition(": ")
+        field = _TEXT_LABELS.get(label)
+        if field is not None and value != "None":
+            entry[field] = _coerce(field, value.strip())
+    return entry
+
+
+def parse_line(line):
+    """Parse one audit line in either format into an entry dict, or None."""
+    if line.startswith("{"):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(entry, dict) or "ts" not in entry:
+            return None
+        entry.setdefault("level", "INFO")
+        return entry
+    return parse_text_line(line.rstrip("\n"))
+
+
+def line_ts(line):
+    """Epoch-ms timestamp of an audit line without parsing the rest of it, or None."""
+    try:
+        if line.startswith('{"ts":'):
+            return int(line[6:line.index(",", 6)])
+        if line[16] == ":":
+            return _minute_ms(line[:16]) + int(line[17:19]) * 1000
+    except (ValueError, IndexError):
+        pass
+    return None
+
+
+def _open(path, offset=0):
+    try:
+        f = open(path, "r", encoding="utf-8", errors="replace")
+    except FileNotFoundError:
+        return None
+    if offset:
+        f.seek(offset)
+    return f
+
+
+def iter_segment_entries(segment, since_ms=None):
+    """
+    Yield parsed entries from one audit log segment, oldest first.
+
+    Args:
+        segment (str): Audit log file or rotated segment
+        since_ms (int, optional): Skip entries older than this epoch-ms timestamp.
+            Reading starts at the segment's sparse index entry for that time, and
+            the remaining older lines are dismissed on their timestamp alone
+    """
+    offset = index_offset(segment, since_ms) if since_ms is not None else 0
+    f = _open(segment, offset)
+    if f is None:
+        return
+    with f:
+        for line in f:
+            if since_ms is not None:
+                ts = line_ts(line)
+                if ts is not None and ts < since_ms:
+                    continue
+            entry = parse_line(line)
+            if entry is None:
+                continue
+            if since_ms is not None and entry["ts"] < since_ms:
+                continue
+            yield entry
+
+
+def _segments_since(path, since_ms):
+    segments = segment_paths(path)
+    if since_ms is None:
+        return segments
+    selected = []
+    for segment in segments:
+        try:
+            # A segment last written before since_ms holds nothing newer
+            if os.stat(segment).st_mtime * 1000 < since_ms:
+                continue
+        except FileNotFoundError:
+            continue
+        selected.append(segment)
+    return selected
+
+
+def iter_entries(path, since_ms=None):
+    """
+    Yield parsed entries of an audit log and its rotated segments, oldest first.
+
+    Segments last written before since_ms are skipped without being opened.
+    """
+    for segment in _segments_since(path, since_ms):
+        yield from iter_segment_entries(segment, since_ms)
+
+
+def iter_timestamps(path):
+    """Yield the epoch-ms timestamp of every line of an audit log and its segments, for counting."""
+    for segment in segment_paths(path):
+        f = _open(segment)
+        if f is None:
+            continue
+        with f:
+            for line in f:
+                ts = line_ts(line)
+                if ts is None:
+                    entry = parse_line(line)
+                    if entry is None:
+                        continue
+                    ts = entry["ts"]
+                yield ts
+
+
+def _iter_lines_reverse(f, end, block_size):
+    """
+    Yield (offset, line) for the complete lines of a binary file before end, last first.
+
+    Text after the last newline is a record still being written and is skipped.
+    """
+    position = end
+    head = b""
+    partial = True
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        f.seek(position)
+        block = f.read(size) + head
+        lines = block.split(b"\n")
+        # The first piece may continue in the previous block
+        head = lines[0]
+        if partial:
+            if len(lines) == 1:
+                continue
+            partial = False
+        cursor = position + len(block)
+        for line in reversed(lines[1:]):
+            start = cursor - len(line)
+            if line and cursor < end:
+                yield start, line
+            cursor = start - 1
+    if head and not partial:
+        yield 0, head
+
+
+def make_cursor(segment, inode, offset):
+    """Opaque position of a line: segment name, its inode (stable across rotation) and byte offset."""
+    return f"{os.path.basename(segment)}:{inode}:{offset}"
+
+
+def _parse_cursor(cursor):
+    try:
+        name, inode, offset = cursor.rsplit(":", 2)
+        return name, int(inode), int(offset)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid cursor {cursor!r}")
+
+
+def iter_entries_reverse(path, cursor=None, block_size=REVERSE_BLOCK_SIZE):
+    """
+    Yield (cursor, entry) for an audit log and its rotated segments, newest first.
+
+    Files are read backwards in blocks from their end, so the cost depends on
+    how many lines are consumed, not on the size of the log. Passing a
+    yielded cursor back resumes with the entries older than that one, even
+    if the segment it points into has been rotated since (it is found again
+    by inode). Raises ValueError for a malformed cursor.
+    """
+    segments = list(reversed(segment_paths(path)))
+    end = None
+    if cursor is not None:
+        name, inode, end = _parse_cursor(cursor)
+        for position, segment in enumerate(segments):
+            try:
+                if os.stat(segment).st_ino == inode:
+                    break
+            except FileNotFoundError:
+                continue
+        else:
+            return  # the segment has been pruned
+        segments = segments[position:]
+
+    for segment in segments:
+        try:
+            f = open(segment, "rb")
+        except FileNotFoundError:
+            continue
+        with f:
+            stat = os.fstat(f.fileno())
+            for offset, line in _iter_lines_reverse(f, stat.st_size if end is None else end, block_size):
+                entry = parse_line(line.decode("utf-8", errors="replace"))
+                if entry is not None:
+                    yield make_cursor(segment, stat.st_ino, offset), entry
+        end = None
+
+
+def service_for_endpoint(endpoint):
+    """Name of the AI service an endpoint belongs to, or None."""
+    for prefix, service in SERVICE_PREFIXES:
+        if endpoint.startswith(prefix):
+            return service
+    return None
+
+
+def format_details(entry):
+    """The " | "-joined detail text of an entry, as shown in the legacy format."""
+    parts = [f"{entry.get('method', '')} {entry.get('endpoint', '')}"]
+    for label, field in _TEXT_LABELS.items():
+        value = entry.get(field)
+        if value is not None:
+            unit = "ms" if field in _FLOAT_FIELDS else ""
+            parts.append(f"{label}: {value}{unit}")
+    return " | ".join(parts)
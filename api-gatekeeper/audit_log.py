@@ -0,0 +1,424 @@
+"""
+Asynchronous, batched audit log writer.
+
+Request threads only put a compact record tuple on a bounded queue; a
+background thread formats records and appends them to the audit file in
+batches, so request latency does not depend on disk I/O.
+
+Settings (environment):
+
+* AUDIT_FLUSH_INTERVAL: seconds a batch may wait to fill before it is written.
+* AUDIT_BATCH_SIZE: most records written in one batch.
+* AUDIT_QUEUE_SIZE: records that may wait in the queue.
+* AUDIT_FSYNC: "never" (leave it to the OS), "interval" (fsync at most every
+  AUDIT_FSYNC_INTERVAL seconds) or "always" (after every batch).
+* AUDIT_OVERFLOW: what happens when the queue is full:
+    - "block": wait up to AUDIT_BLOCK_TIMEOUT for space, then drop.
+    - "drop": drop the record at once.
+    - "spill" (default): the request thread writes the record to the file
+      itself, so nothing is lost and only overflowing requests pay for I/O.
+  Dropped and spilled records are counted in audit_dropped_total and
+  audit_spilled_total.
+
+Segments (AUDIT_ROTATION):
+
+* "hourly" (default): the active file is rolled over when a batch belongs
+  to a later hour than the file's first record, to "<file>.YYYY-mm-dd_HH"
+  (the segment's starting hour, UTC), like TimedRotatingFileHandler.
+  Segments older than AUDIT_RETENTION_HOURS are deleted.
+* "size": the old scheme, rolling over at max_bytes to "<file>.1" ... ".N".
+
+Every segment has a sparse index, "<segment>.idx", with one
+"<epoch ms> <byte offset>" line per AUDIT_INDEX_INTERVAL bytes written
+(always including offset 0), naming the earliest record of the batch that
+starts at that offset. Readers use it to seek straight to a time range
+instead of scanning from byte 0; see segment_paths() and index_offset().
+
+Rotation is safe with several worker processes: every batch is appended
+under an exclusive flock on "<file>.lock". A writer whose file was rotated
+by another worker notices the inode change and reopens the file, so no
+worker keeps writing into a rotated file.
+"""
+
+import atexit
+import calendar
+import fcntl
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", "0.5"))
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", "512"))
+AUDIT_QUEUE_SIZE = int(os.environ.get("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_FSYNC = os.environ.get("AUDIT_FSYNC", "interval")
+AUDIT_FSYNC_INTERVAL = float(os.environ.get("AUDIT_FSYNC_INTERVAL", "5"))
+AUDIT_OVERFLOW = os.environ.get("AUDIT_OVERFLOW", "spill")
+AUDIT_BLOCK_TIMEOUT = float(os.environ.get("AUDIT_BLOCK_TIMEOUT", "0.1"))
+AUDIT_ROTATION = os.environ.get("AUDIT_ROTATION", "hourly")
+# Hourly segments are kept long enough for the dashboard's 30-day view
+AUDIT_RETENTION_HOURS = int(os.environ.get("AUDIT_RETENTION_HOURS", str(30 * 24)))
+AUDIT_INDEX_INTERVAL = int(os.environ.get("AUDIT_INDEX_INTERVAL", str(64 * 1024)))
+
+OVERFLOW_POLICIES = ("block", "drop", "spill")
+FSYNC_POLICIES = ("never", "interval", "always")
+ROTATION_POLICIES = ("hourly", "size")
+
+INDEX_SUFFIX = ".idx"
+SEGMENT_TIME_FORMAT = "%Y-%m-%d_%H"
+_SEGMENT_SUFFIX = re.compile(r"\d{4}-\d{2}-\d{2}_\d{2}(\.\d+)?$")
+
+# Records from different workers can reach the file slightly out of order,
+# so index lookups start this much before the requested time
+INDEX_SLACK_MS = 60 * 1000
+
+_STOP = object()
+
+
+def _hour(ts_ms):
+    return ts_ms // 3600000
+
+
+def segment_paths(path):
+    """Rotated segments of an audit log (oldest first) followed by the active file."""
+    directory, base = os.path.split(os.path.abspath(path))
+    rotated = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    for name in names:
+        if not name.startswith(base + ".") or name.endswith(INDEX_SUFFIX):
+            continue
+        suffix = name[len(base) + 1:]
+        if suffix.isdigit() or _SEGMENT_SUFFIX.match(suffix):
+            segment = os.path.join(directory, name)
+            try:
+                rotated.append((os.stat(segment).st_mtime, name, segment))
+            except FileNotFoundError:
+                continue
+    # Last-write order also orders numbered backups (.5 is older than .1)
+    segments = [segment for _, _, segment in sorted(rotated)]
+    if os.path.exists(path):
+        segments.append(path)
+    return segments
+
+
+def read_index(segment):
+    """(epoch ms, byte offset) entries of a segment's sparse index in file order; [] if it has none."""
+    entries = []
+    try:
+        with open(segment + INDEX_SUFFIX, "r") as f:
+            for line in f:
+                ts, _, offset = line.partition(" ")
+                try:
+                    entries.append((int(ts), int(offset)))
+                except ValueError:
+                    continue  # a torn last line
+    except FileNotFoundError:
+        return []
+    return entries
+
+
+def index_offset(segment, since_ms):
+    """Byte offset to start reading segment from for records at or after since_ms."""
+    target = since_ms - INDEX_SLACK_MS
+    offset = 0
+    for ts, entry_offset in read_index(segment):
+        if ts >= target:
+            break
+        # Records at or after target may still follow in this entry's stretch of the file
+        offset = entry_offset
+    return offset
+
+
+class AuditLogWriter:
+    """
+    Bounded queue of audit records drained by a background batch writer.
+
+    Records are tuples whose first item is the record's epoch-seconds
+    timestamp (e.g. audit_format.AuditRecord); it drives the sparse index
+    and hourly rotation.
+
+    Args:
+        path (str): Audit log file
+        format_record (callable): Turns a queued record into one log line (no newline)
+        max_bytes (int): With rotation="size", rotate once the file would grow past this size
+        backup_count (int): With rotation="size", rotated files kept (path.1 ... path.N)
+        rotation (str): "hourly" or "size" (see AUDIT_ROTATION)
+        on_write (callable, optional): Called with each list of records once written,
+            on the writing thread (e.g. audit_rollup.RollupStore.ingest)
+    """
+
+    def __init__(self, path, format_record, max_bytes=10 * 1024 * 1024, backup_count=5,
+                 queue_size=AUDIT_QUEUE_SIZE, flush_interval=AUDIT_FLUSH_INTERVAL,
+                 batch_size=AUDIT_BATCH_SIZE, fsync=AUDIT_FSYNC, fsync_interval=AUDIT_FSYNC_INTERVAL,
+                 overflow=AUDIT_OVERFLOW, block_timeout=AUDIT_BLOCK_TIMEOUT, rotation=AUDIT_ROTATION,
+                 retention_hours=AUDIT_RETENTION_HOURS, index_interval=AUDIT_INDEX_INTERVAL, on_write=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"AUDIT_OVERFLOW must be one of {OVERFLOW_POLICIES}, not {overflow!r}")
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"AUDIT_FSYNC must be one of {FSYNC_POLICIES}, not {fsync!r}")
+        if rotation not in ROTATION_POLICIES:
+            raise ValueError(f"AUDIT_ROTATION must be one of {ROTATION_POLICIES}, not {rotation!r}")
+        self.path = path
+        self.format_record = format_record
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.rotation = rotation
+        self.retention_hours = retention_hours
+        self.index_interval = index_interval
+        self.on_write = on_write
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()  # between the writer thread and spilling request threads
+        self._fd = None
+        self._index_fd = None
+        self._inode = None
+        self._segment_start = None  # epoch ms of the active file's first record
+        self._last_indexed = None  # byte offset of this writer's last index entry
+        self._last_fsync = time.monotonic()
+        self._lock_path = path + ".lock"
+
+        self._depth = metrics.gauge("audit_queue_depth")
+        self._dropped = metrics.counter("audit_dropped_total")
+        self._spilled = metrics.counter("audit_spilled_total")
+
+        atexit.register(self.close)
+
+    def emit(self, record):
+        """Queue one record without waiting on disk (see AUDIT_OVERFLOW for a full queue)."""
+        self._ensure_writer()
+        try:
+            if self.overflow == "block":
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+
+        if self.overflow == "spill":
+            self._spilled.inc()
+            self._write([(record[0], self.format_record(record))])
+            self._written([record])
+        else:
+            self._dropped.inc()
+
+    def close(self, timeout=5.0):
+        """Flush queued records and stop the writer thread."""
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+
+    def _ensure_writer(self):
+        # Started lazily so each forked worker runs its own
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                return
+            batch = [record]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    record = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stop = True
+                    break
+                batch.append(record)
+            self._depth.set(self._queue.qsize())
+
+            lines = []
+            written = []
+            for record in batch:
+                try:
+                    lines.append((record[0], self.format_record(record)))
+                    written.append(record)
+                except Exception as e:
+                    logger.error(f"Could not format audit record {record!r}: {e}")
+            try:
+                self._write(lines)
+            except Exception as e:
+                self._dropped.inc(len(lines))
+                logger.error(f"Failed to write audit log: {e}")
+            else:
+                self._written(written)
+            if stop:
+                return
+
+    def _written(self, records):
+        if self.on_write is None or not records:
+            return
+        try:
+            self.on_write(records)
+        except Exception as e:
+            logger.error(f"Audit on_write hook failed: {e}")
+
+    def _write(self, lines):
+        """Append (timestamp, line) pairs as one batch."""
+        if not lines:
+            return
+        data = ("\n".join(line for _, line in lines) + "\n").encode("utf-8")
+        earliest = int(min(ts for ts, _ in lines) * 1000)
+        started = time.perf_counter()
+        with self._write_lock, open(self._lock_path, "a") as lock_file:
+            # Serialises appends and rotation across worker processes
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._reopen_if_rotated()
+                size = os.fstat(self._fd).st_size
+                if self._should_rotate(size, len(data), earliest):
+                    self._rotate()
+                    size = 0
+                if self._segment_start is None:
+                    self._segment_start = earliest
+                self._index(earliest, size)
+                os.write(self._fd, data)
+                self._sync()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        metrics.counter("audit_records_total").inc(len(lines))
+        metrics.summary("audit_batch_records").observe(len(lines))
+        metrics.summary("audit_write_seconds").observe(time.perf_counter() - started)
+
+    def _should_rotate(self, size, incoming, earliest):
+        if size == 0:
+            return False
+        if self.rotation == "hourly":
+            return self._segment_start is not None and _hour(earliest) > _hour(self._segment_start)
+        return bool(self.max_bytes) and size + incoming > self.max_bytes
+
+    def _index(self, ts_ms, offset):
+        # Called with the file lock held; other workers' entries only make the index denser
+        if offset == 0 or self._last_indexed is None or offset - self._last_indexed >= self.index_interval:
+            os.write(self._index_fd, f"{ts_ms} {offset}\n".encode("ascii"))
+            self._last_indexed = offset
+
+    def _open(self):
+        # Called with the file lock held
+        if self._fd is not None:
+            os.close(self._fd)
+            os.close(self._index_fd)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._index_fd = os.open(self.path + INDEX_SUFFIX, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        stat = os.fstat(self._fd)
+        self._inode = stat.st_ino
+        self._last_indexed = None
+        if not stat.st_size:
+            # An index left behind by a deleted log would point past the new file's end
+            os.ftruncate(self._index_fd, 0)
+        index = read_index(self.path)
+        if index:
+            self._segment_start = index[0][0]
+        elif stat.st_size:
+            # A file written before indexing existed; date it by its last write
+            self._segment_start = int(stat.st_mtime * 1000)
+        else:
+            self._segment_start = None
+
+    def _reopen_if_rotated(self):
+        # Called with the file lock held
+        try:
+            current = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            current = None
+        if self._fd is None or current != self._inode:
+            self._open()
+
+    def _rotate(self):
+        # Called with the file lock held
+        if self.rotation == "hourly":
+            self._rotate_hourly()
+        else:
+            self._rotate_numbered()
+        self._open()
+
+    def _rename(self, source, target):
+        os.replace(source, target)
+        if os.path.exists(source + INDEX_SUFFIX):
+            os.replace(source + INDEX_SUFFIX, target + INDEX_SUFFIX)
+
+    def _rotate_numbered(self):
+        # Same naming as RotatingFileHandler
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                self._rename(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            self._rename(self.path, f"{self.path}.1")
+        else:
+            os.truncate(self.path, 0)
+            os.truncate(self.path + INDEX_SUFFIX, 0)
+
+    def _rotate_hourly(self):
+        segment = f"{self.path}.{time.strftime(SEGMENT_TIME_FORMAT, time.gmtime(self._segment_start / 1000))}"
+        target, copy = segment, 0
+        while os.path.exists(target):
+            # Clock changes can revisit an hour; keep both segments
+            copy += 1
+            target = f"{segment}.{copy}"
+        self._rename(self.path, target)
+        self._prune()
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_hours * 3600
+        base = os.path.basename(self.path)
+        for segment in segment_paths(self.path)[:-1]:
+            suffix = os.path.basename(segment)[len(base) + 1:]
+            if not _SEGMENT_SUFFIX.match(suffix):
+                continue
+            started = calendar.timegm(time.strptime(suffix[:13], SEGMENT_TIME_FORMAT))
+            # A segment holds one hour, so it is past retention once its hour has ended before cutoff
+            if started + 3600 < cutoff:
+                for name in (segment, segment + INDEX_SUFFIX):
+                    try:
+                        os.remove(name)
+                    except FileNotFoundError:
+                        pass
+
+    def _sync(self):
+        if self.fsync == "always" or (
+                self.fsync == "interval" and time.monotonic() - self._last_fsync >= self.fsync_interval):
+            os.fsync(self._fd)
+            self._last_fsync = time.monotonic()
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "overflow": self.overflow,
+            "fsync": self.fsync,
+            "rotation": self.rotation,
+            "dropped": self._dropped.value,
+            "spilled": self._spilled.value
+        }
@@ -0,0 +1,322 @@
+"""
+Persistent rollups of the audit stream for the dashboard.
+
+Counters for requests, errors and a latency histogram are kept per minute,
+hour and day, overall and per service, user and event, in a SQLite
+database in WAL mode shared by every worker. Each worker's audit writer
+passes every batch it writes to ingest(), which folds it into the buckets
+in one transaction, so the dashboard's 24h/7d/30d views are a query over
+at most a few thousand rows however large the log has grown.
+
+Records written before the rollup database existed are folded in once by
+a background backfill from the audit log segments. The database's
+creation time splits the two sources: the backfill covers records older
+than it and live ingestion covers the rest, so nothing is counted twice.
+If the database cannot be used, ingestion is skipped and logged (the
+audit log itself is unaffected).
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import audit_format
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# On the persisted data volume, so a restart does not re-run the backfill; in its
+# own directory, since its frequent writes would wake watchers of /app/data
+AUDIT_ROLLUP_DB = os.environ.get("AUDIT_ROLLUP_DB", "/app/data/rollups/audit_rollups.db")
+AUDIT_LOG_FILE = os.environ.get("AUDIT_LOG_FILE", "/var/log/ai-gateway/audit.log")
+
+# How long finer buckets are kept; day buckets are kept indefinitely
+ROLLUP_MINUTE_RETENTION_HOURS = float(os.environ.get("ROLLUP_MINUTE_RETENTION_HOURS", "48"))
+ROLLUP_HOUR_RETENTION_DAYS = float(os.environ.get("ROLLUP_HOUR_RETENTION_DAYS", "90"))
+ROLLUP_PRUNE_INTERVAL = 600
+
+RESOLUTIONS = {"minute": 60, "hour": 3600, "day": 86400}
+
+# Upper bounds (ms) of the latency histogram buckets; one more bucket takes the rest
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000)
+_HISTOGRAM_COLUMNS = [f"h{i}" for i in range(len(LATENCY_BUCKETS_MS) + 1)]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    dimension TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    latency_count INTEGER NOT NULL DEFAULT 0,
+    latency_sum REAL NOT NULL DEFAULT 0,
+    {", ".join(f"{column} INTEGER NOT NULL DEFAULT 0" for column in _HISTOGRAM_COLUMNS)},
+    PRIMARY KEY (resolution, dimension, bucket)
+);
+CREATE TABLE IF NOT EXISTS rollup_meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+_COUNTER_COLUMNS = ["requests", "errors", "latency_count", "latency_sum"] + _HISTOGRAM_COLUMNS
+_UPSERT = (
+    f"INSERT INTO rollups (resolution, bucket, dimension, {', '.join(_COUNTER_COLUMNS)}) "
+    f"VALUES (?, ?, ?, {', '.join('?' for _ in _COUNTER_COLUMNS)}) "
+    f"ON CONFLICT (resolution, dimension, bucket) DO UPDATE SET "
+    + ", ".join(f"{column} = {column} + excluded.{column}" for column in _COUNTER_COLUMNS)
+)
+
+
+def _histogram_index(latency_ms):
+    for index, bound in enumerate(LATENCY_BUCKETS_MS):
+        if latency_ms <= bound:
+            return index
+    return len(LATENCY_BUCKETS_MS)
+
+
+def dimensions_for(event, endpoint, user):
+    """Dimensions a record counts towards besides "all"."""
+    dimensions = [f"event:{event}"]
+    service = audit_format.service_for_endpoint(endpoint or "")
+    if service:
+        dimensions.append(f"service:{service}")
+    if user and user != "unknown":
+        dimensions.append(f"user:{user}")
+    return dimensions
+
+
+def is_error(event, status):
+    """Whether a record counts as an error on the dashboard."""
+    return event == "ERROR" or (status or 0) >= 500
+
+
+def aggregate(records, into=None):
+    """
+    Fold (ts_ms, event, endpoint, user, status, latency_ms) tuples into bucket counters.
+
+    Returns {(resolution, bucket, dimension): [counter values in _COUNTER_COLUMNS order]}.
+    """
+    buckets = {} if into is None else into
+    histogram_offset = 4
+    for ts_ms, event, endpoint, user, status, latency_ms in records:
+        seconds = ts_ms // 1000
+        error = is_error(event, status)
+        histogram = _histogram_index(latency_ms) if latency_ms is not None else None
+        for dimension in ["all"] + dimensions_for(event, endpoint, user):
+            for resolution, width in RESOLUTIONS.items():
+                key = (resolution, seconds - seconds % width, dimension)
+                counters = buckets.get(key)
+                if counters is None:
+                    counters = buckets[key] = [0] * len(_COUNTER_COLUMNS)
+                counters[0] += 1
+                if error:
+                    counters[1] += 1
+                if histogram is not None:
+                    counters[2] += 1
+                    counters[3] += latency_ms
+                    counters[histogram_offset + histogram] += 1
+    return buckets
+
+
+def percentile(histogram, p):
+    """Approximate percentile (ms) from histogram counts, interpolated within its bucket."""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = p * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            lower = LATENCY_BUCKETS_MS[index - 1] if index else 0
+            if index == len(LATENCY_BUCKETS_MS):
+                return float(lower)
+            upper = LATENCY_BUCKETS_MS[index]
+            return round(lower + (upper - lower) * (rank - seen) / count, 1)
+        seen += count
+    return float(LATENCY_BUCKETS_MS[-1])
+
+
+class RollupStore:
+    """
+    Minute/hour/day counters of the audit stream, shared through SQLite.
+
+    Args:
+        db_path (str): Database file, shared by every worker on the host
+        log_path (str): Audit log the one-off backfill reads
+    """
+
+    def __init__(self, db_path=AUDIT_ROLLUP_DB, log_path=AUDIT_LOG_FILE):
+        self.db_path = db_path
+        self.log_path = log_path
+        self._local = threading.local()
+        self._schema_ready = False
+        self._lock = threading.Lock()
+        self._live_from = None
+        self._backfill = None
+        self._last_prune = 0.0
+
+    def _connection(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            if not self._schema_ready:
+                with self._lock:
+                    db.executescript(SCHEMA)
+                    self._schema_ready = True
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def live_from(self):
+        """Epoch ms from which records are counted by ingest() rather than the backfill."""
+        if self._live_from is None:
+            with self._transaction() as db:
+                db.execute("INSERT OR IGNORE INTO rollup_meta (name, value) VALUES ('live_from', ?)",
+                           (int(time.time() * 1000),))
+                self._live_from = db.execute(
+                    "SELECT value FROM rollup_meta WHERE name = 'live_from'").fetchone()[0]
+        return self._live_from
+
+    def ingest(self, records):
+        """Fold a batch of audit records (AuditRecord tuples) into the rollups."""
+        try:
+            live_from = self.live_from()
+            self._ensure_backfill()
+            buckets = aggregate(
+                (int(record.ts * 1000), record.event, record.endpoint, record.user, record.status,
+                 record.latency_ms)
+                for record in records if record.ts * 1000 >= live_from
+            )
+            self._apply(buckets)
+            self._prune()
+        except sqlite3.Error as e:
+            metrics.counter("rollup_errors_total").inc()
+            logger.error(f"Could not update audit rollups: {e}")
+
+    def _apply(self, buckets, db=None):
+        if not buckets:
+            return
+        rows = [key + tuple(counters) for key, counters in buckets.items()]
+        started = time.perf_counter()
+        if db is not None:
+            db.executemany(_UPSERT, rows)
+        else:
+            with self._transaction() as db:
+                db.executemany(_UPSERT, rows)
+        metrics.summary("rollup_apply_seconds").observe(time.perf_counter() - started)
+
+    def _ensure_backfill(self):
+        # One thread per worker; the database flag lets only one worker's result in
+        if self._backfill is not None:
+            return
+        with self._lock:
+            if self._backfill is None:
+                self._backfill = threading.Thread(target=self.backfill, name="rollup-backfill", daemon=True)
+                self._backfill.start()
+
+    def backfill(self):
+        """Fold records older than live_from() from the audit log into the rollups, once."""
+        try:
+            db = self._connection()
+            if db.execute("SELECT 1 FROM rollup_meta WHERE name = 'backfilled'").fetchone():
+                return False
+            live_from = self.live_from()
+            started = time.perf_counter()
+            buckets = aggregate(
+                (entry["ts"], entry.get("event"), entry.get("endpoint"), entry.get("user"),
+                 entry.get("status"), entry.get("latency_ms"))
+                for entry in audit_format.iter_entries(self.log_path) if entry["ts"] < live_from
+            )
+            with self._transaction() as db:
+                if db.execute("SELECT 1 FROM rollup_meta WHERE name = 'backfilled'").fetchone():
+                    return False
+                self._apply(buckets, db)
+                db.execute("INSERT INTO rollup_meta (name, value) VALUES ('backfilled', ?)",
+                           (int(time.time() * 1000),))
+            logger.info(f"Audit rollups backfilled from {self.log_path} "
+                        f"({len(buckets)} buckets in {time.perf_counter() - started:.1f}s)")
+            return True
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Could not backfill audit rollups: {e}")
+            return False
+
+    def _prune(self):
+        if time.monotonic() - self._last_prune < ROLLUP_PRUNE_INTERVAL:
+            return
+        self._last_prune = time.monotonic()
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("DELETE FROM rollups WHERE resolution = 'minute' AND bucket < ?",
+                       (now - ROLLUP_MINUTE_RETENTION_HOURS * 3600,))
+            db.execute("DELETE FROM rollups WHERE resolution = 'hour' AND bucket < ?",
+                       (now - ROLLUP_HOUR_RETENTION_DAYS * 86400,))
+
+    def series(self, resolution, since, dimensions=("all",), until=None):
+        """
+        Bucket rows of a resolution from since (epoch seconds) on.
+
+        Returns a list of dicts with bucket (epoch seconds of the bucket
+        start), dimension, requests, errors, latency_count, latency_sum and
+        histogram (counts per LATENCY_BUCKETS_MS bucket), oldest first.
+        """
+        width = RESOLUTIONS[resolution]
+        since = int(since) - int(since) % width
+        until = int(until if until is not None else time.time())
+        marks = ", ".join("?" for _ in dimensions)
+        rows = self._connection().execute(
+            f"SELECT bucket, dimension, {', '.join(_COUNTER_COLUMNS)} FROM rollups "
+            f"WHERE resolution = ? AND dimension IN ({marks}) AND bucket >= ? AND bucket <= ? "
+            f"ORDER BY bucket",
+            (resolution, *dimensions, since, until)).fetchall()
+        return [{
+            "bucket": row[0],
+            "dimension": row[1],
+            "requests": row[2],
+            "errors": row[3],
+            "latency_count": row[4],
+            "latency_sum": row[5],
+            "histogram": list(row[6:])
+        } for row in rows]
+
+    def totals(self, resolution, since, dimension="all", until=None):
+        """Summed counters (and merged histogram) of one dimension over a time range."""
+        totals = {"requests": 0, "errors": 0, "latency_count": 0, "latency_sum": 0.0,
+                  "histogram": [0] * len(_HISTOGRAM_COLUMNS)}
+        for row in self.series(resolution, since, (dimension,), until):
+            for name in ("requests", "errors", "latency_count", "latency_sum"):
+                totals[name] += row[name]
+            totals["histogram"] = [a + b for a, b in zip(totals["histogram"], row["histogram"])]
+        return totals
+
+    def stats(self):
+        stats = {"db": self.db_path, "backfilled": False}
+        try:
+            db = self._connection()
+            stats["rows"] = db.execute("SELECT COUNT(*) FROM rollups").fetchone()[0]
+            stats["backfilled"] = db.execute(
+                "SELECT 1 FROM rollup_meta WHERE name = 'backfilled'").fetchone() is not None
+        except sqlite3.Error as e:
+            stats["error"] = str(e)
+        return stats
+
+
+rollup_store = RollupStore()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Audit log parsing micro-benchmark: old per-line parsing vs audit_format.
+
+Generates a synthetic audit log in both formats and times, per line:
+
+* full parse: what analyze_logs.py used to do (regex match, strptime and a
+  regex per detail field) vs audit_format.parse_line on text and JSONL;
+* time-window filtering: the dashboard's old strptime of every timestamp vs
+  audit_format.line_ts, which is all a line outside the window now costs.
+
+Usage:
+    python benchmarks/bench_audit_parse.py --lines 200000
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from datetime import datetime
+
+GATEKEEPER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, GATEKEEPER_DIR)
+
+import audit_format  # noqa: E402
+from audit_format import AuditRecord  # noqa: E402
+
+OLD_PATTERN = re.compile(
+    r'(?P<timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) UTC \| '
+    r'(?P<level>\w+) \| '
+    r'(?P<event>\w+) \| '
+    r'(?P<method>\w+) '
+    r'(?P<endpoint>/[^\|]*) \|'
+    r'(?P<details>.*)'
+)
+
+
+def old_parse(line):
+    """The per-line work analyze_logs.py did before audit_format."""
+    match = OLD_PATTERN.match(line.strip())
+    if not match:
+        return None
+    entry = {
+        'timestamp': datetime.strptime(match.group('timestamp'), '%Y-%m-%d %H:%M:%S'),
+        'level': match.group('level'),
+        'event': match.group('event'),
+        'method': match.group('method'),
+        'endpoint': match.group('endpoint'),
+        'details': match.group('details').strip(),
+    }
+    details = entry['details']
+    ip_match = re.search(r'IP: ([\d\.]+|unknown)', details)
+    entry['ip'] = ip_match.group(1) if ip_match else 'unknown'
+    if entry['event'] == 'AUTHORIZED':
+        user_match = re.search(r'User: ([^\|]+)', details)
+        service_match = re.search(r'Service: ([^\|]+)', details)
+        entry['user'] = user_match.group(1).strip() if user_match else 'unknown'
+        entry['service'] = service_match.group(1).strip() if service_match else 'unknown'
+    elif entry['event'] == 'UNAUTHORIZED':
+        key_match = re.search(r'Key: ([^\|]+)', details)
+        entry['key_partial'] = key_match.group(1).strip() if key_match else 'missing'
+    return entry
+
+
+def old_timestamp(line):
+    """The per-line work the dashboard's /stats and /analytics did to filter by time."""
+    return datetime.strptime(line[:19], '%Y-%m-%d %H:%M:%S')
+
+
+def make_records(count):
+    rng = random.Random(42)
+    started = time.time() - count
+    records = []
+    for i in range(count):
+        event = rng.choice(("AUTHORIZED", "AUTHORIZED", "AUTHORIZED", "UNAUTHORIZED", "RATE_LIMITED"))
+        records.append(AuditRecord(
+            started + i, event, "POST", rng.choice(("/chat/api/generate", "/tts/api/tts", "/image/api/generate")),
+            f"10.0.{rng.randrange(256)}.{rng.randrange(256)}", f"user{rng.randrange(50)}", "chat",
+            "abcd1234..." if event == "UNAUTHORIZED" else None, 429 if event == "RATE_LIMITED" else None))
+    return records
+
+
+def measure(parse, lines, repeats):
+    """Best-of-repeats nanoseconds per parsed line."""
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for line in lines:
+            parse(line)
+        elapsed = (time.perf_counter() - started) / len(lines) * 1e9
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lines", type=int, default=200000, help="synthetic audit lines")
+    parser.add_argument("--repeats", type=int, default=3, help="runs per variant (best is reported)")
+    args = parser.parse_args()
+
+    records = make_records(args.lines)
+    text_lines = [audit_format.format_text(r) + "\n" for r in records]
+    json_lines = [audit_format.format_jsonl(r) + "\n" for r in records]
+
+    results = [
+        ("old regex+strptime", measure(old_parse, text_lines, args.repeats)),
+        ("text parse_line", measure(audit_format.parse_line, text_lines, args.repeats)),
+        ("jsonl parse_line", measure(audit_format.parse_line, json_lines, args.repeats)),
+    ]
+    window = [
+        ("old strptime", measure(old_timestamp, text_lines, args.repeats)),
+        ("text line_ts", measure(audit_format.line_ts, text_lines, args.repeats)),
+        ("jsonl line_ts", measure(audit_format.line_ts, json_lines, args.repeats)),
+    ]
+
+    for title, rows in (("full parse", results), ("time-window filter", window)):
+        print(f"{title:>20} {'ns_per_line':>12} {'speedup':>8}")
+        for name, ns in rows:
+            print(f"{name:>20} {ns:>12.0f} {rows[0][1] / ns:>7.1f}x")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
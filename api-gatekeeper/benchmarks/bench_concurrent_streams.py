@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Concurrent-stream capacity benchmark: Flask (gunicorn sync worker) vs ASGI.
+
+Starts a fake Ollama upstream that streams NDJSON tokens slowly, launches the
+gateway in each serving mode, opens many concurrent /chat/api/generate
+streams and reports how many finish inside the deadline.
+
+Usage:
+    python benchmarks/bench_concurrent_streams.py --streams 500 --stream-seconds 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+GATEKEEPER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_API_KEY = "bench-key-0123456789"
+
+SERVER_COMMANDS = {
+    # Matches the production gunicorn invocation (one sync worker)
+    "flask": ["gunicorn", "-w", "1", "-b", "127.0.0.1:{port}", "app:app"],
+    "asgi": ["uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", "{port}",
+             "--log-level", "warning"],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def fake_ollama(reader, writer, tokens, stream_seconds):
+    """Minimal HTTP/1.1 server streaming tokens NDJSON lines over stream_seconds."""
+    try:
+        while True:
+            headers = {}
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length:
+                await reader.readexactly(length)
+
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                         b"Transfer-Encoding: chunked\r\n\r\n")
+            for i in range(tokens):
+                chunk = json.dumps({"response": f"tok{i}", "done": i == tokens - 1}).encode() + b"\n"
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                await writer.drain()
+                await asyncio.sleep(stream_seconds / tokens)
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+def start_gateway(mode, port, upstream_url, workdir):
+    keys_file = os.path.join(workdir, "keys.json")
+    with open(keys_file, "w") as f:
+        json.dump({BENCH_API_KEY: {"user": "bench", "service": "all", "created_at": ""}}, f)
+
+    env = dict(
+        os.environ,
+        API_KEYS_FILE=keys_file,
+        AUDIT_LOG_FILE=os.path.join(workdir, "audit.log"),
+        OLLAMA_URL=upstream_url,
+        LOG_LEVEL="WARNING",
+    )
+    command = [part.format(port=port) for part in SERVER_COMMANDS[mode]]
+    process = subprocess.Popen(command, cwd=GATEKEEPER_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/health", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{mode} gateway did not start on port {port}")
+
+
+async def run_streams(port, streams, deadline):
+    results = []
+
+    async def one_stream(client):
+        started = time.perf_counter()
+        ttfb = None
+        try:
+            async with client.stream(
+                "POST", f"http://127.0.0.1:{port}/chat/api/generate",
+                headers={"X-API-Key": BENCH_API_KEY},
+                json={"model": "bench", "prompt": "hi"}
+            ) as response:
+                async for _ in response.aiter_bytes():
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - started
+                results.append((response.status_code == 200, ttfb, time.perf_counter() - started))
+        except (httpx.HTTPError, asyncio.CancelledError):
+            results.append((False, ttfb, time.perf_counter() - started))
+
+    limits = httpx.Limits(max_connections=streams, max_keepalive_connections=0)
+    async with httpx.AsyncClient(limits=limits, timeout=deadline) as client:
+        tasks = [asyncio.create_task(one_stream(client)) for _ in range(streams)]
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    return results
+
+
+def summarize(mode, results, streams, wall):
+    completed = [r for r in results if r[0]]
+    ttfbs = sorted(r[1] for r in completed if r[1] is not None)
+
+    def pct(values, p):
+        return values[min(int(len(values) * p), len(values) - 1)] * 1000 if values else float("nan")
+
+    return {
+        "mode": mode,
+        "streams": streams,
+        "completed": len(completed),
+        "ttfb_p50_ms": round(pct(ttfbs, 0.50), 1),
+        "ttfb_p99_ms": round(pct(ttfbs, 0.99), 1),
+        "mean_stream_s": round(statistics.mean(r[2] for r in completed), 2) if completed else None,
+        "wall_s": round(wall, 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--streams", type=int, default=200, help="concurrent streams to open")
+    parser.add_argument("--stream-seconds", type=float, default=5.0, help="duration of each upstream stream")
+    parser.add_argument("--tokens", type=int, default=50, help="NDJSON lines per stream")
+    parser.add_argument("--deadline", type=float, default=30.0, help="seconds to wait for all streams")
+    parser.add_argument("--modes", default="flask,asgi", help="comma-separated serving modes")
+    args = parser.parse_args()
+
+    upstream_port = free_port()
+    server = await asyncio.start_server(
+        lambda r, w: fake_ollama(r, w, args.tokens, args.stream_seconds),
+        "127.0.0.1", upstream_port, backlog=4096
+    )
+
+    summaries = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in args.modes.split(","):
+            port = free_port()
+            process = start_gateway(mode, port, f"http://127.0.0.1:{upstream_port}", workdir)
+            try:
+                started = time.perf_counter()
+                results = await run_streams(port, args.streams, args.deadline)
+                summaries.append(summarize(mode, results, args.streams, time.perf_counter() - started))
+            finally:
+                process.terminate()
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    # gunicorn waits for in-flight streams on SIGTERM
+                    process.kill()
+                    process.wait()
+
+    server.close()
+
+    columns = ["mode", "streams", "completed", "ttfb_p50_ms", "ttfb_p99_ms", "mean_stream_s", "wall_s"]
+    print(" ".join(f"{c:>14}" for c in columns))
+    for summary in summaries:
+        print(" ".join(f"{str(summary[c]):>14}" for c in columns))
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
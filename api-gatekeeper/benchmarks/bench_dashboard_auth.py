@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Dashboard auth overhead micro-benchmark: jwt.decode per request vs cached.
+
+Runs require_dashboard_auth around a no-op view inside a Flask request
+context, once with the decoded-JWT cache effectively disabled (the old
+behaviour: every call decodes and verifies the token) and once with it
+enabled, and reports the per-request auth cost of each.
+
+Usage:
+    python benchmarks/bench_dashboard_auth.py --requests 20000
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+GATEKEEPER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, GATEKEEPER_DIR)
+
+import jwt  # noqa: E402
+from flask import Flask  # noqa: E402
+
+import dashboard_api  # noqa: E402
+from token_cache import VerifiedTokenCache  # noqa: E402
+
+
+def make_token():
+    return jwt.encode({
+        'email': 'bench@selfmind.dev',
+        'role': 'admin',
+        'exp': datetime.utcnow() + timedelta(hours=1)
+    }, dashboard_api.JWT_SECRET, algorithm=dashboard_api.JWT_ALGORITHM)
+
+
+def decode(token):
+    return jwt.decode(token, dashboard_api.JWT_SECRET, algorithms=[dashboard_api.JWT_ALGORITHM])
+
+
+def measure(app, view, token, requests, repeats):
+    """Best-of-repeats mean microseconds per authenticated call."""
+    headers = {'Authorization': f'Bearer {token}'}
+    runs = []
+    with app.test_request_context('/api/dashboard/stats', headers=headers):
+        for _ in range(repeats):
+            started = time.perf_counter()
+            for _ in range(requests):
+                view()
+            runs.append((time.perf_counter() - started) / requests * 1e6)
+    return min(runs), statistics.mean(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=20000, help="authenticated calls per run")
+    parser.add_argument("--repeats", type=int, default=5, help="runs per variant (best is reported)")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    token = make_token()
+    view = dashboard_api.require_dashboard_auth(lambda: 'ok')
+
+    variants = [
+        # size=0 keeps nothing, so every call decodes like the uncached decorator did
+        ("uncached", VerifiedTokenCache("bench_uncached", decode, size=0)),
+        ("cached", VerifiedTokenCache("bench_cached", decode)),
+    ]
+
+    results = []
+    for name, cache in variants:
+        dashboard_api.dashboard_token_cache = cache
+        best, mean = measure(app, view, token, args.requests, args.repeats)
+        results.append((name, best, mean))
+
+    print(f"{'variant':>10} {'best_us':>10} {'mean_us':>10}")
+    for name, best, mean in results:
+        print(f"{name:>10} {best:>10.2f} {mean:>10.2f}")
+    print(f"speedup: {results[0][1] / results[1][1]:.1f}x")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Dashboard /logs benchmark: reading the whole log vs reading it backwards.
+
+Writes a synthetic audit log of --lines records through AuditLogWriter into
+a temporary directory, then times fetching the newest --limit entries the
+old way (readlines() of the whole file, keep the tail, parse it) and through
+audit_format.iter_entries_reverse, which reads blocks back from the end.
+Both must return the same entries.
+
+Usage:
+    python benchmarks/bench_logs_tail.py --lines 1000000 --limit 100
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+GATEKEEPER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, GATEKEEPER_DIR)
+
+import audit_format  # noqa: E402
+from audit_format import AuditRecord  # noqa: E402
+from audit_log import AuditLogWriter  # noqa: E402
+
+
+def write_log(path, count, fmt):
+    # One size-rotated file large enough to hold everything, like an unrotated log
+    writer = AuditLogWriter(path, audit_format.formatter(fmt), rotation="size", max_bytes=0, fsync="never")
+    started = time.time() - count
+    batch = []
+    for i in range(count):
+        ts = started + i
+        batch.append((ts, writer.format_record(AuditRecord(
+            ts, "AUTHORIZED", "POST", "/chat/api/generate", "10.0.0.1", f"user{i}", "chat",
+            status=200, latency_ms=42.0, bytes=512))))
+        if len(batch) == writer.batch_size or i == count - 1:
+            writer._write(batch)
+            batch = []
+    return os.path.getsize(path)
+
+
+def read_all(path, limit):
+    """What /logs did before: read every line, keep the last limit."""
+    with open(path, "r") as f:
+        lines = f.readlines()
+    return [audit_format.parse_line(line) for line in reversed(lines[-limit:])]
+
+
+def read_reverse(path, limit):
+    return [entry for _, entry in itertools.islice(audit_format.iter_entries_reverse(path), limit)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lines", type=int, default=1000000, help="synthetic audit lines")
+    parser.add_argument("--limit", type=int, default=100, help="entries per page")
+    parser.add_argument("--format", choices=audit_format.FORMATS, default="text")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "audit.log")
+        size = write_log(path, args.lines, args.format)
+        print(f"wrote {args.lines} records ({size / 1e6:.0f} MB)")
+
+        results = {}
+        for name, read in (("readlines", read_all), ("reverse", read_reverse)):
+            started = time.perf_counter()
+            results[name] = read(path, args.limit)
+            print(f"{name:>10}: {len(results[name])} entries in {(time.perf_counter() - started) * 1000:.1f} ms")
+        assert results["readlines"] == results["reverse"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Dashboard analytics benchmark: scanning the audit log vs querying rollups.
+
+Writes --days of synthetic audit records through AuditLogWriter (with the
+rollup store as its on_write hook) into a temporary directory, then times
+the 24h, 7d and 30d analytics queries done by scanning the log segments
+and by reading hourly rollups. Both must count the same requests.
+
+Usage:
+    python benchmarks/bench_rollups.py --days 30 --rate 0.5
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+GATEKEEPER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, GATEKEEPER_DIR)
+
+import audit_format  # noqa: E402
+from audit_format import AuditRecord  # noqa: E402
+from audit_log import AuditLogWriter  # noqa: E402
+from audit_rollup import RollupStore  # noqa: E402
+
+ENDPOINTS = ("/chat/api/generate", "/tts/api/speak", "/image/api/generate", "/whisper/api/transcribe")
+
+
+def write_log(path, store, days, rate):
+    writer = AuditLogWriter(path, audit_format.format_jsonl, rotation="hourly",
+                            retention_hours=days * 24 + 1, fsync="never", on_write=store.ingest)
+    rng = random.Random(7)
+    now = time.time()
+    count = int(days * 86400 * rate)
+    batch = []
+    for i in range(count):
+        ts = now - days * 86400 + i / rate
+        batch.append(AuditRecord(ts, "AUTHORIZED", "POST", rng.choice(ENDPOINTS), "10.0.0.1",
+                                 f"user{rng.randrange(20)}", "all", status=rng.choice((200,) * 19 + (502,)),
+                                 latency_ms=round(rng.expovariate(1 / 300), 1), bytes=512))
+        if len(batch) == writer.batch_size or i == count - 1:
+            writer._write([(record.ts, writer.format_record(record)) for record in batch])
+            writer._written(batch)
+            batch = []
+            os.utime(writer.path, (ts, ts))
+    return count
+
+
+def scan(path, since):
+    return sum(1 for _ in audit_format.iter_entries(path, since_ms=int(since * 1000)))
+
+
+def rollups(store, since):
+    return sum(row["requests"] for row in store.series("hour", since))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--days", type=float, default=30, help="days of history to generate")
+    parser.add_argument("--rate", type=float, default=0.5, help="records per second of history")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "audit.log")
+        store = RollupStore(os.path.join(workdir, "rollups.db"), path)
+        # Everything generated here is live, so there is nothing to backfill
+        with store._transaction() as db:
+            db.execute("INSERT INTO rollup_meta (name, value) VALUES ('live_from', 0), ('backfilled', 0)")
+
+        started = time.perf_counter()
+        count = write_log(path, store, args.days, args.rate)
+        print(f"wrote and rolled up {count} records in {time.perf_counter() - started:.1f}s")
+
+        print(f"{'window':>7} {'scan_ms':>10} {'rollup_ms':>10} {'requests':>10}")
+        for label, hours in (("24h", 24), ("7d", 24 * 7), ("30d", 24 * 30)):
+            # Rollups are hour-aligned, so compare from the start of an hour
+            since = time.time() - hours * 3600
+            since -= since % 3600
+            started = time.perf_counter()
+            scanned = scan(path, since)
+            scan_ms = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            rolled = rollups(store, since)
+            rollup_ms = (time.perf_counter() - started) * 1000
+            assert scanned == rolled, (scanned, rolled)
+            print(f"{label:>7} {scan_ms:>10.1f} {rollup_ms:>10.2f} {rolled:>10}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
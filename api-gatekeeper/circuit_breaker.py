@@ -0,0 +1,182 @@
+"""
+Per-upstream circuit breakers.
+
+A breaker trips open when an upstream's recent error rate or slow-call rate
+crosses its threshold; while open, requests fail fast with 503 instead of
+waiting on connect errors or timeouts. After a cool-down it lets a few
+half-open trial requests through and closes again if they succeed.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+BREAKER_WINDOW_SECONDS = float(os.environ.get("BREAKER_WINDOW_SECONDS", "30"))
+BREAKER_MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.environ.get("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_CALL_SECONDS = float(os.environ.get("BREAKER_SLOW_CALL_SECONDS", "60"))
+BREAKER_SLOW_CALL_RATE = float(os.environ.get("BREAKER_SLOW_CALL_RATE", "0.8"))
+BREAKER_OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", "20"))
+BREAKER_HALF_OPEN_CALLS = int(os.environ.get("BREAKER_HALF_OPEN_CALLS", "1"))
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a sliding time window of call outcomes."""
+
+    def __init__(self, name, window_seconds=BREAKER_WINDOW_SECONDS, min_calls=BREAKER_MIN_CALLS,
+                 error_rate=BREAKER_ERROR_RATE, slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+                 slow_call_rate=BREAKER_SLOW_CALL_RATE, open_seconds=BREAKER_OPEN_SECONDS,
+                 half_open_calls=BREAKER_HALF_OPEN_CALLS):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self._lock = threading.Lock()
+        self._calls = deque()  # (finished_at, failed, slow)
+        self.state = CLOSED
+        self.opened_at = None
+        self._trials = 0
+        self.last_failure = None
+
+    def allow(self):
+        """Return True if a call may go to the upstream now."""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    metrics.counter("breaker_rejections_total", upstream=self.name).inc()
+                    return False
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._trials >= self.half_open_calls:
+                    metrics.counter("breaker_rejections_total", upstream=self.name).inc()
+                    return False
+                self._trials += 1
+            return True
+
+    def record(self, failed, duration, error=None):
+        """Record the outcome of a call that allow() let through."""
+        now = time.monotonic()
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if failed:
+                self.last_failure = error or "error"
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    self._transition(OPEN)
+                else:
+                    self._transition(CLOSED)
+                return
+
+            self._calls.append((now, failed, slow))
+            while self._calls and now - self._calls[0][0] > self.window_seconds:
+                self._calls.popleft()
+
+            total = len(self._calls)
+            if self.state == CLOSED and total >= self.min_calls:
+                failures = sum(1 for _, f, _ in self._calls if f)
+                slow_calls = sum(1 for _, _, s in self._calls if s)
+                if failures / total >= self.error_rate or slow_calls / total >= self.slow_call_rate:
+                    self._transition(OPEN)
+
+    def release(self):
+        """Give back a call allow() let through whose outcome is unknown (e.g. it was cancelled)."""
+        with self._lock:
+            if self.state == HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def call(self, send, *args, **kwargs):
+        """Run send(*args, **kwargs) (an HTTP call returning a response) and record its outcome."""
+        started = time.perf_counter()
+        try:
+            response = send(*args, **kwargs)
+        except Exception as e:
+            self.record(True, time.perf_counter() - started, type(e).__name__)
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record(response.status_code >= 500, time.perf_counter() - started,
+                    f"HTTP {response.status_code}")
+        return response
+
+    def retry_after(self):
+        """Seconds until the breaker will let a trial call through (at least 1)."""
+        if self.state != OPEN:
+            return 1
+        return max(int(self.open_seconds - (time.monotonic() - self.opened_at)) + 1, 1)
+
+    def _transition(self, state):
+        # Called with the lock held
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker for {self.name}: {self.state} -> {state}")
+        metrics.counter("breaker_transitions_total", upstream=self.name, to=state).inc()
+        self.state = state
+        self._trials = 0
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._calls.clear()
+            self.opened_at = None
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            calls = [c for c in self._calls if now - c[0] <= self.window_seconds]
+            return {
+                "state": self.state,
+                "calls_in_window": len(calls),
+                "failures_in_window": sum(1 for _, f, _ in calls if f),
+                "slow_calls_in_window": sum(1 for _, _, s in calls if s),
+                "retry_after": self.retry_after(),
+                "last_failure": self.last_failure
+            }
+
+
+class BreakerRegistry:
+    """One breaker per upstream name, created on first use."""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def configure(self, name, **options):
+        """Create name's breaker with non-default thresholds (e.g. a longer slow_call_seconds)."""
+        with self._lock:
+            self._breakers[name] = CircuitBreaker(name, **options)
+        return self._breakers[name]
+
+    def get(self, name):
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(name, CircuitBreaker(name))
+        return breaker
+
+    def is_open(self, name):
+        """True while name's breaker is open and still cooling down."""
+        breaker = self._breakers.get(name)
+        return (breaker is not None and breaker.state == OPEN
+                and time.monotonic() - breaker.opened_at < breaker.open_seconds)
+
+    def stats(self):
+        return {name: breaker.stats() for name, breaker in sorted(list(self._breakers.items()))}
+
+
+# Shared by every route in the process
+breakers = BreakerRegistry()
@@ -6,14 +6,22 @@ Separate from the main API to avoid mixing concerns.
 from datetime import datetime, timedelta
 import json
 import os
-import uuid
+import time
 from functools import wraps
+import hmac
 from flask import Blueprint, jsonify, request, current_app
 import jwt
 import bcrypt
-import docker
-import psutil
 from collections import defaultdict
+from circuit_breaker import breakers
+from health_check import health_prober
+from key_db import key_db, KeyNotFound
+import audit_format
+from audit_rollup import rollup_store, percentile
+import firebase_tokens
+from log_tail import LogTailer, LOG_STREAM_HEARTBEAT
+from system_metrics import system_sampler
+from token_cache import VerifiedTokenCache
 
 # Create Blueprint for dashboard routes
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/api/dashboard')
@@ -31,14 +39,48 @@ JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production'
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24
 
-def require_dashboard_auth(f):
-    """Decorator to require dashboard authentication (separate from API keys)."""
+# /logs page size cap, and how many entries one call may scan looking for filter matches
+LOGS_MAX_LIMIT = 1000
+LOGS_MAX_SCAN = int(os.environ.get('DASHBOARD_LOGS_MAX_SCAN', '100000'))
+
+# One tailer of the audit log shared by every open /logs/stream
+audit_tailer = LogTailer(os.environ.get('AUDIT_LOG_FILE', '/var/log/ai-gateway/audit.log'))
+
+# Decoded dashboard JWTs, reused until they expire (the dashboard polls constantly)
+dashboard_token_cache = VerifiedTokenCache(
+    "dashboard_jwt",
+    lambda token: jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM]),
+    size=int(os.environ.get('DASHBOARD_TOKEN_CACHE_SIZE', '256'))
+)
+
+def require_dashboard_auth(f=None, allow_admin_key=False):
+    """
+    Decorator to require dashboard authentication (separate from API keys).
+
+    Validates the Bearer JWT through dashboard_token_cache, so a token is
+    decoded once and reused until its exp. With allow_admin_key=True a
+    matching X-Admin-Key header is accepted instead of a JWT.
+
+    Usage:
+        @require_dashboard_auth
+        @require_dashboard_auth(allow_admin_key=True)
+    """
+    if f is None:
+        return lambda view: require_dashboard_auth(view, allow_admin_key=allow_admin_key)
+
     @wraps(f)
     def decorated_function(*args, **kwargs):
         # Skip auth for OPTIONS requests (CORS preflight)
         if request.method == 'OPTIONS':
             return '', 200
-            
+
+        if allow_admin_key:
+            admin_key = request.headers.get('X-Admin-Key')
+            expected_key = os.environ.get('ADMIN_API_KEY', 'admin-key-change-in-production')
+            if admin_key and hmac.compare_digest(admin_key.encode('utf-8'), expected_key.encode('utf-8')):
+                request.dashboard_user = {"role": "admin", "via": "admin_key"}
+                return f(*args, **kwargs)
+
         auth_header = request.headers.get('Authorization')
         
         if not auth_header or not auth_header.startswith('Bearer '):
@@ -47,7 +89,7 @@ def require_dashboard_auth(f):
         token = auth_header.split(' ')[1]
         
         try:
-            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+            payload = dashboard_token_cache.verify(token)
             request.dashboard_user = payload
         except jwt.ExpiredSignatureError:
             return jsonify({"error": "Token has expired"}), 401
@@ -58,6 +100,43 @@ def require_dashboard_auth(f):
     
     return decorated_function
 
+def latency_percentiles(totals):
+    """Approximate p50/p90/p95/p99 in milliseconds from rolled-up latency histograms."""
+    histogram = totals['histogram']
+    percentiles = {f"p{int(p * 100)}": percentile(histogram, p) for p in (0.50, 0.90, 0.95, 0.99)}
+    percentiles["samples"] = totals['latency_count']
+    return percentiles
+
+def log_matches(entry, level, service, event):
+    """Whether an audit entry passes the /logs filters ('ALL'/'all' disables one)."""
+    if level != 'ALL' and entry['level'] != level:
+        return False
+    if event != 'ALL' and entry.get('event') != event:
+        return False
+    if service != 'all' and service not in (
+            audit_format.service_for_endpoint(entry.get('endpoint', '')), entry.get('service')):
+        return False
+    return True
+
+def log_stream_frames(lines, dropped):
+    """SSE frames for one batch of streamed audit lines; a heartbeat if there are none."""
+    frames = []
+    if dropped:
+        frames.append(f"data: {json.dumps({'dropped': dropped})}\n\n")
+    for line in lines:
+        frames.append(f"data: {json.dumps({'log': line.strip()})}\n\n")
+    return frames or [": heartbeat\n\n"]
+
+def log_entry(entry):
+    """Shape a parsed audit entry for the /logs response."""
+    return {
+        "timestamp": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['ts'] / 1000)),
+        "level": entry['level'],
+        "event": entry.get('event'),
+        "details": audit_format.format_details(entry),
+        **{field: entry[field] for field in audit_format.FIELDS[3:] if entry.get(field) is not None}
+    }
+
 @dashboard_bp.route('/auth/login', methods=['POST'])
 def login():
     """Authenticate dashboard admin user."""
@@ -94,7 +173,6 @@ def login():
 def firebase_auth():
     """Authenticate via Firebase ID token and return admin API key."""
     import firebase_admin
-    from firebase_admin import auth as firebase_auth
     from firebase_admin import credentials
     
     # Initialize Firebase Admin SDK if not already initialized
@@ -109,8 +187,8 @@ def firebase_auth():
     id_token = auth_header.split(' ')[1]
     
     try:
-        # Verify Firebase ID token
-        decoded_token = firebase_auth.verify_id_token(id_token)
+        # Verify Firebase ID token (cached until the token expires)
+        decoded_token = firebase_tokens.verify_id_token(id_token)
         email = decoded_token.get('email')
         
         # Check if user is authorized (you can add your own logic here)
@@ -143,196 +221,138 @@ def firebase_auth():
 def get_dashboard_stats():
     """Get overview statistics for dashboard home."""
     try:
-        # Read audit log for request stats
-        audit_log_path = os.environ.get('AUDIT_LOG_FILE', '/var/log/ai-gateway/audit.log')
-        total_requests = 0
-        requests_last_week = 0
-        week_ago = datetime.now() - timedelta(days=7)
-        
-        if os.path.exists(audit_log_path):
-            with open(audit_log_path, 'r') as f:
-                for line in f:
-                    total_requests += 1
-                    # Parse timestamp from log line
-                    try:
-                        timestamp_str = line.split(' | ')[0]
-                        timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-                        if timestamp > week_ago:
-                            requests_last_week += 1
-                    except:
-                        pass
+        # Request counters come from the audit rollups, not a scan of the log
+        now = time.time()
+        all_time = rollup_store.totals('day', 0)
+        last_week = rollup_store.totals('hour', now - 7 * 24 * 3600)
+        total_requests = all_time['requests']
+        requests_last_week = last_week['requests']
         
         # Count active API keys
-        api_keys_file = os.environ.get('API_KEYS_FILE', 'caddy_apikeys.json')
-        active_keys = 0
-        if os.path.exists(api_keys_file):
-            with open(api_keys_file, 'r') as f:
-                keys = json.load(f)
-                active_keys = len(keys)
+        active_keys = key_db.count(enabled=True)
         
-        # Get system stats
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
+        # Latest background sample, so the request never waits on psutil
+        system = system_sampler.latest()
         
-        # Calculate average response time (mock for now)
-        avg_response_time = 89  # milliseconds
+        # Average response time in milliseconds over the last week (None until requests have completed)
+        avg_response_time = (round(last_week['latency_sum'] / last_week['latency_count'], 1)
+                             if last_week['latency_count'] else None)
         
         return jsonify({
             "total_requests": total_requests,
             "requests_last_week": requests_last_week,
             "active_api_keys": active_keys,
             "avg_response_time": avg_response_time,
+            "response_time_percentiles": latency_percentiles(last_week),
             "system": {
-                "cpu_percent": cpu_percent,
-                "memory_percent": memory.percent,
-                "disk_percent": disk.percent
+                "cpu_percent": system['cpu_percent'],
+                "memory_percent": system['memory_percent'],
+                "disk_percent": system['disk_percent'],
+                "sampled_at": datetime.fromtimestamp(system['ts']).isoformat()
             }
         }), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@dashboard_bp.route('/stats/history', methods=['GET'])
+@require_dashboard_auth
+def get_stats_history():
+    """
+    Recent system samples for sparklines, oldest first.
+
+    Query parameters:
+        window: seconds of history to return (default 900, at most what the
+            sampler keeps, SYSTEM_METRICS_HISTORY samples)
+    """
+    try:
+        window = float(request.args.get('window', 900))
+        samples = system_sampler.history(since=time.time() - window)
+        return jsonify({
+            "interval": system_sampler.interval,
+            "samples": samples
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @dashboard_bp.route('/services', methods=['GET'])
 @require_dashboard_auth
 def get_service_status():
-    """Get real-time status of all services."""
+    """
+    Get the status of all services.
+
+    Served from health_prober's background checks (see health_check), with
+    each service's latency and recent probe history, instead of probing
+    Docker and the upstreams on every request.
+    """
     try:
-        client = docker.from_env()
+        breaker_stats = breakers.stats()
         services = []
+        for entry in health_prober.targets():
+            if entry["upstream"]:
+                breaker_state = breaker_stats.get(entry["upstream"])
+                entry["circuit"] = breaker_state["state"] if breaker_state else "closed"
+            services.append(entry)
         
-        # Define expected services
-        expected_services = [
-            {"name": "ai-gateway-caddy", "display_name": "Caddy Proxy", "port": 443},
-            {"name": "ai-gateway-api-gatekeeper", "display_name": "API Gateway", "port": 8080},
-            {"name": "edge-tts", "display_name": "Edge TTS", "port": 8090},
-            {"name": "ollama", "display_name": "Ollama LLM", "port": 11434, "external": True}
-        ]
-        
-        for service in expected_services:
-            status = "offline"
-            health = "unknown"
-            
-            if not service.get("external", False):
-                # Check Docker container
-                try:
-                    container = client.containers.get(service["name"])
-                    status = container.status
-                    if status == "running":
-                        health = "healthy"
-                except docker.errors.NotFound:
-                    status = "not_found"
-                    health = "error"
-            else:
-                # Check external service (like Ollama)
-                import requests
-                try:
-                    response = requests.get(f"http://localhost:{service['port']}/", timeout=2)
-                    if response.status_code < 500:
-                        status = "running"
-                        health = "healthy"
-                except:
-                    status = "offline"
-                    health = "error"
-            
-            services.append({
-                "name": service["display_name"],
-                "container": service["name"],
-                "status": status,
-                "health": health,
-                "port": service["port"]
-            })
-        
-        return jsonify({"services": services}), 200
+        return jsonify({
+            "services": services,
+            "circuit_breakers": breaker_stats
+        }), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @dashboard_bp.route('/keys', methods=['GET', 'OPTIONS'])
+@require_dashboard_auth(allow_admin_key=True)
 def get_api_keys():
-    """Get all API keys with metadata."""
-    if request.method == 'OPTIONS':
-        return '', 200
-    
-    # Check for admin key authentication
-    admin_key = request.headers.get('X-Admin-Key')
-    expected_key = os.environ.get('ADMIN_API_KEY', 'admin-key-change-in-production')
-    
-    if admin_key != expected_key:
-        # Fall back to JWT auth
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({"error": "Unauthorized"}), 401
-        
-        token = auth_header.split(' ')[1]
-        try:
-            jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        except:
-            return jsonify({"error": "Invalid token"}), 401
-        
+    """
+    Get all API keys with metadata.
+
+    Optional user, service and enabled (true/false) query parameters filter
+    the list through the key database's indexes.
+    """
     try:
-        # Read from the full metadata file if available
-        metadata_file = os.environ.get('API_KEYS_METADATA_FILE', '/app/data/apikeys_metadata.json')
-        runtime_file = os.environ.get('API_KEYS_FILE', 'caddy_apikeys.json')
+        enabled = request.args.get('enabled')
+        rows = key_db.list(
+            user=request.args.get('user'),
+            service=request.args.get('service'),
+            enabled=None if enabled is None else enabled.lower() == 'true'
+        )
         
         keys = []
-        
-        # Try metadata file first
-        if os.path.exists(metadata_file):
-            with open(metadata_file, 'r') as f:
-                api_keys = json.load(f)
-                for key_id, data in api_keys.items():
-                    keys.append({
-                        "id": key_id,
-                        "user": data.get("user", "unknown"),
-                        "service": data.get("service", "all"),
-                        "created_at": data.get("created_at", ""),
-                        "expires_at": data.get("expires_at", ""),
-                        "enabled": data.get("enabled", True),
-                        "description": data.get("description", "")
-                    })
-        elif os.path.exists(runtime_file):
-            # Fallback to runtime file
-            with open(runtime_file, 'r') as f:
-                api_keys = json.load(f)
-                for key_id, data in api_keys.items():
-                    keys.append({
-                        "id": key_id,
-                        "user": data.get("user", "unknown"),
-                        "service": data.get("service", "all"),
-                        "created_at": data.get("created_at", ""),
-                        "enabled": True
-                    })
+        for row in rows:
+            keys.append({
+                "id": row["key"],
+                "user": row["user"],
+                "service": row["service"],
+                "created_at": row["created_at"],
+                "expires_at": row["expires_at"] or "",
+                "enabled": row["enabled"],
+                "description": row["description"],
+                "rate_limit": row["extra"].get("rate_limit")
+            })
         
         return jsonify({"keys": keys}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _key_extra(data):
+    # Per-key runtime settings accepted from the dashboard (see rate_limiter.limits_for)
+    return {"rate_limit": data["rate_limit"]} if data.get("rate_limit") else None
+
+def _key_response(row):
+    return {
+        "key": row["key"],
+        "user": row["user"],
+        "service": row["service"],
+        "created_at": row["created_at"],
+        "expires_at": row["expires_at"]
+    }
+
 @dashboard_bp.route('/keys', methods=['POST', 'OPTIONS'])
+@require_dashboard_auth(allow_admin_key=True)
 def create_api_key():
     """Create a new API key."""
-    if request.method == 'OPTIONS':
-        return '', 200
-    
-    # Check for admin key authentication
-    admin_key = request.headers.get('X-Admin-Key')
-    expected_key = os.environ.get('ADMIN_API_KEY', 'admin-key-change-in-production')
-    
-    if admin_key != expected_key:
-        # Fall back to JWT auth
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({"error": "Unauthorized"}), 401
-        
-        token = auth_header.split(' ')[1]
-        try:
-            jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        except:
-            return jsonify({"error": "Invalid token"}), 401
-        
     try:
-        current_app.logger.info(f"Creating API key - Request method: {request.method}")
-        current_app.logger.info(f"Request headers: {dict(request.headers)}")
         data = request.get_json()
-        current_app.logger.info(f"Request data: {data}")
         
         # Validate input
         user = data.get('user')
@@ -343,59 +363,54 @@ def create_api_key():
         if not user:
             return jsonify({"error": "User is required"}), 400
         
-        # Generate new key
-        key_id = str(uuid.uuid4())
-        created_at = datetime.utcnow().isoformat() + 'Z'
-        expires_at = None
-        
-        if expires_days > 0:
-            expires_at = (datetime.utcnow() + timedelta(days=expires_days)).isoformat() + 'Z'
-        
-        # Read existing keys
-        metadata_file = os.environ.get('API_KEYS_METADATA_FILE', '/app/data/apikeys_metadata.json')
-        runtime_file = os.environ.get('API_KEYS_FILE', 'caddy_apikeys.json')
-        
-        # Update metadata file
-        if os.path.exists(metadata_file):
-            with open(metadata_file, 'r') as f:
-                api_keys = json.load(f)
-        else:
-            api_keys = {}
-        
-        api_keys[key_id] = {
-            "user": user,
-            "service": service,
-            "description": description,
-            "created_at": created_at,
-            "expires_at": expires_at,
-            "enabled": True
-        }
-        
-        # Save metadata
-        os.makedirs(os.path.dirname(metadata_file), exist_ok=True)
-        with open(metadata_file, 'w') as f:
-            json.dump(api_keys, f, indent=2)
+        # One transaction; the runtime keys file is re-exported and every worker picks the key up
+        row = key_db.create(user, service, description, expires_days, extra=_key_extra(data))
+        current_app.logger.info(f"Created API key {row['key'][:8]}... for {user} ({service})")
         
-        # Update runtime file (only active keys)
-        runtime_keys = {}
-        for k, v in api_keys.items():
-            if v.get("enabled", True):
-                runtime_keys[k] = {
-                    "user": v["user"],
-                    "service": v["service"],
-                    "created_at": v["created_at"]
-                }
+        return jsonify(_key_response(row)), 201
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@dashboard_bp.route('/keys/batch', methods=['POST', 'OPTIONS'])
+@require_dashboard_auth(allow_admin_key=True)
+def batch_api_keys():
+    """
+    Create, update and disable several API keys atomically.
+
+    Body: {"create": [{"user", "service", "description", "expires_days", "rate_limit"?}, ...],
+           "update": [{"id", "user"?, "service"?, "description"?, "enabled"?, "extra"?}, ...],
+           "disable": ["key id", ...]}
+
+    Either every change is applied or, if any fails (e.g. an unknown key
+    id), none is.
+    """
+    try:
+        data = request.get_json() or {}
+        creates = data.get('create', [])
+        if any(not item.get('user') for item in creates):
+            return jsonify({"error": "User is required"}), 400
         
-        with open(runtime_file, 'w') as f:
-            json.dump(runtime_keys, f, indent=2)
+        created = []
+        with key_db.batch() as batch:
+            for item in creates:
+                created.append(batch.create(item['user'], item.get('service', 'all'),
+                                            item.get('description', ''), item.get('expires_days', 0),
+                                            extra=_key_extra(item)))
+            for item in data.get('update', []):
+                fields = {field: value for field, value in item.items() if field != 'id'}
+                batch.update(item['id'], **fields)
+            for key_id in data.get('disable', []):
+                batch.disable(key_id)
         
         return jsonify({
-            "key": key_id,
-            "user": user,
-            "service": service,
-            "created_at": created_at,
-            "expires_at": expires_at
-        }), 201
+            "version": batch.version,
+            "created": [_key_response(row) for row in created],
+            "changed": len(batch.changed)
+        }), 200
+    except KeyNotFound as e:
+        return jsonify({"error": f"Key not found: {e.args[0]}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -404,30 +419,8 @@ def create_api_key():
 def delete_api_key(key_id):
     """Delete/disable an API key."""
     try:
-        metadata_file = os.environ.get('API_KEYS_METADATA_FILE', '/app/data/apikeys_metadata.json')
-        runtime_file = os.environ.get('API_KEYS_FILE', 'caddy_apikeys.json')
-        
-        # Update metadata file
-        if os.path.exists(metadata_file):
-            with open(metadata_file, 'r') as f:
-                api_keys = json.load(f)
-            
-            if key_id in api_keys:
-                api_keys[key_id]["enabled"] = False
-                
-                with open(metadata_file, 'w') as f:
-                    json.dump(api_keys, f, indent=2)
-        
-        # Update runtime file
-        if os.path.exists(runtime_file):
-            with open(runtime_file, 'r') as f:
-                runtime_keys = json.load(f)
-            
-            if key_id in runtime_keys:
-                del runtime_keys[key_id]
-                
-                with open(runtime_file, 'w') as f:
-                    json.dump(runtime_keys, f, indent=2)
+        if not key_db.disable(key_id):
+            return jsonify({"error": "Key not found"}), 404
         
         return jsonify({"message": "Key disabled successfully"}), 200
     except Exception as e:
@@ -436,74 +429,68 @@ def delete_api_key(key_id):
 @dashboard_bp.route('/logs/stream', methods=['GET'])
 @require_dashboard_auth
 def stream_logs():
-    """Stream log updates in real-time."""
-    import time
+    """
+    Stream log updates in real-time (server-sent events).
+
+    Every open stream subscribes to the shared audit_tailer instead of
+    polling the file itself. Each new line is sent as {"log": line}. If this
+    client fell behind and lines were dropped from its buffer, a
+    {"dropped": n} frame says how many. A comment frame is sent every
+    LOG_STREAM_HEARTBEAT seconds while the log is quiet.
+    """
     from flask import Response
     
     def generate():
-        log_file = os.environ.get('AUDIT_LOG_FILE', '/var/log/ai-gateway/audit.log')
-        last_position = 0
-        
-        while True:
-            try:
-                if os.path.exists(log_file):
-                    with open(log_file, 'r') as f:
-                        f.seek(last_position)
-                        new_lines = f.readlines()
-                        last_position = f.tell()
-                        
-                        for line in new_lines:
-                            yield f"data: {json.dumps({'log': line.strip()})}\n\n"
-                            
-                time.sleep(1)  # Check for new logs every second
-            except Exception as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
-                break
+        with audit_tailer.subscribe() as subscription:
+            while True:
+                for frame in log_stream_frames(*subscription.get(LOG_STREAM_HEARTBEAT)):
+                    yield frame
     
-    return Response(generate(), mimetype="text/event-stream")
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @dashboard_bp.route('/logs', methods=['GET'])
 @require_dashboard_auth
 def get_logs():
-    """Get recent logs with filtering."""
+    """
+    Get recent logs with filtering, newest first.
+
+    Reads the audit log and its rotated segments backwards from the end,
+    applying the level, service and event filters while scanning, and stops
+    once limit entries match. Pass the returned next_cursor as cursor to
+    get the next (older) page; it is null once the log is exhausted.
+    """
     try:
         # Get query parameters
-        limit = int(request.args.get('limit', 100))
-        level = request.args.get('level', 'all')
+        limit = min(int(request.args.get('limit', 100)), LOGS_MAX_LIMIT)
+        level = request.args.get('level', 'all').upper()
         service = request.args.get('service', 'all')
+        event = request.args.get('event', 'all').upper()
+        cursor = request.args.get('cursor') or None
         
         audit_log_path = os.environ.get('AUDIT_LOG_FILE', '/var/log/ai-gateway/audit.log')
         logs = []
+        next_cursor = None
+        scanned = 0
         
-        if os.path.exists(audit_log_path):
-            with open(audit_log_path, 'r') as f:
-                # Read last N lines efficiently
-                lines = f.readlines()[-limit:]
-                
-                for line in lines:
-                    try:
-                        # Parse log line
-                        parts = line.strip().split(' | ')
-                        if len(parts) >= 4:
-                            log_entry = {
-                                "timestamp": parts[0],
-                                "level": parts[1],
-                                "event": parts[2],
-                                "details": ' | '.join(parts[3:])
-                            }
-                            
-                            # Apply filters
-                            if level != 'all' and log_entry['level'] != level.upper():
-                                continue
-                            
-                            logs.append(log_entry)
-                    except:
-                        pass
-        
-        # Reverse to show newest first
-        logs.reverse()
+        try:
+            for position, entry in audit_format.iter_entries_reverse(audit_log_path, cursor):
+                scanned += 1
+                next_cursor = position
+
+                # Apply filters
+                if log_matches(entry, level, service, event):
+                    logs.append(log_entry(entry))
+                    if len(logs) >= limit:
+                        break
+                if scanned >= LOGS_MAX_SCAN:
+                    break  # a sparse filter; the client can keep paging from next_cursor
+            else:
+                next_cursor = None  # reached the oldest entry
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        return jsonify({"logs": logs}), 200
+        return jsonify({"logs": logs, "next_cursor": next_cursor}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -538,42 +525,21 @@ def get_analytics():
             "whisper": 0
         })
         
-        audit_log_path = os.environ.get('AUDIT_LOG_FILE', '/var/log/ai-gateway/audit.log')
-        
-        if os.path.exists(audit_log_path):
-            with open(audit_log_path, 'r') as f:
-                for line in f:
-                    try:
-                        parts = line.strip().split(' | ')
-                        timestamp_str = parts[0]
-                        timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-                        
-                        if timestamp < start_time:
-                            continue
-                        
-                        # Round to interval
-                        interval_key = timestamp.replace(minute=0, second=0, microsecond=0)
-                        interval_key = interval_key.replace(hour=(timestamp.hour // interval_hours) * interval_hours)
-                        
-                        level = parts[1]
-                        event = parts[2]
-                        
-                        time_series[interval_key]["requests"] += 1
-                        
-                        if level == "ERROR":
-                            time_series[interval_key]["errors"] += 1
-                        
-                        # Count by service
-                        if "/chat/api" in line:
-                            time_series[interval_key]["chat"] += 1
-                        elif "/tts/api" in line:
-                            time_series[interval_key]["tts"] += 1
-                        elif "/image/api" in line:
-                            time_series[interval_key]["image"] += 1
-                        elif "/whisper/api" in line:
-                            time_series[interval_key]["whisper"] += 1
-                    except:
-                        pass
+        # Hourly rollups, regrouped into the chart's (local time) intervals
+        dimensions = ('all',) + tuple(f'service:{service}' for service in audit_format.SERVICES)
+        for row in rollup_store.series('hour', start_time.timestamp(), dimensions):
+            timestamp = datetime.fromtimestamp(row['bucket'])
+
+            # Round to interval
+            interval_key = timestamp.replace(minute=0, second=0, microsecond=0)
+            interval_key = interval_key.replace(hour=(timestamp.hour // interval_hours) * interval_hours)
+
+            if row['dimension'] == 'all':
+                time_series[interval_key]["requests"] += row['requests']
+                time_series[interval_key]["errors"] += row['errors']
+            else:
+                # Count by service
+                time_series[interval_key][row['dimension'].split(':', 1)[1]] += row['requests']
         
         # Convert to list for chart
         chart_data = []
@@ -5,5 +5,10 @@ curl -s http://host.docker.internal:11434/api/generate \
   -H "Content-Type: application/json" \
   -d '{"model":"devstral:24b","prompt":"Hello","stream":false}' > /dev/null
 
+if [ "$GATEWAY_SERVER" = "asgi" ]; then
+  echo "🚀 Starting ASGI gateway"
+  exec uvicorn asgi:app --host 0.0.0.0 --port 8080
+fi
+
 echo "🚀 Starting Flask app"
 exec python app.py
@@ -0,0 +1,100 @@
+"""
+Minimal inotify wrapper (Linux) for waking up when files change.
+
+Used to notice changes without stat()ing files on the request path. Callers
+treat it as a hint and still re-check the file themselves, so wait() also
+returns on timeout and platforms without inotify degrade to polling.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+
+# A file was (re)written in place or replaced by rename
+REPLACED = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event: wd, mask, cookie, len, then len bytes of NUL-padded name
+EVENT_HEADER = struct.Struct("iIII")
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+    return _libc
+
+
+class Inotify:
+    """Watch one directory for the events in mask."""
+
+    def __init__(self, directory, mask):
+        libc = _load_libc()
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno))
+
+    def wait(self, timeout, names=None):
+        """
+        Block until an event arrives or timeout seconds pass; True if there were events.
+
+        With names (a set of file names in the directory), events for other
+        files are skipped and do not end the wait.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], max(deadline - time.monotonic(), 0))
+            if not ready:
+                return False
+            changed = self._drain()
+            # A nameless event (e.g. a queue overflow) could have been any file
+            if names is None or "" in changed or not changed.isdisjoint(names):
+                return True
+
+    def _drain(self):
+        # Names of the files in the queued events
+        changed = set()
+        try:
+            while True:
+                data = os.read(self.fd, 64 * 1024)
+                if not data:
+                    break
+                offset = 0
+                while offset + EVENT_HEADER.size <= len(data):
+                    _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                    offset += EVENT_HEADER.size
+                    changed.add(os.fsdecode(data[offset:offset + length].rstrip(b"\0")))
+                    offset += length
+        except BlockingIOError:
+            pass
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def watch_directory(directory, mask):
+    """Return an Inotify for directory, or None where inotify is unavailable."""
+    try:
+        return Inotify(directory or ".", mask)
+    except (OSError, AttributeError) as e:
+        logger.info(f"inotify unavailable for {directory}, falling back to polling: {e}")
+        return None
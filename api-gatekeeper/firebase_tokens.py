@@ -0,0 +1,30 @@
+"""
+Cached verification of Firebase ID tokens.
+
+Verified claims are cached by the SHA-256 of the token until the token's own
+exp (capped at FIREBASE_TOKEN_CACHE_MAX_TTL), in a bounded LRU, so a
+dashboard page load that fans out into many authenticated calls pays for
+signature verification once. Invalid tokens are never cached. Google's
+public signing keys are fetched and cached by the SDK itself, per their
+HTTP cache headers.
+
+Revocation is not checked (verify_id_token's check_revoked=False default),
+so caching does not weaken what the callers already rely on.
+"""
+
+import os
+
+from firebase_admin import auth as firebase_auth
+
+from token_cache import VerifiedTokenCache
+
+FIREBASE_TOKEN_CACHE_SIZE = int(os.environ.get("FIREBASE_TOKEN_CACHE_SIZE", "1024"))
+FIREBASE_TOKEN_CACHE_MAX_TTL = float(os.environ.get("FIREBASE_TOKEN_CACHE_MAX_TTL", "3600"))
+
+token_cache = VerifiedTokenCache("firebase", lambda token: firebase_auth.verify_id_token(token),
+                                 size=FIREBASE_TOKEN_CACHE_SIZE, max_ttl=FIREBASE_TOKEN_CACHE_MAX_TTL)
+
+
+def verify_id_token(token):
+    """Drop-in for firebase_auth.verify_id_token backed by the shared cache."""
+    return token_cache.verify(token)
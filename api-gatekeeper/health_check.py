@@ -0,0 +1,257 @@
+"""
+Active health checks of the gateway's upstreams and containers.
+
+A background thread probes every registered target each
+HEALTH_CHECK_INTERVAL seconds, all at once on a small thread pool, so a
+round takes as long as the slowest probe (at most HEALTH_CHECK_TIMEOUT)
+rather than the sum of them. A target can have:
+
+* an HTTP probe URL, fetched through the upstream's pooled session
+  (as background traffic, so probes do not keep an idle pool open);
+  anything below 500 counts as healthy;
+* a Docker container name, looked up in a single container listing per
+  round through one long-lived Docker client.
+
+Results and the last HEALTH_CHECK_HISTORY probes per target are kept in
+memory, so /api/dashboard/services answers from the cache. Routing reads
+them too: after HEALTH_CHECK_UNHEALTHY_AFTER failed probes in a row a
+target is_down(), and the Ollama balancer skips it (see load_balancer)
+until a probe succeeds again.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import docker
+
+from metrics import metrics
+from upstream_pool import upstream_pool
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_INTERVAL = float(os.environ.get("HEALTH_CHECK_INTERVAL", "10"))
+HEALTH_CHECK_TIMEOUT = float(os.environ.get("HEALTH_CHECK_TIMEOUT", "2"))
+HEALTH_CHECK_HISTORY = int(os.environ.get("HEALTH_CHECK_HISTORY", "60"))
+HEALTH_CHECK_UNHEALTHY_AFTER = int(os.environ.get("HEALTH_CHECK_UNHEALTHY_AFTER", "2"))
+
+HEALTHY = "healthy"
+UNHEALTHY = "error"
+UNKNOWN = "unknown"
+
+
+class Target:
+    """One probed service and its latest results."""
+
+    def __init__(self, name, display_name, url=None, container=None, port=None, upstream=None,
+                 history=HEALTH_CHECK_HISTORY):
+        self.name = name
+        self.display_name = display_name
+        self.url = url
+        self.container = container
+        self.port = port if port is not None or url is None else urlsplit(url).port
+        self.upstream = upstream
+        self.status = UNKNOWN
+        self.health = UNKNOWN
+        self.latency_ms = None
+        self.checked_at = None
+        self.last_error = None
+        self.consecutive_failures = 0
+        self.history = deque(maxlen=history)  # (epoch seconds, healthy, latency ms)
+
+    def stats(self):
+        return {
+            "name": self.display_name,
+            "container": self.container or self.name,
+            "status": self.status,
+            "health": self.health,
+            "port": self.port,
+            "upstream": self.upstream,
+            "latency_ms": self.latency_ms,
+            "checked_at": self.checked_at,
+            "last_error": self.last_error,
+            "consecutive_failures": self.consecutive_failures,
+            "history": [
+                {"ts": ts, "healthy": healthy, "latency_ms": latency_ms}
+                for ts, healthy, latency_ms in self.history
+            ]
+        }
+
+
+class HealthProber:
+    """
+    Registry of health check targets probed concurrently in the background.
+
+    Args:
+        interval (float): Seconds between probe rounds
+        timeout (float): Connect and read timeout of each HTTP probe (and Docker call)
+        unhealthy_after (int): Consecutive failed probes before is_down() is True
+    """
+
+    def __init__(self, interval=HEALTH_CHECK_INTERVAL, timeout=HEALTH_CHECK_TIMEOUT,
+                 unhealthy_after=HEALTH_CHECK_UNHEALTHY_AFTER):
+        self.interval = interval
+        self.timeout = timeout
+        self.unhealthy_after = unhealthy_after
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._executor = None
+        self._docker = None
+        self._first_round = threading.Event()
+        self.rounds = 0
+
+    def register(self, name, display_name=None, url=None, container=None, port=None, upstream=None):
+        """
+        Add (or replace) a target.
+
+        Args:
+            name (str): Target name; use the upstream name to have routing consult it
+            display_name (str, optional): Name shown on the dashboard
+            url (str, optional): URL probed over HTTP
+            container (str, optional): Docker container whose state is reported
+            port (int, optional): Port shown on the dashboard (defaults to url's)
+            upstream (str, optional): Upstream whose circuit breaker belongs to this target
+        """
+        target = Target(name, display_name or name, url=url, container=container, port=port, upstream=upstream)
+        with self._lock:
+            self._targets[name] = target
+        return target
+
+    def is_down(self, name):
+        """True once name's recent probes have failed unhealthy_after times in a row."""
+        self._ensure_prober()
+        target = self._targets.get(name)
+        return target is not None and target.consecutive_failures >= self.unhealthy_after
+
+    def targets(self, wait=True):
+        """Latest results of every target, waiting for the first probe round if none has finished."""
+        self._ensure_prober()
+        if wait:
+            self._first_round.wait(self.timeout * 2 + 1)
+        with self._lock:
+            return [target.stats() for target in self._targets.values()]
+
+    def probe_all(self):
+        """Probe every target concurrently and record the results."""
+        with self._lock:
+            targets = list(self._targets.values())
+        if not targets:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=min(len(targets) + 1, 16),
+                                                thread_name_prefix="health-probe")
+        started = time.perf_counter()
+        containers = self._executor.submit(self._container_states)
+        probes = {target: self._executor.submit(self._probe_http, target.url)
+                  for target in targets if target.url}
+        containers = containers.result()
+        for target in targets:
+            self._record(target, containers, probes.get(target))
+        self.rounds += 1
+        metrics.summary("health_check_round_seconds").observe(time.perf_counter() - started)
+
+    def _record(self, target, containers, probe):
+        state = None
+        if target.container and containers is not None:
+            state = containers.get(target.container, ("not_found", UNHEALTHY))
+        status, health = state or (UNKNOWN, UNKNOWN)
+
+        latency_ms = error = None
+        if probe is not None:
+            healthy, latency_ms, error = probe.result()
+            health = HEALTHY if healthy else UNHEALTHY
+            if state is None or status == "not_found":
+                # Not a container we can see (e.g. Ollama on the host): the probe decides
+                status = "running" if healthy else "offline"
+
+        now = time.time()
+        with self._lock:
+            target.status = status
+            target.health = health
+            target.latency_ms = latency_ms
+            target.checked_at = now
+            target.last_error = error
+            if health == UNHEALTHY:
+                target.consecutive_failures += 1
+            elif health == HEALTHY:
+                target.consecutive_failures = 0
+            target.history.append((now, health == HEALTHY, latency_ms))
+        if health == UNHEALTHY:
+            metrics.counter("health_check_failures_total", target=target.name).inc()
+
+    def _probe_http(self, url):
+        # (healthy, latency ms, error)
+        started = time.perf_counter()
+        try:
+            response = upstream_pool.request("GET", url, timeout=(self.timeout, self.timeout), background=True)
+            response.close()
+        except Exception as e:
+            return False, None, type(e).__name__
+        latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        if response.status_code >= 500:
+            return False, latency_ms, f"HTTP {response.status_code}"
+        return True, latency_ms, None
+
+    def _container_states(self):
+        # {container name: (status, health)} from one listing, or None without Docker
+        with self._lock:
+            if not any(target.container for target in self._targets.values()):
+                return {}
+        try:
+            if self._docker is None:
+                self._docker = docker.from_env(timeout=max(int(self.timeout), 1))
+            containers = self._docker.containers.list(all=True)
+        except Exception as e:
+            logger.debug(f"Docker unavailable for health checks: {e}")
+            self._docker = None
+            return None
+        states = {}
+        for container in containers:
+            status = container.status
+            # The listing's "Status" text carries the container's own healthcheck result
+            summary = container.attrs.get("Status", "")
+            if "(unhealthy)" in summary:
+                health = UNHEALTHY
+            elif status == "running":
+                health = HEALTHY
+            else:
+                health = UNHEALTHY
+            states[container.name] = (status, health)
+        return states
+
+    def _ensure_prober(self):
+        # Started lazily so each forked worker runs its own
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._probe_forever, name="health-prober", daemon=True)
+            self._thread.start()
+
+    def _probe_forever(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.probe_all()
+            except Exception as e:
+                logger.error(f"Health check round failed: {e}")
+            self._first_round.set()
+            time.sleep(max(self.interval - (time.monotonic() - started), 0))
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "timeout": self.timeout,
+            "rounds": self.rounds,
+            "targets": len(self._targets)
+        }
+
+
+# Shared by the dashboard and the balancers in the process
+health_prober = HealthProber()
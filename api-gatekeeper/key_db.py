@@ -0,0 +1,532 @@
+"""
+Transactional API key database.
+
+Permanent API keys and their metadata live in a SQLite database in WAL
+mode (API_KEYS_DB) shared by every worker, indexed by key, user and
+service. Every write is a transaction: a batch of creates, updates and
+disables either commits as a whole or not at all, so concurrent dashboard
+edits can no longer interleave read-modify-write cycles of the JSON files
+and lose or corrupt keys.
+
+Each committed batch gets the next version number, stored on the rows it
+touched. Consumers ask for changes_since(version) to apply just those rows
+(see key_store.DatabaseKeyStore); subscribe() callbacks are notified at
+once in the writing process, and other workers notice the database change
+through their own watchers.
+
+Settings beyond the key's columns (e.g. its "rate_limit" override, see
+rate_limiter) are kept as a JSON object in the extra column and handed to
+the validator with the rest of the key's runtime info.
+
+After every commit the enabled keys are exported to the legacy flat JSON
+file (API_KEYS_FILE, {"key": {"user", "service", "created_at", ...extra}})
+for Caddy and other readers, written to a temporary file and renamed into
+place. Where the file cannot be renamed over (a single-file bind mount
+fails with EBUSY) it is rewritten in place under an exclusive flock.
+Edits made to that file by hand (or by generate_apikey.py) are merged back
+in by sync() and before every batch, so they are not overwritten. A new
+database is seeded from the legacy metadata file (API_KEYS_METADATA_FILE)
+and then the runtime file.
+"""
+
+import errno
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+API_KEYS_DB = os.environ.get("API_KEYS_DB", "/app/data/apikeys.db")
+API_KEYS_FILE = os.environ.get("API_KEYS_FILE", "caddy_apikeys.json")
+API_KEYS_METADATA_FILE = os.environ.get("API_KEYS_METADATA_FILE", "/app/data/apikeys_metadata.json")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS api_keys (
+    key TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    service TEXT NOT NULL DEFAULT 'all',
+    description TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL DEFAULT '',
+    expires_at TEXT,
+    enabled INTEGER NOT NULL DEFAULT 1,
+    extra TEXT NOT NULL DEFAULT '{}',
+    in_file INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS api_keys_user ON api_keys (user);
+CREATE INDEX IF NOT EXISTS api_keys_service ON api_keys (service);
+CREATE INDEX IF NOT EXISTS api_keys_version ON api_keys (version);
+CREATE TABLE IF NOT EXISTS key_meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+COLUMNS = ("key", "user", "service", "description", "created_at", "expires_at", "enabled", "extra")
+
+# Fields a batch may change on an existing key
+UPDATABLE = frozenset(("user", "service", "description", "expires_at", "enabled", "extra"))
+
+# Runtime file fields stored in their own columns; anything else goes to extra
+RUNTIME_FIELDS = ("user", "service", "created_at")
+METADATA_FIELDS = ("user", "service", "description", "created_at", "expires_at", "enabled")
+
+# rename() over a file that is itself a mount point (or on another filesystem)
+RENAME_ERRORS = (errno.EBUSY, errno.EXDEV)
+
+
+def _row(values):
+    row = dict(zip(COLUMNS, values))
+    row["enabled"] = bool(row["enabled"])
+    row["extra"] = json.loads(row["extra"] or "{}")
+    return row
+
+
+def _extra(info, known):
+    return {field: value for field, value in info.items() if field not in known}
+
+
+def runtime_info(row):
+    """What the validator and the legacy runtime file know about a key, extra settings included."""
+    info = {"user": row["user"], "service": row["service"], "created_at": row["created_at"]}
+    info.update(_extra(row["extra"], RUNTIME_FIELDS))
+    return info
+
+
+def _next_version(db):
+    # Called inside a write transaction
+    db.execute("INSERT OR IGNORE INTO key_meta (name, value) VALUES ('version', 0)")
+    db.execute("UPDATE key_meta SET value = value + 1 WHERE name = 'version'")
+    return db.execute("SELECT value FROM key_meta WHERE name = 'version'").fetchone()[0]
+
+
+def _timestamp(when):
+    return when.isoformat() + 'Z'
+
+
+class KeyNotFound(KeyError):
+    """Raised when a batch updates or disables a key that does not exist."""
+
+
+class KeyBatch:
+    """
+    Writes staged inside one KeyDatabase transaction (see KeyDatabase.batch).
+
+    Every row written gets the batch's version, so consumers apply the
+    whole batch together.
+    """
+
+    def __init__(self, db, version):
+        self._db = db
+        self.version = version
+        self.changed = []
+
+    def create(self, user, service="all", description="", expires_days=0, key=None, extra=None):
+        """
+        Add a key (a new random one unless key is given) and return its row.
+
+        extra holds further runtime settings, e.g. {"rate_limit": {"rps": 5}}.
+        """
+        now = datetime.utcnow()
+        row = {
+            "key": key or str(uuid.uuid4()),
+            "user": user,
+            "service": service or "all",
+            "description": description or "",
+            "created_at": _timestamp(now),
+            "expires_at": _timestamp(now + timedelta(days=expires_days)) if expires_days > 0 else None,
+            "enabled": True,
+            "extra": dict(extra or {}),
+        }
+        self._db.execute(
+            "INSERT INTO api_keys (key, user, service, description, created_at, expires_at, enabled, extra, version) "
+            "VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)",
+            (row["key"], row["user"], row["service"], row["description"], row["created_at"],
+             row["expires_at"], json.dumps(row["extra"]), self.version))
+        self.changed.append(row["key"])
+        return row
+
+    def update(self, key, **fields):
+        """Change fields (see UPDATABLE) of an existing key; raises KeyNotFound."""
+        unknown = set(fields) - UPDATABLE
+        if unknown:
+            raise ValueError(f"Cannot update {', '.join(sorted(unknown))}")
+        assignments = "".join(f"{field} = ?, " for field in fields)
+        encode = {"enabled": int, "extra": lambda value: json.dumps(value or {})}
+        values = [encode.get(field, lambda value: value)(value) for field, value in fields.items()]
+        cursor = self._db.execute(f"UPDATE api_keys SET {assignments}version = ? WHERE key = ?",
+                                  values + [self.version, key])
+        if cursor.rowcount == 0:
+            raise KeyNotFound(key)
+        self.changed.append(key)
+
+    def disable(self, key):
+        """Disable a key; it stays in the database (and the dashboard) but no longer authenticates."""
+        self.update(key, enabled=False)
+
+
+class KeyDatabase:
+    """
+    API keys in SQLite, with versioned changes and a legacy JSON export.
+
+    Args:
+        db_path (str): Database file, shared by every worker on the host
+        export_path (str, optional): Flat JSON file rewritten after every commit, and
+            merged back in when edited by hand
+        metadata_path (str, optional): Legacy metadata file that seeds a new database
+    """
+
+    def __init__(self, db_path=API_KEYS_DB, export_path=API_KEYS_FILE, metadata_path=API_KEYS_METADATA_FILE):
+        self.db_path = db_path
+        self.export_path = export_path
+        self.metadata_path = metadata_path
+        self._local = threading.local()
+        self._schema_ready = False
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self.last_export_error = None
+
+    def _connection(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            if not self._schema_ready:
+                with self._lock:
+                    db.executescript(SCHEMA)
+                    self._migrate(db)
+                    self._import_legacy(db)
+                    self._schema_ready = True
+            self._local.db = db
+        return db
+
+    def _migrate(self, db):
+        # Databases created before the extra and in_file columns
+        columns = {row[1] for row in db.execute("PRAGMA table_info(api_keys)")}
+        for column, definition in (("extra", "TEXT NOT NULL DEFAULT '{}'"),
+                                   ("in_file", "INTEGER NOT NULL DEFAULT 0")):
+            if column in columns:
+                continue
+            try:
+                db.execute(f"ALTER TABLE api_keys ADD COLUMN {column} {definition}")
+            except sqlite3.OperationalError as e:
+                # Another worker added it first
+                if "duplicate column" not in str(e):
+                    raise
+
+    @contextmanager
+    def _transaction(self):
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    @contextmanager
+    def batch(self):
+        """
+        Stage writes that commit together, e.g.::
+
+            with key_db.batch() as batch:
+                batch.create("alice", "chat")
+                batch.disable(old_key)
+
+        Any exception rolls the whole batch back. On commit the legacy file
+        is re-exported and subscribers are notified.
+        """
+        started = time.perf_counter()
+        with self._transaction() as db:
+            version = _next_version(db)
+            # Hand edits of the exported file would otherwise be overwritten by this batch's export
+            self._merge_file(db, version)
+            batch = KeyBatch(db, version)
+            yield batch
+        metrics.counter("keys_writes_total").inc(len(batch.changed))
+        metrics.summary("keys_batch_seconds").observe(time.perf_counter() - started)
+        self.export()
+        self._notify(version)
+
+    def create(self, user, service="all", description="", expires_days=0, extra=None):
+        """Create one key (expiring after expires_days, if positive) and return its row."""
+        with self.batch() as batch:
+            return batch.create(user, service, description, expires_days, extra=extra)
+
+    def disable(self, key):
+        """Disable one key; False if there is no such key."""
+        try:
+            with self.batch() as batch:
+                batch.disable(key)
+        except KeyNotFound:
+            return False
+        return True
+
+    def sync(self):
+        """
+        Merge hand edits of the exported file (e.g. by generate_apikey.py) into the database.
+
+        Keys added to the file are created (or re-enabled), keys whose user,
+        service or extra settings were edited are updated, and keys removed
+        from it are disabled. Only keys known to have been in the file (last
+        exported or merged) count as removed, so keys created while exports
+        were failing are not disabled by a hand edit of a stale file. Returns True if the file had changed
+        since it was last exported or merged.
+        """
+        db = self._connection()
+        try:
+            stat = os.stat(self.export_path)
+        except (OSError, TypeError):
+            return False
+        row = db.execute("SELECT value FROM key_meta WHERE name = 'file_mtime_ns'").fetchone()
+        if row is not None and row[0] == stat.st_mtime_ns:
+            return False
+        with self._transaction() as db:
+            version = _next_version(db)
+            merged = self._merge_file(db, version)
+        if merged:
+            self._notify(version)
+        return merged
+
+    def _merge_file(self, db, version):
+        # Called inside a write transaction; True if the file was read (whether or not keys changed)
+        try:
+            stat = os.stat(self.export_path)
+        except (OSError, TypeError):
+            return False
+        row = db.execute("SELECT value FROM key_meta WHERE name = 'file_mtime_ns'").fetchone()
+        if row is not None and row[0] == stat.st_mtime_ns:
+            return False
+        try:
+            with open(self.export_path, "r") as f:
+                file_keys = json.load(f)
+        except (OSError, ValueError) as e:
+            # Possibly caught mid-edit; the next sync or batch retries
+            logger.error(f"Could not merge API keys from {self.export_path}: {e}")
+            return False
+
+        rows = db.execute(f"SELECT {', '.join(COLUMNS)} FROM api_keys WHERE enabled = 1")
+        enabled = {row["key"]: row for row in map(_row, rows)}
+        added = updated = 0
+        for key, info in file_keys.items():
+            user, service = info.get("user", "unknown"), info.get("service", "all")
+            extra = _extra(info, RUNTIME_FIELDS)
+            current = enabled.get(key)
+            if current is not None:
+                if (current["user"], current["service"], current["extra"]) != (user, service, extra):
+                    db.execute("UPDATE api_keys SET user = ?, service = ?, extra = ?, version = ? WHERE key = ?",
+                               (user, service, json.dumps(extra), version, key))
+                    updated += 1
+                continue
+            cursor = db.execute(
+                "UPDATE api_keys SET user = ?, service = ?, extra = ?, enabled = 1, version = ? WHERE key = ?",
+                (user, service, json.dumps(extra), version, key))
+            if cursor.rowcount == 0:
+                db.execute(
+                    "INSERT INTO api_keys (key, user, service, created_at, enabled, extra, version) "
+                    "VALUES (?, ?, ?, ?, 1, ?, ?)",
+                    (key, user, service, info.get("created_at", ""), json.dumps(extra), version))
+            added += 1
+        db.executemany("UPDATE api_keys SET in_file = 1 WHERE key = ?", [(key,) for key in file_keys])
+        in_file = {key for key, in db.execute("SELECT key FROM api_keys WHERE enabled = 1 AND in_file = 1")}
+        removed = in_file - set(file_keys)
+        db.executemany("UPDATE api_keys SET enabled = 0, in_file = 0, version = ? WHERE key = ?",
+                       [(version, key) for key in removed])
+        db.execute("INSERT OR REPLACE INTO key_meta (name, value) VALUES ('file_mtime_ns', ?)", (stat.st_mtime_ns,))
+        if added or updated or removed:
+            logger.info(f"Merged {self.export_path} into the key database "
+                        f"({added} enabled, {updated} updated, {len(removed)} disabled)")
+        return True
+
+    def get(self, key):
+        row = self._connection().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM api_keys WHERE key = ?", (key,)).fetchone()
+        return _row(row) if row is not None else None
+
+    def list(self, user=None, service=None, enabled=None):
+        """Key rows in creation order, optionally filtered (each filter uses an index)."""
+        clauses, params = [], []
+        if user is not None:
+            clauses.append("user = ?")
+            params.append(user)
+        if service is not None:
+            clauses.append("service = ?")
+            params.append(service)
+        if enabled is not None:
+            clauses.append("enabled = ?")
+            params.append(int(enabled))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._connection().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM api_keys{where} ORDER BY created_at, rowid", params)
+        return [_row(row) for row in rows]
+
+    def count(self, enabled=None):
+        if enabled is None:
+            return self._connection().execute("SELECT COUNT(*) FROM api_keys").fetchone()[0]
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM api_keys WHERE enabled = ?", (int(enabled),)).fetchone()[0]
+
+    def version(self):
+        """Version of the last committed batch (0 before the first)."""
+        row = self._connection().execute("SELECT value FROM key_meta WHERE name = 'version'").fetchone()
+        return row[0] if row else 0
+
+    def changes_since(self, version):
+        """
+        (current version, {key: runtime info, or None if disabled}) for rows changed after version.
+
+        Pass 0 for every key. Both come from one read transaction, so applying
+        the changes and remembering the version never misses a batch.
+        """
+        db = self._connection()
+        db.execute("BEGIN")
+        try:
+            current = self.version()
+            rows = db.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM api_keys WHERE version > ?", (version,)).fetchall()
+        finally:
+            db.execute("COMMIT")
+        changes = {}
+        for values in rows:
+            row = _row(values)
+            changes[row["key"]] = runtime_info(row) if row["enabled"] else None
+        return current, changes
+
+    def subscribe(self, callback):
+        """Call callback(version) in this process after each commit."""
+        self._subscribers.append(callback)
+
+    def _notify(self, version):
+        for callback in list(self._subscribers):
+            try:
+                callback(version)
+            except Exception as e:
+                logger.error(f"API key change subscriber failed: {e}")
+
+    def export(self, path=None):
+        """
+        Rewrite the legacy runtime keys file with the enabled keys.
+
+        The file is replaced atomically by a rename where possible and
+        rewritten in place otherwise (see _write_in_place). The snapshot is
+        read under the database write lock, so when several workers export at
+        once the last write always carries the latest keys. Failures (e.g. a
+        read-only mount) are logged and leave the database as is.
+        """
+        path = path or self.export_path
+        if not path:
+            return False
+        try:
+            with self._transaction() as db:
+                rows = db.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM api_keys WHERE enabled = 1 ORDER BY created_at, rowid")
+                runtime_keys = {row["key"]: runtime_info(row) for row in map(_row, rows)}
+                data = json.dumps(runtime_keys, indent=2)
+                if not self._replace(path, data):
+                    self._write_in_place(path, data)
+                if path == self.export_path:
+                    # Our own write, not a hand edit for sync() to merge; and what sync() may disable
+                    db.execute("UPDATE api_keys SET in_file = enabled WHERE in_file != enabled")
+                    db.execute("INSERT OR REPLACE INTO key_meta (name, value) VALUES ('file_mtime_ns', ?)",
+                               (os.stat(path).st_mtime_ns,))
+        except (OSError, sqlite3.Error) as e:
+            metrics.counter("keys_export_errors_total").inc()
+            if self.last_export_error != str(e):
+                logger.error(f"Could not export API keys to {path}: {e}")
+            self.last_export_error = str(e)
+            return False
+        self.last_export_error = None
+        return True
+
+    def _replace(self, path, data):
+        # False if the file cannot be renamed over, e.g. a single-file bind mount (EBUSY)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except OSError as e:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            if e.errno in RENAME_ERRORS:
+                return False
+            raise
+        return True
+
+    def _write_in_place(self, path, data):
+        # Keeps the inode (and the bind mount) but is not atomic: readers that take
+        # a shared flock see the whole file, others may briefly see it half written
+        with open(path, "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                f.truncate()
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        metrics.counter("keys_export_in_place_total").inc()
+
+    def _import_legacy(self, db):
+        # Called with the schema lock held until it succeeds; the flag makes it once per database.
+        # The runtime file is merged by the first sync() or batch.
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if db.execute("SELECT 1 FROM key_meta WHERE name = 'imported'").fetchone():
+                db.execute("COMMIT")
+                return
+            keys = {}
+            if self.metadata_path and os.path.exists(self.metadata_path):
+                with open(self.metadata_path, "r") as f:
+                    keys = json.load(f)
+            version = _next_version(db)
+            db.executemany(
+                "INSERT OR IGNORE INTO api_keys "
+                "(key, user, service, description, created_at, expires_at, enabled, extra, version) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(key, info.get("user", "unknown"), info.get("service", "all"), info.get("description", ""),
+                  info.get("created_at", ""), info.get("expires_at"), int(info.get("enabled", True)),
+                  json.dumps(_extra(info, METADATA_FIELDS)), version)
+                 for key, info in keys.items()])
+            db.execute("INSERT INTO key_meta (name, value) VALUES ('imported', ?)", (int(time.time()),))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        if keys:
+            logger.info(f"Imported {len(keys)} API keys from {self.metadata_path} into {self.db_path}")
+
+    def stats(self):
+        stats = {
+            "path": self.db_path,
+            "export_path": self.export_path,
+            "last_export_error": self.last_export_error
+        }
+        try:
+            stats.update(version=self.version(), keys=self.count(), enabled=self.count(enabled=True))
+        except sqlite3.Error as e:
+            stats["error"] = str(e)
+        return stats
+
+
+# Shared by the dashboard and the validator in the process
+key_db = KeyDatabase()
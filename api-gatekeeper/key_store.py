@@ -0,0 +1,376 @@
+"""
+API key store: an immutable in-memory index of the keys file.
+
+Keys are indexed by their HMAC-SHA256 under a per-process secret, so the
+index holds no plaintext keys and the final comparison is constant-time.
+Lookups read the current index with no filesystem access. A background
+thread waits for inotify events on the keys file's directory (or polls at
+KEYS_RELOAD_INTERVAL where inotify is unavailable), rebuilds the index off
+the request path and swaps it in with a single reference assignment. A file
+that fails to parse leaves the previous index in place.
+
+With KEY_STORE=sqlite (the default) keys come from key_db.KeyDatabase
+instead: DatabaseKeyStore applies only the rows changed since its last
+version, woken by the database's change notifications in the writing
+process and by inotify on the database directory in the others. KEY_STORE=file
+keeps watching the JSON keys file, for deployments that manage it by hand.
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+
+from file_watch import IN_MODIFY, REPLACED, watch_directory
+from key_db import key_db
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+KEYS_RELOAD_INTERVAL = float(os.environ.get("KEYS_RELOAD_INTERVAL", "5"))
+KEY_STORE = os.environ.get("KEY_STORE", "sqlite")
+
+# HMAC secret for the index; random per process unless set (e.g. to compare digests across workers)
+KEY_INDEX_SECRET = os.environ.get("KEY_INDEX_SECRET")
+
+# Recently rejected keys are refused from this cache without a lookup or log line
+NEGATIVE_CACHE_SIZE = int(os.environ.get("NEGATIVE_CACHE_SIZE", "10000"))
+NEGATIVE_CACHE_TTL = float(os.environ.get("NEGATIVE_CACHE_TTL", "60"))
+
+# Bytes of the digest used as the dict key; candidates are then compared in full
+DIGEST_PREFIX_BYTES = 8
+
+
+def _signature(stat):
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def key_digest(secret, key):
+    """HMAC-SHA256 of an API key under secret."""
+    return hmac.new(secret, key.encode('utf-8'), hashlib.sha256).digest()
+
+
+class KeyIndex:
+    """Read-only snapshot of the keys file, keyed by each key's HMAC digest."""
+
+    def __init__(self, keys, secret, signature=None, loaded_at=None):
+        buckets = {}
+        for key, info in keys.items():
+            digest = key_digest(secret, key)
+            buckets.setdefault(digest[:DIGEST_PREFIX_BYTES], []).append((digest, MappingProxyType(dict(info))))
+        self._buckets = MappingProxyType({prefix: tuple(entries) for prefix, entries in buckets.items()})
+        self._count = len(keys)
+        self.signature = signature
+        self.loaded_at = loaded_at or time.time()
+
+    def updated(self, changes, secret, signature=None):
+        """
+        New index with changes ({key: info, or None to remove}) applied.
+
+        Only the changed keys are hashed; the buckets of everything else are
+        shared with this index, which stays valid for readers still using it.
+        """
+        buckets = dict(self._buckets)
+        count = self._count
+        for key, info in changes.items():
+            digest = key_digest(secret, key)
+            prefix = digest[:DIGEST_PREFIX_BYTES]
+            old = buckets.get(prefix, ())
+            entries = [entry for entry in old if not hmac.compare_digest(entry[0], digest)]
+            count -= len(old) - len(entries)
+            if info is not None:
+                entries.append((digest, MappingProxyType(dict(info))))
+                count += 1
+            if entries:
+                buckets[prefix] = tuple(entries)
+            else:
+                buckets.pop(prefix, None)
+        index = KeyIndex({}, secret, signature)
+        index._buckets = MappingProxyType(buckets)
+        index._count = count
+        return index
+
+    def get(self, digest):
+        """Return the metadata of the key with this digest, or None."""
+        for candidate, info in self._buckets.get(digest[:DIGEST_PREFIX_BYTES], ()):
+            if hmac.compare_digest(candidate, digest):
+                return info
+        return None
+
+    def __len__(self):
+        return self._count
+
+
+class NegativeCache:
+    """
+    Bounded LRU of rejected key digests, each remembered for ttl seconds.
+
+    Entries are tagged with the key store generation they were rejected
+    under, so a reload that adds a key makes earlier rejections stale.
+    """
+
+    def __init__(self, size=NEGATIVE_CACHE_SIZE, ttl=NEGATIVE_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def contains(self, digest, generation):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return False
+            expires, entry_generation = entry
+            if expires < time.monotonic() or entry_generation != generation:
+                del self._entries[digest]
+                return False
+            self._entries.move_to_end(digest)
+            return True
+
+    def add(self, digest, generation):
+        with self._lock:
+            self._entries[digest] = (time.monotonic() + self.ttl, generation)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class KeyStore:
+    """
+    Keys file watched in the background and served from an immutable KeyIndex.
+
+    Args:
+        path (str): JSON keys file ({"key": {"user": ..., "service": ...}})
+        reload_interval (float): Longest time between checks of the file
+    """
+
+    def __init__(self, path, reload_interval=KEYS_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.secret = KEY_INDEX_SECRET.encode('utf-8') if KEY_INDEX_SECRET else os.urandom(32)
+        self.index = KeyIndex({}, self.secret)
+        self.reloads = 0
+        self.last_error = None
+        self._failed_signature = None
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._key_count = metrics.gauge("keys_loaded", store=os.path.basename(path))
+        self.reload()
+
+    def digest(self, key):
+        """Digest of key as stored in the index."""
+        return key_digest(self.secret, key)
+
+    def lookup(self, digest):
+        """Return the metadata for a key digest, or None. Never touches the filesystem."""
+        self._ensure_watcher()
+        return self.index.get(digest)
+
+    def reload(self, force=False):
+        """Rebuild and swap in the index if the file changed; True if it was swapped."""
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except OSError as e:
+                if self.last_error != str(e):
+                    logger.error(f"Failed to load API keys from {self.path}: {e}")
+                self.last_error = str(e)
+                return False
+
+            signature = _signature(stat)
+            if not force and signature in (self.index.signature, self._failed_signature):
+                return False
+
+            started = time.perf_counter()
+            try:
+                with open(self.path, "r") as f:
+                    index = KeyIndex(json.load(f), self.secret, signature)
+            except Exception as e:
+                # Possibly caught mid-write; the next event or poll retries
+                metrics.counter("keys_reload_errors_total").inc()
+                logger.error(f"Failed to load API keys from {self.path}: {e}")
+                self.last_error = str(e)
+                self._failed_signature = signature
+                return False
+
+            self.index = index
+            self._failed_signature = None
+            if self.reloads:
+                # How long after the write the new keys took effect
+                metrics.summary("keys_reload_lag_seconds").observe(max(index.loaded_at - stat.st_mtime, 0))
+            self.reloads += 1
+            self.last_error = None
+            self._key_count.set(len(index))
+            metrics.summary("keys_reload_seconds").observe(time.perf_counter() - started)
+            logger.info(f"API keys reloaded from {self.path} ({len(index)} keys)")
+            return True
+
+    def _ensure_watcher(self):
+        # Started lazily so each forked worker runs its own
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        with self._lock:
+            if self._watcher is not None and self._watcher.is_alive():
+                return
+            self._watcher = threading.Thread(target=self._watch_forever, name="key-store-watcher", daemon=True)
+            self._watcher.start()
+
+    def _watch_forever(self):
+        inotify = watch_directory(os.path.dirname(os.path.abspath(self.path)), REPLACED)
+        # Catch changes made between the initial load and the watch starting
+        self.reload()
+        while True:
+            if inotify is not None:
+                inotify.wait(self.reload_interval)
+            else:
+                time.sleep(self.reload_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"API key reload failed: {e}")
+
+    def stats(self):
+        index = self.index
+        return {
+            "path": self.path,
+            "keys": len(index),
+            "loaded_at": index.loaded_at,
+            "reloads": self.reloads,
+            "last_error": self.last_error
+        }
+
+
+class DatabaseKeyStore:
+    """
+    KeyStore over a key_db.KeyDatabase, updated incrementally from its changes.
+
+    Args:
+        database (key_db.KeyDatabase): Source of the keys
+        reload_interval (float): Longest time between checks for changes made
+            by other workers
+    """
+
+    def __init__(self, database, reload_interval=KEYS_RELOAD_INTERVAL):
+        self.database = database
+        self.path = database.db_path
+        self.reload_interval = reload_interval
+        self.secret = KEY_INDEX_SECRET.encode('utf-8') if KEY_INDEX_SECRET else os.urandom(32)
+        self.index = KeyIndex({}, self.secret, signature=0)
+        self.reloads = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._key_count = metrics.gauge("keys_loaded", store=os.path.basename(self.path))
+        # Writes made in this process take effect before the write call returns
+        database.subscribe(lambda version: self.reload())
+        try:
+            database.sync()
+        except Exception as e:
+            logger.error(f"Failed to merge API keys into {self.path}: {e}")
+        self.reload()
+
+    def digest(self, key):
+        """Digest of key as stored in the index."""
+        return key_digest(self.secret, key)
+
+    def lookup(self, digest):
+        """Return the metadata for a key digest, or None. Never touches the database."""
+        self._ensure_watcher()
+        return self.index.get(digest)
+
+    def reload(self, force=False):
+        """Apply the changes committed since the index's version; True if the index was swapped."""
+        with self._lock:
+            started = time.perf_counter()
+            since = 0 if force else self.index.signature
+            try:
+                version, changes = self.database.changes_since(since)
+                if version < since:
+                    # The database was replaced; start over from its contents
+                    since = 0
+                    version, changes = self.database.changes_since(since)
+            except Exception as e:
+                if self.last_error != str(e):
+                    logger.error(f"Failed to load API keys from {self.path}: {e}")
+                metrics.counter("keys_reload_errors_total").inc()
+                self.last_error = str(e)
+                return False
+            if version == self.index.signature and not force:
+                return False
+
+            if since == 0:
+                index = KeyIndex({key: info for key, info in changes.items() if info is not None},
+                                 self.secret, version)
+            else:
+                index = self.index.updated(changes, self.secret, version)
+            self.index = index
+            self.reloads += 1
+            self.last_error = None
+            self._key_count.set(len(index))
+            metrics.summary("keys_reload_seconds").observe(time.perf_counter() - started)
+            logger.info(f"API keys updated from {self.path} to version {version} "
+                        f"({len(changes)} changed, {len(index)} keys)")
+            return True
+
+    def _ensure_watcher(self):
+        # Started lazily so each forked worker runs its own
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        with self._lock:
+            if self._watcher is not None and self._watcher.is_alive():
+                return
+            self._watcher = threading.Thread(target=self._watch_forever, name="key-store-watcher", daemon=True)
+            self._watcher.start()
+
+    def _watch_forever(self):
+        # Other workers' commits modify the database's WAL file. Other files in the
+        # directory (e.g. other databases on the data volume) are ignored; an export
+        # file elsewhere is picked up by the periodic check.
+        directory = os.path.dirname(os.path.abspath(self.path))
+        name = os.path.basename(self.path)
+        names = {name, f"{name}-wal", f"{name}-journal"}
+        export_path = self.database.export_path
+        if export_path and os.path.dirname(os.path.abspath(export_path)) == directory:
+            names.add(os.path.basename(export_path))
+        inotify = watch_directory(directory, IN_MODIFY | REPLACED)
+        self.reload()
+        while True:
+            if inotify is not None:
+                inotify.wait(self.reload_interval, names)
+            else:
+                time.sleep(self.reload_interval)
+            try:
+                # Hand edits of the exported keys file still take effect
+                self.database.sync()
+                self.reload()
+            except Exception as e:
+                logger.error(f"API key reload failed: {e}")
+
+    def stats(self):
+        index = self.index
+        return {
+            "path": self.path,
+            "backend": "sqlite",
+            "keys": len(index),
+            "version": index.signature,
+            "loaded_at": index.loaded_at,
+            "reloads": self.reloads,
+            "last_error": self.last_error
+        }
+
+
+def create_key_store(keys_file, backend=KEY_STORE):
+    """Build the validator's key store selected by KEY_STORE ("sqlite" or "file")."""
+    if backend == "file":
+        return KeyStore(keys_file)
+    if backend != "sqlite":
+        logger.warning(f"Unknown KEY_STORE {backend!r}, using sqlite")
+    return DatabaseKeyStore(key_db)
@@ -0,0 +1,201 @@
+"""
+Load balancing across several backends of the same service (Ollama nodes).
+
+Requests go to the healthy backend with the fewest outstanding requests,
+preferring backends that already have the requested model loaded so we avoid
+cold model loads. Backends that keep failing are ejected for a cool-down
+period (passive health checking), as are backends whose circuit breaker
+is open or whose active health checks are failing (see health_check).
+"""
+
+import logging
+import re
+import threading
+import time
+
+from circuit_breaker import breakers
+from health_check import health_prober
+from metrics import metrics
+from upstream_pool import upstream_pool
+
+logger = logging.getLogger(__name__)
+
+# Cheap scan for the top-level "model" field so chat bodies need no JSON parse
+MODEL_PATTERN = re.compile(rb'"model"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def extract_model(body):
+    """Return the "model" value from a raw JSON request body, or None."""
+    if not body:
+        return None
+    match = MODEL_PATTERN.search(body)
+    return match.group(1).decode('utf-8', errors='replace') if match else None
+
+
+def model_key(model):
+    """Normalise a model name the way Ollama reports it ("llama3" -> "llama3:latest")."""
+    if not model:
+        return None
+    return model if ':' in model else f"{model}:latest"
+
+
+def upstream_failed(outcome):
+    """
+    release()'s failed argument for a proxied call's (status, error) outcome.
+
+    The node failed if it answered with a 5xx or could not be reached or
+    timed out; None (never called, e.g. an open breaker) stays None.
+    """
+    if outcome is None:
+        return None
+    status, error = outcome
+    return error is not None or status >= 500
+
+
+class Backend:
+    """One node of a backend pool and its load/health state."""
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url.rstrip('/')
+        self.outstanding = 0
+        self.loaded_models = set()
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.requests_total = 0
+        self.failures_total = 0
+
+    def is_ejected(self, now):
+        return self.ejected_until > now
+
+    def stats(self, now):
+        return {
+            "name": self.name,
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "loaded_models": sorted(self.loaded_models),
+            "ejected": self.is_ejected(now),
+            "ejected_for": round(max(self.ejected_until - now, 0), 1),
+            "consecutive_failures": self.consecutive_failures,
+            "requests_total": self.requests_total,
+            "failures_total": self.failures_total
+        }
+
+
+class BackendPool:
+    """
+    Least-outstanding-requests balancer with model affinity and passive ejection.
+
+    Args:
+        name (str): Pool name, used for metrics and upstream names
+        urls (list): Base URLs of the backends
+        eject_after (int): Consecutive failures before a backend is ejected
+        eject_seconds (float): How long an ejected backend is skipped
+        models_path (str, optional): Path listing loaded models (Ollama's /api/ps),
+            polled every models_refresh seconds to learn model placement
+    """
+
+    def __init__(self, name, urls, eject_after=3, eject_seconds=30, models_path=None,
+                 models_refresh=15):
+        self.name = name
+        self.backends = []
+        for index, url in enumerate(urls):
+            backend_name = name if index == 0 else f"{name}-{index + 1}"
+            upstream_pool.register(backend_name, url)
+            self.backends.append(Backend(backend_name, url))
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.models_path = models_path
+        self.models_refresh = models_refresh
+        self._lock = threading.Lock()
+        self._next = 0
+        self._refresher = None
+
+    def acquire(self, model=None):
+        """Pick a backend for a request and count it as outstanding."""
+        self._ensure_refresher()
+        model = model_key(model)
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends
+                          if not b.is_ejected(now) and not breakers.is_open(b.name)
+                          and not health_prober.is_down(b.name)]
+            if not candidates:
+                # Everything is ejected: fail open rather than refuse all traffic
+                candidates = self.backends
+
+            if model:
+                warm = [b for b in candidates if model in b.loaded_models]
+                if warm:
+                    candidates = warm
+                    metrics.counter("balancer_affinity_hits_total", pool=self.name).inc()
+                else:
+                    metrics.counter("balancer_affinity_misses_total", pool=self.name).inc()
+
+            # Rotate the starting point so ties spread across backends
+            self._next = (self._next + 1) % len(self.backends)
+            ordered = candidates[self._next % len(candidates):] + candidates[:self._next % len(candidates)]
+            backend = min(ordered, key=lambda b: b.outstanding)
+            backend.outstanding += 1
+            backend.requests_total += 1
+            return backend
+
+    def release(self, backend, model=None, failed=False):
+        """
+        Finish a request on backend, updating affinity and passive health.
+
+        failed=None means the backend was never called (e.g. its breaker was
+        open), so its health and loaded models are left alone.
+        """
+        model = model_key(model)
+        with self._lock:
+            backend.outstanding -= 1
+            if failed is None:
+                return
+            if failed:
+                backend.failures_total += 1
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.eject_after:
+                    backend.ejected_until = time.monotonic() + self.eject_seconds
+                    backend.consecutive_failures = 0
+                    metrics.counter("balancer_ejections_total", backend=backend.name).inc()
+                    logger.warning(f"Ejecting backend {backend.name} ({backend.url}) for {self.eject_seconds}s")
+            else:
+                backend.consecutive_failures = 0
+                if model:
+                    # The node keeps a model loaded for a while after serving it
+                    backend.loaded_models.add(model)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return [backend.stats(now) for backend in self.backends]
+
+    def refresh_loaded_models(self):
+        """Poll each backend's models_path and replace its loaded model set."""
+        for backend in self.backends:
+            try:
+                resp = upstream_pool.request('GET', f"{backend.url}{self.models_path}", timeout=(2, 5),
+                                             background=True)
+                resp.raise_for_status()
+                models = {model_key(m.get('name') or m.get('model')) for m in resp.json().get('models', [])}
+                models.discard(None)
+                with self._lock:
+                    backend.loaded_models = models
+            except Exception as e:
+                logger.debug(f"Could not refresh loaded models on {backend.name}: {e}")
+
+    def _ensure_refresher(self):
+        if not self.models_path or (self._refresher is not None and self._refresher.is_alive()):
+            return
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(target=self._refresh_forever, name=f"{self.name}-models",
+                                               daemon=True)
+            self._refresher.start()
+
+    def _refresh_forever(self):
+        while True:
+            self.refresh_loaded_models()
+            time.sleep(self.models_refresh)
@@ -0,0 +1,259 @@
+"""
+Shared tailer of the audit log for live dashboard streams.
+
+One background thread follows the audit file and fans each new line out
+to every subscriber (an open /api/dashboard/logs/stream), so any number of
+dashboards cost one file watcher instead of one polling loop each. The
+thread sleeps on inotify (see file_watch), re-checking the file every
+LOG_STREAM_POLL_INTERVAL seconds at most as a fallback, and exits when the
+last subscriber leaves.
+
+It follows the file by name: when the audit writer rotates it (the inode
+changes or the file disappears) the rest of the old file is read through
+the still-open handle before switching to the new file from its start,
+and a file that shrinks below the read position (truncation) is re-read
+from the start.
+
+Each subscriber has a bounded buffer of LOG_STREAM_BUFFER lines. A client
+that falls behind loses its oldest lines rather than holding up the
+others; losses are counted per subscription and in
+log_stream_dropped_total.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from file_watch import IN_MODIFY, REPLACED, watch_directory
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LOG_STREAM_BUFFER = int(os.environ.get("LOG_STREAM_BUFFER", "1000"))
+LOG_STREAM_POLL_INTERVAL = float(os.environ.get("LOG_STREAM_POLL_INTERVAL", "1.0"))
+LOG_STREAM_HEARTBEAT = float(os.environ.get("LOG_STREAM_HEARTBEAT", "15"))
+
+# Most bytes read from the file per step, so a burst is fanned out in pieces
+READ_CHUNK_SIZE = 256 * 1024
+
+
+class Subscription:
+    """
+    One subscriber's bounded buffer of new log lines.
+
+    Use as a context manager (or call close()) so the tailer stops feeding
+    it. get() blocks a thread; aget() awaits on the event loop without one.
+    """
+
+    def __init__(self, tailer, size):
+        self._tailer = tailer
+        self._lines = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._loop = None
+        self._async_ready = None
+        self.dropped = 0  # lines lost to a full buffer since the last get()
+        self.dropped_total = 0
+
+    def _push(self, lines):
+        # Called on the tailer thread
+        with self._lock:
+            overflow = len(self._lines) + len(lines) - self._lines.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+                self.dropped_total += overflow
+                self._tailer._dropped.inc(overflow)
+            self._lines.extend(lines)
+            loop, event = self._loop, self._async_ready
+        self._ready.set()
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # the loop has closed
+
+    def _take(self):
+        with self._lock:
+            lines = list(self._lines)
+            self._lines.clear()
+            dropped, self.dropped = self.dropped, 0
+            self._ready.clear()
+            if self._async_ready is not None:
+                self._async_ready.clear()
+        return lines, dropped
+
+    def get(self, timeout=None):
+        """Wait up to timeout seconds for new lines; returns (lines, dropped), possibly empty."""
+        self._ready.wait(timeout)
+        return self._take()
+
+    async def aget(self, timeout=None):
+        """get() for asyncio callers; the wait does not hold a thread."""
+        if self._async_ready is None:
+            event = asyncio.Event()
+            with self._lock:
+                self._loop, self._async_ready = asyncio.get_running_loop(), event
+                if self._lines:
+                    event.set()
+        try:
+            await asyncio.wait_for(self._async_ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._take()
+
+    def close(self):
+        self._tailer._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LogTailer:
+    """
+    Follow a log file on one background thread and fan new lines out to subscribers.
+
+    Args:
+        path (str): File to follow (by name, across rotation)
+        buffer_size (int): Lines buffered per subscriber before the oldest are dropped
+        poll_interval (float): Longest wait between checks of the file when
+            inotify is quiet or unavailable
+    """
+
+    def __init__(self, path, buffer_size=LOG_STREAM_BUFFER, poll_interval=LOG_STREAM_POLL_INTERVAL):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.poll_interval = poll_interval
+
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._file = None
+        self._inode = None
+        self._partial = b""
+        self.rotations = 0
+        self.truncations = 0
+
+        self._subscriber_count = metrics.gauge("log_stream_subscribers")
+        self._dropped = metrics.counter("log_stream_dropped_total")
+        self._lines = metrics.counter("log_stream_lines_total")
+
+    def subscribe(self):
+        """New Subscription receiving lines appended from now on."""
+        subscription = Subscription(self, self.buffer_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+            self._subscriber_count.set(len(self._subscribers))
+            # Started on demand so each forked worker runs its own, and only while watched
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-tailer", daemon=True)
+                self._thread.start()
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            self._subscriber_count.set(len(self._subscribers))
+
+    def _run(self):
+        inotify = watch_directory(os.path.dirname(os.path.abspath(self.path)), IN_MODIFY | REPLACED)
+        try:
+            # Subscribers only see what is written after they joined
+            self._open(at_end=True)
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        # Under the lock, so a new subscriber starts a fresh thread after this one is done
+                        self._close()
+                        self._thread = None
+                        return
+                if inotify is not None:
+                    inotify.wait(self.poll_interval)
+                else:
+                    time.sleep(self.poll_interval)
+                try:
+                    self._follow()
+                except Exception as e:
+                    logger.error(f"Tailing {self.path} failed: {e}")
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def _open(self, at_end=False):
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        self._file = f
+        self._inode = os.fstat(f.fileno()).st_ino
+        self._partial = b""
+        if at_end:
+            f.seek(0, os.SEEK_END)
+        return True
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._inode = None
+
+    def _follow(self):
+        if self._file is None:
+            if not self._open():
+                return
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+
+        if stat is None or stat.st_ino != self._inode:
+            # Rotated: finish the old file through our handle, then start the new one
+            self._read()
+            if self._partial:
+                self._publish([self._partial])
+            self._close()
+            self.rotations += 1
+            if stat is None or not self._open():
+                return
+        elif stat.st_size < self._file.tell():
+            self.truncations += 1
+            self._file.seek(0)
+            self._partial = b""
+        self._read()
+
+    def _read(self):
+        while True:
+            data = self._file.read(READ_CHUNK_SIZE)
+            if not data:
+                return
+            lines = (self._partial + data).split(b"\n")
+            # The last piece is a line still being written
+            self._partial = lines.pop()
+            self._publish([line for line in lines if line])
+
+    def _publish(self, raw_lines):
+        if not raw_lines:
+            return
+        lines = [line.decode("utf-8", errors="replace") for line in raw_lines]
+        self._lines.inc(len(lines))
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription._push(lines)
+
+    def stats(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return {
+            "path": self.path,
+            "subscribers": len(subscribers),
+            "watching": self._thread is not None,
+            "rotations": self.rotations,
+            "truncations": self.truncations,
+            "dropped": sum(s.dropped_total for s in subscribers),
+        }
@@ -0,0 +1,144 @@
+"""
+In-process metrics for the API Gateway.
+
+Counters, gauges and latency summaries keyed by name and labels, served as
+JSON from /metrics. Values are per process; with several gunicorn workers
+each worker reports its own.
+"""
+
+import threading
+from collections import deque
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_name(name, key):
+    if not key:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in key) + "}"
+
+
+class Counter:
+    """Monotonically increasing count."""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        return self._value
+
+
+class Gauge:
+    """Value that can go up and down (queue depth, in-flight requests)."""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        return self._value
+
+
+class Summary:
+    """Count, sum, min and max of observations plus percentiles over a recent window."""
+
+    def __init__(self, window=1024):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+            self._recent.append(value)
+
+    def snapshot(self):
+        with self._lock:
+            values = sorted(self._recent)
+            count, total, low, high = self.count, self.total, self.min, self.max
+
+        def pct(p):
+            return round(values[min(int(len(values) * p), len(values) - 1)], 6) if values else None
+
+        return {
+            "count": count,
+            "sum": round(total, 6),
+            "avg": round(total / count, 6) if count else None,
+            "min": round(low, 6) if low is not None else None,
+            "max": round(high, 6) if high is not None else None,
+            "p50": pct(0.50),
+            "p90": pct(0.90),
+            "p99": pct(0.99)
+        }
+
+
+class MetricsRegistry:
+    """Get-or-create registry of metrics by name and labels."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name, labels):
+        key = (name, _label_key(labels))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = kind()
+                    self._metrics[key] = metric
+        return metric
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self._get(Gauge, name, labels)
+
+    def summary(self, name, **labels):
+        return self._get(Summary, name, labels)
+
+    def snapshot(self, prefix=None):
+        """Return {"name{label=value}": value-or-summary} for every metric (optionally filtered by prefix)."""
+        return {
+            _format_name(name, key): metric.snapshot()
+            for (name, key), metric in sorted(list(self._metrics.items()), key=lambda item: item[0])
+            if prefix is None or name.startswith(prefix)
+        }
+
+
+# Shared by every module in the process
+metrics = MetricsRegistry()
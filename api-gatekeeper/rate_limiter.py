@@ -0,0 +1,252 @@
+"""
+Per-API-key rate limiting shared across worker processes.
+
+Each key identity (user and service from the key's metadata) gets a token
+bucket for requests per second and a cap on concurrent requests (streams).
+State lives in a small SQLite database in WAL mode so every gunicorn worker
+on the host enforces the same budget. Limits can be set per key with a
+"rate_limit" object in the keys file: {"rps": 5, "burst": 10, "streams": 2}.
+
+Temporary (demo) keys all share one user and service, so they are limited
+per issuing client IP instead: each visitor gets their own budget, and
+minting more keys from the same address does not add to it.
+"""
+
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB", "/tmp/ai-gateway-ratelimit.db")
+
+# Defaults for permanent keys; 0 disables a limit
+RATE_LIMIT_RPS = float(os.environ.get("RATE_LIMIT_RPS", "10"))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "20"))
+RATE_LIMIT_MAX_STREAMS = int(os.environ.get("RATE_LIMIT_MAX_STREAMS", "8"))
+
+# Demo (temporary) keys share the GPU with everyone else, so they get less
+TEMP_KEY_RATE_LIMIT_RPS = float(os.environ.get("TEMP_KEY_RATE_LIMIT_RPS", "1"))
+TEMP_KEY_RATE_LIMIT_BURST = float(os.environ.get("TEMP_KEY_RATE_LIMIT_BURST", "5"))
+TEMP_KEY_RATE_LIMIT_MAX_STREAMS = int(os.environ.get("TEMP_KEY_RATE_LIMIT_MAX_STREAMS", "2"))
+
+# Stream leases older than this are assumed leaked by a crashed worker
+RATE_LIMIT_STREAM_TTL = float(os.environ.get("RATE_LIMIT_STREAM_TTL", "3600"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    identity TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS streams (
+    lease TEXT PRIMARY KEY,
+    identity TEXT NOT NULL,
+    started REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS streams_identity ON streams (identity);
+"""
+
+
+class RateLimits:
+    """Requests-per-second, burst and concurrent-stream limits for one identity."""
+
+    def __init__(self, rps, burst, streams):
+        self.rps = rps
+        self.burst = max(burst, 1)
+        self.streams = streams
+
+
+class RateDecision:
+    """Outcome of a rate-limit check, with the budget left for response headers."""
+
+    def __init__(self, allowed, limits, tokens, streams, reason=None, retry_after=None, lease=None):
+        self.allowed = allowed
+        self.limits = limits
+        self.tokens = tokens
+        self.streams = streams
+        self.reason = reason
+        self.retry_after = retry_after
+        self.lease = lease
+
+    def headers(self):
+        headers = {}
+        if self.limits.rps > 0:
+            headers["X-RateLimit-Limit"] = str(int(self.limits.burst))
+            headers["X-RateLimit-Remaining"] = str(max(int(self.tokens), 0))
+            refill = (self.limits.burst - self.tokens) / self.limits.rps
+            headers["X-RateLimit-Reset"] = str(max(math.ceil(refill), 0))
+        if self.limits.streams > 0:
+            headers["X-RateLimit-Streams-Limit"] = str(self.limits.streams)
+            headers["X-RateLimit-Streams-Remaining"] = str(max(self.limits.streams - self.streams, 0))
+        if self.retry_after is not None:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+def identity_for(key_info):
+    """Rate-limit identity of an API key: its user and service, or a temporary key's client IP."""
+    if key_info.get("is_temp") and key_info.get("client_ip"):
+        return f"temp:{key_info['client_ip']}"
+    return f"{key_info.get('user', 'unknown')}:{key_info.get('service', 'unknown')}"
+
+
+def limits_for(key_info):
+    """Limits for a key: its own "rate_limit" settings over the defaults for its kind."""
+    if key_info.get("is_temp"):
+        defaults = (TEMP_KEY_RATE_LIMIT_RPS, TEMP_KEY_RATE_LIMIT_BURST, TEMP_KEY_RATE_LIMIT_MAX_STREAMS)
+    else:
+        defaults = (RATE_LIMIT_RPS, RATE_LIMIT_BURST, RATE_LIMIT_MAX_STREAMS)
+    overrides = key_info.get("rate_limit") or {}
+    return RateLimits(
+        float(overrides.get("rps", defaults[0])),
+        float(overrides.get("burst", defaults[1])),
+        int(overrides.get("streams", defaults[2]))
+    )
+
+
+class RateLimiter:
+    """
+    Token-bucket and concurrent-stream limiter backed by a shared SQLite file.
+
+    acquire() takes one token and a stream lease in a single write
+    transaction; release() returns the lease once the response is done.
+    If the database cannot be used the limiter fails open.
+    """
+
+    def __init__(self, db_path=RATE_LIMIT_DB, enabled=RATE_LIMIT_ENABLED):
+        self.db_path = db_path
+        self.enabled = enabled
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _connection(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=1.0, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            if not self._schema_ready:
+                with self._schema_lock:
+                    db.executescript(SCHEMA)
+                    self._schema_ready = True
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def acquire(self, key_info):
+        """Check and consume budget for one request by key_info's identity."""
+        limits = limits_for(key_info)
+        if not self.enabled or (limits.rps <= 0 and limits.streams <= 0):
+            return RateDecision(True, limits, limits.burst, 0)
+
+        identity = identity_for(key_info)
+        started = time.perf_counter()
+        try:
+            decision = self._acquire(identity, limits)
+        except sqlite3.Error as e:
+            logger.error(f"Rate limit store unavailable, allowing request: {e}")
+            metrics.counter("ratelimit_store_errors_total").inc()
+            return RateDecision(True, limits, limits.burst, 0)
+        finally:
+            metrics.summary("ratelimit_check_seconds").observe(time.perf_counter() - started)
+
+        if not decision.allowed:
+            metrics.counter("ratelimit_rejections_total", reason=decision.reason).inc()
+        return decision
+
+    def _acquire(self, identity, limits):
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE identity = ?", (identity,)).fetchone()
+            if row is None or limits.rps <= 0:
+                tokens = limits.burst
+            else:
+                tokens = min(limits.burst, row[0] + max(now - row[1], 0) * limits.rps)
+
+            streams = 0
+            if limits.streams > 0:
+                db.execute("DELETE FROM streams WHERE identity = ? AND started < ?",
+                           (identity, now - RATE_LIMIT_STREAM_TTL))
+                streams = db.execute("SELECT COUNT(*) FROM streams WHERE identity = ?",
+                                     (identity,)).fetchone()[0]
+
+            if limits.rps > 0 and tokens < 1:
+                decision = RateDecision(False, limits, tokens, streams, reason="rate",
+                                        retry_after=max(math.ceil((1 - tokens) / limits.rps), 1))
+            elif limits.streams > 0 and streams >= limits.streams:
+                decision = RateDecision(False, limits, tokens, streams, reason="streams", retry_after=1)
+            else:
+                lease = None
+                if limits.rps > 0:
+                    tokens -= 1
+                if limits.streams > 0:
+                    lease = uuid.uuid4().hex
+                    db.execute("INSERT INTO streams (lease, identity, started) VALUES (?, ?, ?)",
+                               (lease, identity, now))
+                    streams += 1
+                decision = RateDecision(True, limits, tokens, streams, lease=lease)
+
+            if limits.rps > 0:
+                db.execute(
+                    "INSERT INTO buckets (identity, tokens, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT (identity) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                    (identity, tokens, now)
+                )
+        return decision
+
+    def release(self, decision):
+        """Return the stream lease taken by an allowed decision."""
+        if decision.lease is None:
+            return
+        try:
+            self._connection().execute("DELETE FROM streams WHERE lease = ?", (decision.lease,))
+        except sqlite3.Error as e:
+            logger.error(f"Could not release rate limit stream lease: {e}")
+
+    def stats(self, key_info):
+        """Current budget of key_info's identity without consuming any."""
+        limits = limits_for(key_info)
+        identity = identity_for(key_info)
+        stats = {
+            "identity": identity,
+            "enabled": self.enabled,
+            "rps": limits.rps,
+            "burst": limits.burst,
+            "max_streams": limits.streams
+        }
+        try:
+            db = self._connection()
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE identity = ?", (identity,)).fetchone()
+            streams = db.execute("SELECT COUNT(*) FROM streams WHERE identity = ?", (identity,)).fetchone()[0]
+        except sqlite3.Error as e:
+            stats["error"] = str(e)
+            return stats
+        tokens = limits.burst if row is None or limits.rps <= 0 else \
+            min(limits.burst, row[0] + max(time.time() - row[1], 0) * limits.rps)
+        stats["tokens"] = round(tokens, 2)
+        stats["streams"] = streams
+        return stats
+
+
+# Shared by every route in the process (and, through the database, every worker)
+rate_limiter = RateLimiter()
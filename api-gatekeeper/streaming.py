@@ -0,0 +1,149 @@
+"""
+Content-type-aware relaying of streamed upstream responses.
+
+Token streams (NDJSON, server-sent events) are flushed to the client one
+line at a time as soon as each line arrives; everything else is relayed in
+large reads for throughput. Routes can override the policy.
+"""
+
+import os
+import time
+
+from metrics import metrics
+
+STREAM_LINE_MAX_READ = int(os.environ.get("STREAM_LINE_MAX_READ", str(64 * 1024)))
+STREAM_BULK_CHUNK_SIZE = int(os.environ.get("STREAM_BULK_CHUNK_SIZE", str(256 * 1024)))
+
+LINE_CONTENT_TYPES = ('application/x-ndjson', 'text/event-stream')
+
+
+class StreamPolicy:
+    """How a response body is relayed: 'line' (flush per line) or 'bulk' (fixed-size reads)."""
+
+    def __init__(self, mode, chunk_size):
+        self.mode = mode
+        self.chunk_size = chunk_size
+
+    def __repr__(self):
+        return f"StreamPolicy({self.mode!r}, {self.chunk_size})"
+
+
+LINE_FLUSH = StreamPolicy('line', STREAM_LINE_MAX_READ)
+BULK = StreamPolicy('bulk', STREAM_BULK_CHUNK_SIZE)
+
+
+def policy_for(content_type, override=None):
+    """Pick the policy for a response: the route's override, else by content type."""
+    if override is not None:
+        return override
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    if media_type in LINE_CONTENT_TYPES:
+        return LINE_FLUSH
+    return BULK
+
+
+class LineBuffer:
+    """Split arbitrary byte chunks into complete lines (newline included)."""
+
+    def __init__(self):
+        self._partial = b''
+
+    def feed(self, data):
+        data = self._partial + data
+        lines = data.split(b'\n')
+        self._partial = lines.pop()
+        return [line + b'\n' for line in lines]
+
+    def flush(self):
+        rest, self._partial = self._partial, b''
+        return rest
+
+
+def iter_response(resp, policy):
+    """Yield a requests response body according to policy."""
+    if policy.mode == 'line':
+        lines = LineBuffer()
+        read1 = getattr(resp.raw, 'read1', None)
+        if read1 is not None:
+            # read1 returns as soon as any data is available instead of filling the buffer
+            chunks = iter(lambda: read1(policy.chunk_size, decode_content=True), b'')
+        else:
+            # urllib3 1.x has no read1; chunked bodies (token streams) still arrive chunk by chunk
+            chunks = resp.raw.stream(None, decode_content=True)
+        for data in chunks:
+            yield from lines.feed(data)
+        rest = lines.flush()
+        if rest:
+            yield rest
+    else:
+        yield from resp.iter_content(chunk_size=policy.chunk_size)
+
+
+async def aiter_response(upstream_response, policy):
+    """Yield an httpx response body according to policy."""
+    if policy.mode == 'line':
+        lines = LineBuffer()
+        async for data in upstream_response.aiter_bytes():
+            for line in lines.feed(data):
+                yield line
+        rest = lines.flush()
+        if rest:
+            yield rest
+    else:
+        async for data in upstream_response.aiter_bytes(chunk_size=policy.chunk_size):
+            yield data
+
+
+class StreamMeter:
+    """
+    Records time-to-first-byte and throughput of one relayed response.
+
+    started is when the upstream call was made; first_byte_at and
+    finished_at (perf_counter values) are filled in as the body is relayed,
+    so the request's audit event can report them once the response closes.
+    """
+
+    def __init__(self, route, policy, started, upstream=None):
+        self.route = route
+        self.mode = policy.mode
+        self.started = started
+        self.upstream = upstream
+        self.first_byte_at = None
+        self.finished_at = None
+        self.bytes = 0
+
+    def chunk(self, data):
+        if self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter()
+            metrics.summary("stream_ttfb_seconds", route=self.route, mode=self.mode).observe(
+                self.first_byte_at - self.started)
+        self.bytes += len(data)
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+        metrics.counter("stream_bytes_total", route=self.route, mode=self.mode).inc(self.bytes)
+        if self.first_byte_at is not None:
+            elapsed = time.perf_counter() - self.first_byte_at
+            if elapsed > 0 and self.bytes:
+                metrics.summary("stream_throughput_bytes_per_second", route=self.route,
+                                mode=self.mode).observe(self.bytes / elapsed)
+
+
+def metered(chunks, meter):
+    """Pass chunks through unchanged while feeding meter."""
+    try:
+        for chunk in chunks:
+            meter.chunk(chunk)
+            yield chunk
+    finally:
+        meter.finish()
+
+
+async def ametered(chunks, meter):
+    """Async counterpart of metered()."""
+    try:
+        async for chunk in chunks:
+            meter.chunk(chunk)
+            yield chunk
+    finally:
+        meter.finish()
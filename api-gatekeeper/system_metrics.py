@@ -0,0 +1,180 @@
+"""
+Background sampler of host and process metrics for the dashboard.
+
+A thread takes one sample every SYSTEM_METRICS_INTERVAL seconds: CPU,
+memory, disk usage and I/O, network throughput and this worker process's
+own CPU, memory, threads and file descriptors. It keeps the last
+SYSTEM_METRICS_HISTORY samples in a ring buffer, so /api/dashboard/stats
+returns the latest sample at once instead of blocking a worker in
+psutil.cpu_percent(interval=1). /api/dashboard/stats/history serves the
+buffer for sparklines.
+
+CPU percentages and I/O rates are measured between consecutive samples,
+so the very first sample has them as None.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import psutil
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_METRICS_INTERVAL = float(os.environ.get("SYSTEM_METRICS_INTERVAL", "5"))
+# An hour of history at the default interval
+SYSTEM_METRICS_HISTORY = int(os.environ.get("SYSTEM_METRICS_HISTORY", "720"))
+SYSTEM_METRICS_DISK_PATH = os.environ.get("SYSTEM_METRICS_DISK_PATH", "/")
+
+
+def _rate(current, previous, elapsed, field):
+    if current is None or previous is None or elapsed <= 0:
+        return None
+    return round(max(getattr(current, field) - getattr(previous, field), 0) / elapsed, 1)
+
+
+class SystemSampler:
+    """
+    Ring buffer of system samples filled by a background thread.
+
+    Args:
+        interval (float): Seconds between samples
+        history (int): Samples kept
+        disk_path (str): Filesystem whose usage is reported
+    """
+
+    def __init__(self, interval=SYSTEM_METRICS_INTERVAL, history=SYSTEM_METRICS_HISTORY,
+                 disk_path=SYSTEM_METRICS_DISK_PATH):
+        self.interval = interval
+        self.disk_path = disk_path
+        self._samples = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._process = None
+        self._previous = None  # (monotonic time, disk I/O counters, network counters)
+
+        self._cpu = metrics.gauge("system_cpu_percent")
+        self._memory = metrics.gauge("system_memory_percent")
+        self._duration = metrics.summary("system_sample_seconds")
+
+    def latest(self):
+        """Most recent sample; taken on the spot if the sampler has none yet."""
+        self._ensure_sampler()
+        with self._lock:
+            if self._samples:
+                return self._samples[-1]
+            return self._sample()
+
+    def history(self, since=None):
+        """Buffered samples, oldest first, optionally only those taken at or after epoch seconds since."""
+        self._ensure_sampler()
+        with self._lock:
+            samples = list(self._samples)
+        if since is not None:
+            samples = [sample for sample in samples if sample["ts"] >= since]
+        return samples
+
+    def _ensure_sampler(self):
+        # Started lazily so each forked worker runs its own
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="system-sampler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        # The first sample only primes the CPU and I/O counters, so the second follows soon after
+        interval = min(self.interval, 1.0)
+        while True:
+            started = time.monotonic()
+            try:
+                with self._lock:
+                    self._sample()
+            except Exception as e:
+                logger.error(f"System metrics sample failed: {e}")
+            time.sleep(max(interval - (time.monotonic() - started), 0))
+            interval = self.interval
+
+    def _sample(self):
+        # Called with the lock held; appends to the ring buffer and returns the sample
+        started = time.perf_counter()
+        process = self._process
+        if process is None or process.pid != os.getpid():
+            # psutil.Process caches per pid, so a forked worker needs its own
+            process = self._process = psutil.Process()
+            process.cpu_percent(None)
+            self._previous = None
+
+        now = time.monotonic()
+        first = self._previous is None
+        cpu_percent = psutil.cpu_percent(None)
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage(self.disk_path)
+        disk_io = psutil.disk_io_counters()
+        net_io = psutil.net_io_counters()
+        with process.oneshot():
+            process_memory = process.memory_info()
+            process_cpu = process.cpu_percent(None)
+            threads = process.num_threads()
+            try:
+                fds = process.num_fds()
+            except (AttributeError, psutil.Error):
+                fds = None
+        try:
+            load = [round(value, 2) for value in os.getloadavg()]
+        except (AttributeError, OSError):
+            load = None
+
+        previous_time, previous_disk, previous_net = self._previous or (now, None, None)
+        elapsed = now - previous_time
+        self._previous = (now, disk_io, net_io)
+
+        sample = {
+            "ts": time.time(),
+            "cpu_percent": None if first else cpu_percent,
+            "cpu_count": psutil.cpu_count(),
+            "load_average": load,
+            "memory_percent": memory.percent,
+            "memory_used": memory.used,
+            "memory_total": memory.total,
+            "disk_percent": disk.percent,
+            "disk_used": disk.used,
+            "disk_total": disk.total,
+            "disk_read_bytes_per_sec": _rate(disk_io, previous_disk, elapsed, "read_bytes"),
+            "disk_write_bytes_per_sec": _rate(disk_io, previous_disk, elapsed, "write_bytes"),
+            "net_sent_bytes_per_sec": _rate(net_io, previous_net, elapsed, "bytes_sent"),
+            "net_recv_bytes_per_sec": _rate(net_io, previous_net, elapsed, "bytes_recv"),
+            "process": {
+                "pid": process.pid,
+                "cpu_percent": None if first else process_cpu,
+                "memory_rss": process_memory.rss,
+                "threads": threads,
+                "open_fds": fds,
+            },
+        }
+        self._samples.append(sample)
+        if not first:
+            self._cpu.set(cpu_percent)
+        self._memory.set(memory.percent)
+        self._duration.observe(time.perf_counter() - started)
+        return sample
+
+    def stats(self):
+        with self._lock:
+            count = len(self._samples)
+        return {
+            "interval": self.interval,
+            "samples": count,
+            "capacity": self._samples.maxlen,
+            "sampling": self._thread is not None and self._thread.is_alive(),
+        }
+
+
+# Shared by every dashboard request in the process
+system_sampler = SystemSampler()
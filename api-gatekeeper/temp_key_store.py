@@ -0,0 +1,250 @@
+"""
+Storage for temporary (demo) API keys.
+
+Two backends share one interface:
+
+* "sqlite" (default): a local SQLite database in WAL mode, so a key issued
+  by one gunicorn worker is valid on every worker. Each worker keeps a
+  read-through cache of keys it has seen, so repeat validations are a dict
+  lookup.
+* "memory": a process-local dict, for single-worker runs and development.
+
+Expired keys are swept in expiry order from a min-heap (and, for SQLite, an
+indexed range delete), so memory stays bounded by the live keys instead of
+growing until someone presents an expired key. Each client IP may hold at
+most TEMP_KEY_MAX_PER_IP live keys.
+"""
+
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TEMP_KEY_STORE = os.environ.get("TEMP_KEY_STORE", "sqlite")
+TEMP_KEY_DB = os.environ.get("TEMP_KEY_DB", "/tmp/ai-gateway-tempkeys.db")
+TEMP_KEY_MAX_PER_IP = int(os.environ.get("TEMP_KEY_MAX_PER_IP", "5"))
+# How often the SQLite backend deletes expired rows (workers' local caches sweep on every call)
+TEMP_KEY_SWEEP_INTERVAL = float(os.environ.get("TEMP_KEY_SWEEP_INTERVAL", "60"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS temp_keys (
+    key TEXT PRIMARY KEY,
+    client_ip TEXT NOT NULL,
+    expires_at INTEGER NOT NULL,
+    info TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS temp_keys_expires_at ON temp_keys (expires_at);
+CREATE INDEX IF NOT EXISTS temp_keys_client_ip ON temp_keys (client_ip, expires_at);
+"""
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _expires_first(heap):
+    """Earliest expiry in heap without taking a lock, or None."""
+    try:
+        return heap[0][0]
+    except IndexError:
+        return None
+
+
+class TempKeyLimitExceeded(Exception):
+    """Raised when a client IP already holds the maximum number of live temporary keys."""
+
+
+class MemoryTempKeyStore:
+    """Process-local temporary keys with heap-ordered expiry and a per-IP cap."""
+
+    backend = "memory"
+
+    def __init__(self, max_per_ip=TEMP_KEY_MAX_PER_IP):
+        self.max_per_ip = max_per_ip
+        self._keys = {}  # key -> (client_ip, info)
+        self._expiry = []  # heap of (expires_at, key)
+        self._per_ip = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, info, client_ip):
+        """Store key with info (which must carry "expires_at" in ms since the epoch)."""
+        client_ip = client_ip or "unknown"
+        with self._lock:
+            self._sweep(_now_ms())
+            if self._per_ip.get(client_ip, 0) >= self.max_per_ip:
+                metrics.counter("temp_keys_rejected_total", reason="per_ip_limit").inc()
+                raise TempKeyLimitExceeded(client_ip)
+            self._keys[key] = (client_ip, info)
+            heapq.heappush(self._expiry, (info["expires_at"], key))
+            self._per_ip[client_ip] = self._per_ip.get(client_ip, 0) + 1
+        metrics.counter("temp_keys_issued_total").inc()
+
+    def get(self, key):
+        """Return key's info, or None. Expired keys may be returned until swept."""
+        entry = self._keys.get(key)
+        now = _now_ms()
+        first = _expires_first(self._expiry)
+        if first is not None and first < now:
+            with self._lock:
+                self._sweep(now)
+        return entry[1] if entry is not None else None
+
+    def _sweep(self, now):
+        # Called with the lock held; pops expired keys in expiry order
+        while self._expiry and self._expiry[0][0] < now:
+            _, key = heapq.heappop(self._expiry)
+            entry = self._keys.pop(key, None)
+            if entry is not None:
+                self._forget_ip(entry[0])
+                metrics.counter("temp_keys_expired_total").inc()
+
+    def _forget_ip(self, client_ip):
+        remaining = self._per_ip.get(client_ip, 1) - 1
+        if remaining > 0:
+            self._per_ip[client_ip] = remaining
+        else:
+            self._per_ip.pop(client_ip, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "active": len(self._keys),
+                "client_ips": len(self._per_ip),
+                "max_per_ip": self.max_per_ip
+            }
+
+
+class SqliteTempKeyStore:
+    """
+    Temporary keys shared across workers through a SQLite database.
+
+    Args:
+        db_path (str): Database file, shared by every worker on the host
+        max_per_ip (int): Live keys allowed per client IP
+        sweep_interval (float): Seconds between deletes of expired rows
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, db_path=TEMP_KEY_DB, max_per_ip=TEMP_KEY_MAX_PER_IP,
+                 sweep_interval=TEMP_KEY_SWEEP_INTERVAL):
+        self.db_path = db_path
+        self.max_per_ip = max_per_ip
+        self.sweep_interval = sweep_interval
+        self._local = threading.local()
+        self._schema_ready = False
+        self._lock = threading.Lock()
+        # Read-through cache of keys this worker has seen, expired from a heap
+        self._cache = {}
+        self._expiry = []
+        self._last_sweep = 0.0
+
+    def _connection(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=1.0, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            if not self._schema_ready:
+                with self._lock:
+                    db.executescript(SCHEMA)
+                    self._schema_ready = True
+            self._local.db = db
+        return db
+
+    def add(self, key, info, client_ip):
+        """Store key with info (which must carry "expires_at" in ms since the epoch)."""
+        client_ip = client_ip or "unknown"
+        now = _now_ms()
+        self._sweep(now)
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            live = db.execute("SELECT COUNT(*) FROM temp_keys WHERE client_ip = ? AND expires_at >= ?",
+                              (client_ip, now)).fetchone()[0]
+            if live >= self.max_per_ip:
+                db.execute("ROLLBACK")
+                metrics.counter("temp_keys_rejected_total", reason="per_ip_limit").inc()
+                raise TempKeyLimitExceeded(client_ip)
+            db.execute("INSERT INTO temp_keys (key, client_ip, expires_at, info) VALUES (?, ?, ?, ?)",
+                       (key, client_ip, info["expires_at"], json.dumps(info)))
+            db.execute("COMMIT")
+        except sqlite3.Error:
+            db.execute("ROLLBACK")
+            raise
+        self._remember(key, info)
+        metrics.counter("temp_keys_issued_total").inc()
+
+    def get(self, key):
+        """Return key's info, or None. Expired keys may be returned until swept."""
+        now = _now_ms()
+        first = _expires_first(self._expiry)
+        if first is not None and first < now:
+            self._sweep(now)
+        info = self._cache.get(key)
+        if info is not None:
+            return info
+
+        try:
+            row = self._connection().execute("SELECT info FROM temp_keys WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Temporary key store unavailable: {e}")
+            return None
+        if row is None:
+            return None
+        info = json.loads(row[0])
+        self._remember(key, info)
+        return info
+
+    def _remember(self, key, info):
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = info
+                heapq.heappush(self._expiry, (info["expires_at"], key))
+
+    def _sweep(self, now):
+        with self._lock:
+            while self._expiry and self._expiry[0][0] < now:
+                _, key = heapq.heappop(self._expiry)
+                self._cache.pop(key, None)
+            if time.monotonic() - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = time.monotonic()
+        try:
+            deleted = self._connection().execute("DELETE FROM temp_keys WHERE expires_at < ?", (now,)).rowcount
+            if deleted:
+                metrics.counter("temp_keys_expired_total").inc(deleted)
+        except sqlite3.Error as e:
+            logger.error(f"Could not sweep expired temporary keys: {e}")
+
+    def stats(self):
+        stats = {
+            "backend": self.backend,
+            "cached": len(self._cache),
+            "max_per_ip": self.max_per_ip
+        }
+        try:
+            row = self._connection().execute(
+                "SELECT COUNT(*), COUNT(DISTINCT client_ip) FROM temp_keys WHERE expires_at >= ?",
+                (_now_ms(),)).fetchone()
+            stats.update(active=row[0], client_ips=row[1])
+        except sqlite3.Error as e:
+            stats["error"] = str(e)
+        return stats
+
+
+def create_temp_key_store(backend=TEMP_KEY_STORE):
+    """Build the temporary key store selected by TEMP_KEY_STORE ("sqlite" or "memory")."""
+    if backend == "memory":
+        return MemoryTempKeyStore()
+    if backend != "sqlite":
+        logger.warning(f"Unknown TEMP_KEY_STORE {backend!r}, using sqlite")
+    return SqliteTempKeyStore()
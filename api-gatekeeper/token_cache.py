@@ -0,0 +1,74 @@
+"""
+Cache of verified bearer-token claims.
+
+Verifying a signed token (Firebase ID token, dashboard JWT) costs a
+signature check per request. VerifiedTokenCache keeps the claims of tokens
+that verified, keyed by the SHA-256 of the token and valid until the
+token's own exp, in a bounded LRU. Tokens that fail verification are never
+cached, so every rejection still goes through the verifier.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import metrics
+
+
+class VerifiedTokenCache:
+    """
+    LRU of verified token claims keyed by token hash and bounded by each token's exp.
+
+    Args:
+        name (str): Cache name, used as the metrics label
+        verify (callable): Verifies a token and returns its claims, raising if invalid
+        size (int): Maximum cached tokens
+        max_ttl (float): Longest time any token stays cached
+    """
+
+    def __init__(self, name, verify, size=1024, max_ttl=3600):
+        self.name = name
+        self._verify = verify
+        self.size = size
+        self.max_ttl = max_ttl
+        self._entries = OrderedDict()  # token digest -> (expires_at, claims)
+        self._lock = threading.Lock()
+        self._hits = metrics.counter("token_cache_hits_total", cache=name)
+        self._misses = metrics.counter("token_cache_misses_total", cache=name)
+
+    def verify(self, token):
+        """Return the verified claims for token (a copy), verifying only on a cache miss."""
+        digest = hashlib.sha256(token.encode('utf-8')).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(digest)
+                    self._hits.inc()
+                    return dict(entry[1])
+                del self._entries[digest]
+
+        self._misses.inc()
+        started = time.perf_counter()
+        claims = self._verify(token)
+        metrics.summary("token_verify_seconds", cache=self.name).observe(time.perf_counter() - started)
+
+        expires_at = min(float(claims.get('exp') or 0), now + self.max_ttl)
+        if expires_at > now:
+            with self._lock:
+                self._entries[digest] = (expires_at, dict(claims))
+                self._entries.move_to_end(digest)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return dict(claims)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached": len(self._entries),
+                "size": self.size,
+                "hits": self._hits.value,
+                "misses": self._misses.value
+            }
@@ -0,0 +1,230 @@
+"""
+Pooled upstream HTTP sessions for the gateway proxies.
+
+Every upstream origin (Ollama, Edge-TTS, Stable Diffusion, Whisper, the
+Next.js dashboard) gets its own keep-alive connection pool with its own pool
+size and timeouts, shared by all routes that talk to it.
+"""
+
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable per upstream with UPSTREAM_<NAME>_<SETTING>
+UPSTREAM_POOL_SIZE = int(os.environ.get("UPSTREAM_POOL_SIZE", "20"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", "120"))
+UPSTREAM_IDLE_TIMEOUT = float(os.environ.get("UPSTREAM_IDLE_TIMEOUT", "90"))
+UPSTREAM_REAPER_INTERVAL = float(os.environ.get("UPSTREAM_REAPER_INTERVAL", "15"))
+
+
+def _env_setting(name, setting, default, cast):
+    """Read UPSTREAM_<NAME>_<SETTING> from the environment, falling back to default."""
+    env_name = f"UPSTREAM_{name.upper().replace('-', '_')}_{setting}"
+    value = os.environ.get(env_name)
+    if value is None:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid {env_name}={value!r}")
+        return default
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class Upstream:
+    """A single upstream origin with its own keep-alive session and timeouts."""
+
+    def __init__(self, name, base_url, pool_size=None, connect_timeout=None,
+                 read_timeout=None, idle_timeout=None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.origin = _origin(self.base_url)
+        self.pool_size = _env_setting(name, "POOL_SIZE", pool_size or UPSTREAM_POOL_SIZE, int)
+        self.connect_timeout = _env_setting(
+            name, "CONNECT_TIMEOUT", connect_timeout or UPSTREAM_CONNECT_TIMEOUT, float)
+        self.read_timeout = _env_setting(
+            name, "READ_TIMEOUT", read_timeout or UPSTREAM_READ_TIMEOUT, float)
+        self.idle_timeout = _env_setting(
+            name, "IDLE_TIMEOUT", idle_timeout or UPSTREAM_IDLE_TIMEOUT, float)
+
+        self._lock = threading.Lock()
+        self._session = None
+        self.last_used = time.monotonic()
+        self.requests_total = 0
+        self.sessions_created = 0
+        self.idle_evictions = 0
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=False,
+            max_retries=0
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        self.sessions_created += 1
+        return session
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                self._session = self._new_session()
+            return self._session
+
+    def url(self, path=""):
+        """Build an absolute URL for a path on this upstream."""
+        if not path:
+            return self.base_url
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, url, timeout=None, background=False, **kwargs):
+        """
+        Send a request through this upstream's pooled session.
+
+        Args:
+            timeout: None for the upstream defaults, a number to override the
+                read timeout only, or a (connect, read) tuple.
+            background (bool): Housekeeping traffic (health probes, polling)
+                that does not count as use, so it cannot keep an otherwise
+                idle pool from being evicted.
+        """
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        elif not isinstance(timeout, tuple):
+            timeout = (self.connect_timeout, timeout)
+
+        session = self.session
+        if not background:
+            self.last_used = time.monotonic()
+        self.requests_total += 1
+        return session.request(method, url, timeout=timeout, **kwargs)
+
+    def _occupancy(self, session):
+        """Return (in_use, idle) connection counts across this session's urllib3 pools."""
+        in_use = idle = 0
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                queue = getattr(pool, "pool", None) if pool is not None else None
+                if queue is None:
+                    continue
+                slots = list(queue.queue)
+                idle += sum(1 for conn in slots if conn is not None)
+                in_use += max(queue.maxsize - len(slots), 0)
+        return in_use, idle
+
+    def evict_if_idle(self, now=None):
+        """Close the pooled connections if nothing has used them for idle_timeout seconds."""
+        now = now or time.monotonic()
+        with self._lock:
+            if self._session is None or now - self.last_used < self.idle_timeout:
+                return False
+            in_use, _ = self._occupancy(self._session)
+            if in_use:
+                return False
+            self._session.close()
+            self._session = None
+            self.idle_evictions += 1
+        logger.debug(f"Evicted idle connection pool for upstream {self.name}")
+        return True
+
+    def stats(self):
+        with self._lock:
+            in_use, idle = self._occupancy(self._session) if self._session else (0, 0)
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "pool_size": self.pool_size,
+            "in_use": in_use,
+            "idle": idle,
+            "requests_total": self.requests_total,
+            "sessions_created": self.sessions_created,
+            "idle_evictions": self.idle_evictions,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+            "timeouts": {
+                "connect": self.connect_timeout,
+                "read": self.read_timeout,
+                "idle": self.idle_timeout
+            }
+        }
+
+
+class UpstreamPoolManager:
+    """Registry of upstreams shared by all proxy routes."""
+
+    def __init__(self, reaper_interval=UPSTREAM_REAPER_INTERVAL):
+        self._upstreams = {}
+        self._by_origin = {}
+        self._lock = threading.Lock()
+        self._reaper_interval = reaper_interval
+        self._reaper = None
+
+    def register(self, name, base_url, **options):
+        """Register (or replace) a named upstream and return it."""
+        upstream = Upstream(name, base_url, **options)
+        with self._lock:
+            self._upstreams[name] = upstream
+            self._by_origin[upstream.origin] = upstream
+        return upstream
+
+    def get(self, name):
+        return self._upstreams[name]
+
+    def for_url(self, url):
+        """Return the upstream that owns url, registering an ad-hoc one for unknown origins."""
+        origin = _origin(url)
+        upstream = self._by_origin.get(origin)
+        if upstream is None:
+            upstream = self.register(urlsplit(url).netloc, origin)
+        return upstream
+
+    def request(self, method, url, **kwargs):
+        """Send a request through the pooled session for url's upstream."""
+        self._ensure_reaper()
+        return self.for_url(url).request(method, url, **kwargs)
+
+    def evict_idle(self):
+        now = time.monotonic()
+        return sum(1 for upstream in list(self._upstreams.values()) if upstream.evict_if_idle(now))
+
+    def stats(self):
+        return {name: upstream.stats() for name, upstream in list(self._upstreams.items())}
+
+    def _ensure_reaper(self):
+        # Started lazily so each gunicorn worker gets its own thread after fork
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+        with self._lock:
+            if self._reaper is not None and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reap_forever, name="upstream-pool-reaper",
+                                            daemon=True)
+            self._reaper.start()
+
+    def _reap_forever(self):
+        while True:
+            time.sleep(self._reaper_interval)
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logger.error(f"Upstream pool reaper failed: {e}")
+
+
+# Shared by every route in the process
+upstream_pool = UpstreamPoolManager()